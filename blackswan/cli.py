@@ -4,23 +4,22 @@ import argparse
 import logging
 
 from blackswan import config
+from blackswan import modules
+from blackswan.support import progressbar
 
 _log = logging.getLogger(__name__)
 
 def list_modules(args):
-    from blackswan import modules
-    for name,cls in config.modules.items():
-        print("{} {}".format(name.ljust(20, " "), cls.description))
+    for (name, info) in modules.available().items():
+        print("{} {}".format(name.ljust(20, " "), modules.description(info) or "({})".format(info.entrypoint)))
     pass
 
 def display_module(args):
-    from blackswan import modules
-    modcls = config.modules[args.module]
+    modcls = modules.load(args.module)
     print("{}\n{}\n\n{}".format(modcls.modname, len(modcls.modname)*"-",modcls.argparser.format_help()))
 
 def run_module(args):
-    __import__("blackswan.modules.{}".format(args.module))
-    modcls = config.modules[args.module]
+    modcls = modules.load(args.module)
     modinst = modcls()
     modinst.parse_args(args.modargs)
     modinst.run()
@@ -29,7 +28,12 @@ def list_metafiles(args):
     pass
 
 def list_indicators(args):
-    pass
+    from blackswan.core import database
+    from blackswan.support import sanity
+    sanity.assert_exists(args.db)
+    dbif = database.DbIf("sqlite:///{}".format(args.db))
+    for (path, score, count, descriptions) in dbif.indicator_scores(min_score=args.min_score, limit=args.limit, modulerun_id=args.run):
+        print("{:>6d} {:>3d} {}  ({})".format(score, count, path, descriptions))
 
 def db_info(args):
     pass
@@ -37,6 +41,7 @@ def db_info(args):
 def main():
     parser = argparse.ArgumentParser(description="Blackswan cli")
     parser.add_argument("--debug", "-d", help="Enable debug output")
+    parser.add_argument("--progress", "-p", choices=progressbar.MODES, default="auto", help="Progress as a bar, log lines, JSON lines on stdout or not at all. Default: auto, a bar on a terminal and log lines otherwise")
 
     subparsers = parser.add_subparsers(title="subcommands", description="valid subcommands", dest="cmd")
     sp_list_modules = subparsers.add_parser("list_modules", help="List all the available modules", aliases=["l"])
@@ -50,9 +55,17 @@ def main():
     sp_runmod.add_argument("module", help="The module to run")
     sp_runmod.add_argument("modargs", nargs="*", help="The module arguments. See help <modname>")
     sp_runmod.set_defaults(func=run_module)
+
+    sp_indicators = subparsers.add_parser("list_indicators", help="List the files with indicators by their total score", aliases=["i"])
+    sp_indicators.add_argument("--db", "-b", default=config.def_db, help="The blackswan db file. Default: {}".format(config.def_db))
+    sp_indicators.add_argument("--min-score", type=int, default=None, help="Only files with at least this total score")
+    sp_indicators.add_argument("--limit", "-n", type=int, default=50, help="Number of files listed, 0 for all. Default: 50")
+    sp_indicators.add_argument("--run", type=int, default=None, help="Only the indicators of this module run id")
+    sp_indicators.set_defaults(func=list_indicators)
     args = parser.parse_args()
     if args.debug:
         config.set_debug()
+    config.progress = args.progress
     if args.cmd:
         args.func(args)
 
@@ -5,6 +5,8 @@ import logging
 
 console = sys.stdout
 def_db = "blackswan.db"
+# progress output: auto, bar, log, json or none. See support.progressbar
+progress = "auto"
 
 modules = {}
 
@@ -1,17 +1,59 @@
 __author__ = 'ivo'
 
+import binascii
 import logging
 import os
 import os.path
+import contextlib
+import time
 
 import sqlalchemy as sqla
+import sqlalchemy.dialects.sqlite
 from sqlalchemy.ext import declarative
-from sqlalchemy import Date, Column,Integer, String, create_engine, Boolean, ForeignKey
+from sqlalchemy import Date, Column,Integer, String, create_engine, Boolean, ForeignKey, LargeBinary
 from sqlalchemy.orm import sessionmaker, scoped_session, relationship
 
+from blackswan.core import fuzzyindex
+
 _log = logging.getLogger(__name__)
 _Base = declarative.declarative_base()
 
+DEF_BATCH_SIZE = 5000
+# Trade durability for speed while ingesting: a crash loses at most the uncommitted batch.
+INGEST_PRAGMAS = ("PRAGMA journal_mode=WAL", "PRAGMA synchronous=OFF", "PRAGMA cache_size=-65536", "PRAGMA temp_store=MEMORY")
+POST_INGEST_PRAGMAS = ("PRAGMA synchronous=NORMAL",)
+HASH_COLUMNS = ("sha1", "md5", "sha256")
+# Columns of an explored file that describe its content and are stored once per distinct content.
+CONTENT_COLUMNS = HASH_COLUMNS + ("magic", "mimetype", "ssdeep")
+# Content columns a later writer may leave empty, e.g. magic skipped by extension or no ssdeep. Values stored for a
+# content fill in the ones it has empty, but never replace ones it has.
+FILLED_COLUMNS = ("magic", "mimetype", "ssdeep")
+# 1: digests and magic on every MetaFile. 2: normalized into Contents.
+SCHEMA_VERSION = 2
+# Stay below the bound parameter limit of older sqlite builds.
+MAX_IN_PARAMS = 500
+# Rows read per query when reading a table while writing to the same database.
+PAGE_SIZE = 10000
+# DbInfo kind of a certificate whitelist, see modules.build_certlist. Explored databases have no kind.
+KIND_CERTLIST = "certlist"
+
+def _raw(digest):
+    """
+    @return: the raw digest of a hex digest, raw digests and None pass unchanged
+    """
+    if isinstance(digest, str):
+        return binascii.unhexlify(digest) if digest else None
+    return digest
+
+def _hex(digest):
+    return digest.hex() if digest is not None else None
+
+def _fill(column, excluded):
+    """
+    @return: SQL expression that keeps the non-empty value of column and takes excluded otherwise
+    """
+    return "COALESCE(NULLIF({0}, ''), {1})".format(column, excluded)
+
 class DbIf():
     def __init__(self, connstr):
         self.connstr = connstr
@@ -23,12 +65,43 @@ class DbIf():
         _Base.metadata.create_all(self._engine, checkfirst=False)
         for k in dbinfos:
             self.Session.add(DbInfo(key=k, value=dbinfos[k]))
+        self.Session.add(DbInfo(key="schema_version", value=str(SCHEMA_VERSION)))
         self.Session.commit()
         _log.debug("Database (re)created at %s", self._engine)
         return True
 
     def get_db_info(self):
-        return {ci.key:ci.val for ci in self.Session.query(DbInfo)}
+        return {ci.key:ci.value for ci in self.Session.query(DbInfo)}
+
+    def kind(self):
+        """
+        @return: the kind recorded in the DbInfo of the database, None if it has none or no DbInfo at all
+        """
+        if not self.has_table(DbInfo.__tablename__):
+            return None
+        value = self.Session.query(DbInfo.value).filter(DbInfo.key == "kind").scalar()
+        self.Session.remove()
+        return value
+
+    def schema_version(self):
+        """
+        Databases from before the schema was versioned are recognized by their tables.
+        """
+        value = self.Session.query(DbInfo.value).filter(DbInfo.key == "schema_version").scalar()
+        self.Session.commit()
+        if value is not None:
+            return int(value)
+        return 2 if Content.__tablename__ in sqla.inspect(self._engine).get_table_names() else 1
+
+    def assert_schema(self):
+        """
+        @raise Exception: if the database does not have the current schema
+        """
+        version = self.schema_version()
+        if version != SCHEMA_VERSION:
+            _log.error("Database %s has schema version %d, expected %d", self._engine.url, version, SCHEMA_VERSION)
+            raise Exception("Outdated database schema, migrate the database with blackswan.utils.migrate_db")
+        return True
 
     def add_db_info(self, key, value, replace=False):
         dbinfos = self.Session.query(DbInfo).filter(DbInfo.key==key).all()
@@ -41,6 +114,578 @@ class DbIf():
         self.Session.commit()
         return True
 
+    @contextlib.contextmanager
+    def attached(self, dbpath, alias="refdb"):
+        """
+        Context manager. Yields a connection on which the sqlite database at dbpath is attached as alias.
+        """
+        conn = self._engine.connect()
+        try:
+            trans = conn.begin()
+            conn.execute(sqla.text("ATTACH DATABASE :path AS {}".format(alias)), {"path": dbpath})
+            trans.commit()
+            try:
+                yield conn
+            finally:
+                trans = conn.begin()
+                conn.execute(sqla.text("DETACH DATABASE {}".format(alias)))
+                trans.commit()
+        finally:
+            conn.close()
+
+    def exclude_by_refdb(self, refdbpath):
+        """
+        Mark every not yet excluded MetaFile excluded if any of its hashes occurs in the reference blackswan db.
+        Runs as set operations inside sqlite instead of one lookup per record: the Contents of both databases are
+        joined and the matching content ids are excluded.
+        @return: dict with the number of matches per hash column and the total number of records excluded
+        """
+        DbIf("sqlite:///{}".format(refdbpath)).assert_schema()
+        stats = {}
+        with self.attached(refdbpath, alias="refdb") as conn:
+            trans = conn.begin()
+            matches = []
+            for col in HASH_COLUMNS:
+                match = "{0} IN (SELECT {0} FROM refdb.Contents)".format(col)
+                stats[col] = conn.execute(sqla.text("SELECT count(*) FROM MetaFiles WHERE excluded = 0 AND content_id IN "
+                                                    "(SELECT id FROM Contents WHERE {})".format(match))).scalar()
+                _log.debug("%d records match on %s", stats[col], col)
+                matches.append(match)
+            res = conn.execute(sqla.text("UPDATE MetaFiles SET excluded = 1 WHERE excluded = 0 AND content_id IN "
+                                         "(SELECT id FROM Contents WHERE {})".format(" OR ".join(matches))))
+            stats["excluded"] = res.rowcount
+            trans.commit()
+        return stats
+
+    def included_digests(self, column="sha1", ordered=False):
+        """
+        Generator function. Streams the digests of the records that are not excluded, bypassing the ORM.
+        @param ordered: yield in order of the digest, which walks the digest index
+        @yield: (id, hexdigest)
+        """
+        table = MetaFile.__table__
+        contents = Content.__table__
+        query = sqla.select(table.c.id, contents.c[column]).select_from(table.join(contents)).where(table.c.excluded == False)
+        if ordered:
+            query = query.order_by(contents.c[column])
+        with self._engine.connect() as conn:
+            for row in conn.execute(query):
+                yield (row[0], _hex(row[1]))
+
+    def distinct_digests(self, column="sha1", hexdigest=True):
+        """
+        Generator function. Streams every distinct digest of a hash column in ascending order.
+        @yield: hexdigest, or raw digest if not hexdigest
+        """
+        contents = Content.__table__
+        query = sqla.select(contents.c[column]).distinct().order_by(contents.c[column])
+        with self._engine.connect() as conn:
+            for row in conn.execute(query):
+                yield _hex(row[0]) if hexdigest else row[0]
+
+    def digest_rows(self, column="sha1"):
+        """
+        Generator function. Streams the digest and path of every MetaFile in ascending order of the digest.
+        @yield: (hexdigest, path)
+        """
+        table = MetaFile.__table__
+        contents = Content.__table__
+        query = sqla.select(contents.c[column], table.c.path).select_from(table.join(contents)).order_by(contents.c[column])
+        with self._engine.connect() as conn:
+            for row in conn.execute(query):
+                if row[0]:
+                    yield (_hex(row[0]), row[1])
+
+    def update_ids(self, ids, batch_size=DEF_BATCH_SIZE, **values):
+        """
+        Set the given column values on the MetaFiles with the given ids with batched executemany updates.
+        @return: number of ids processed
+        """
+        table = MetaFile.__table__
+        stmt = table.update().where(table.c.id == sqla.bindparam("_id")).values(**values)
+        ids = list(ids)
+        with self._engine.connect() as conn:
+            for i in range(0, len(ids), batch_size):
+                trans = conn.begin()
+                conn.execute(stmt, [{"_id": mfid} for mfid in ids[i:i + batch_size]])
+                trans.commit()
+        return len(ids)
+
+    def exclude_ids(self, ids, batch_size=DEF_BATCH_SIZE):
+        return self.update_ids(ids, batch_size=batch_size, excluded=True)
+
+    def file_states(self):
+        """
+        The stored stat state of every MetaFile, used to detect changed files.
+        @return: dict of path to (id, size, lastmodified, inode, removed)
+        """
+        self.assert_schema()
+        table = MetaFile.__table__
+        query = sqla.select(table.c.path, table.c.id, table.c.size, table.c.lastmodified, table.c.inode, table.c.removed)
+        with self._engine.connect() as conn:
+            return {row[0]: tuple(row[1:]) for row in conn.execute(query)}
+
+    def merge_db(self, srcdbpath, source):
+        """
+        Copy all MetaFiles of another blackswan db into this one, tagged with source. Contents already present are
+        shared rather than copied, their empty FILLED_COLUMNS filled in from the other db.
+        @return: number of records copied
+        """
+        DbIf("sqlite:///{}".format(srcdbpath)).assert_schema()
+        columns = [col.name for col in MetaFile.__table__.columns if col.name not in ("id", "source", "content_id")]
+        contentcolumns = ", ".join(col.name for col in Content.__table__.columns if col.name != "id")
+        with self.attached(srcdbpath, alias="srcdb") as conn:
+            trans = conn.begin()
+            # the WHERE keeps sqlite from parsing ON CONFLICT as a join constraint
+            conn.execute(sqla.text("INSERT INTO Contents ({0}) SELECT {0} FROM srcdb.Contents WHERE true ON CONFLICT(sha256) DO UPDATE SET {1}"
+                                   .format(contentcolumns, ", ".join("{} = {}".format(col, _fill("Contents." + col, "excluded." + col)) for col in FILLED_COLUMNS))))
+            res = conn.execute(sqla.text("INSERT INTO MetaFiles ({0}, content_id, source) SELECT {1}, c.id, :source FROM srcdb.MetaFiles m "
+                                         "LEFT JOIN srcdb.Contents s ON s.id = m.content_id LEFT JOIN Contents c ON c.sha256 = s.sha256"
+                                         .format(", ".join(columns), ", ".join("m." + col for col in columns))), {"source": source})
+            trans.commit()
+        return res.rowcount
+
+    def prune_contents(self):
+        """
+        Delete the Contents no MetaFile refers to anymore, e.g. after files changed in an update, along with their
+        FuzzyGrams and Similarities. Content ids are reused, so these would otherwise attach to unrelated new Contents.
+        @return: number of Contents deleted
+        """
+        orphans = "SELECT id FROM Contents WHERE id NOT IN (SELECT content_id FROM MetaFiles WHERE content_id IS NOT NULL)"
+        with self._engine.connect() as conn:
+            trans = conn.begin()
+            for table in (FuzzyGram.__tablename__, Similarity.__tablename__):
+                if self.has_table(table):
+                    conn.execute(sqla.text("DELETE FROM {} WHERE content_id IN ({})".format(table, orphans)))
+            res = conn.execute(sqla.text("DELETE FROM Contents WHERE id IN ({})".format(orphans)))
+            trans.commit()
+        return res.rowcount
+
+    def fuzzy_hashes(self, included=True):
+        """
+        Generator function. Streams the ssdeep hashes of the Contents, page by page so the database can be written
+        while iterating.
+        @param included: only the Contents of MetaFiles that are not excluded
+        @yield: (content id, ssdeep hash)
+        """
+        contents = Content.__table__
+        metafiles = MetaFile.__table__
+        query = sqla.select(contents.c.id, contents.c.ssdeep).where(contents.c.ssdeep != None)
+        if included:
+            query = query.where(contents.c.id.in_(sqla.select(metafiles.c.content_id).where(metafiles.c.excluded == False)))
+        last = 0
+        while True:
+            with self._engine.connect() as conn:
+                rows = conn.execute(query.where(contents.c.id > last).order_by(contents.c.id).limit(PAGE_SIZE)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield (row[0], row[1])
+            last = rows[-1][0]
+
+    def has_table(self, name):
+        return name in sqla.inspect(self._engine).get_table_names()
+
+    def has_fuzzy_index(self):
+        if not self.has_table(FuzzyGram.__tablename__):
+            return False
+        with self._engine.connect() as conn:
+            return conn.execute(sqla.select(FuzzyGram.__table__.c.gram).limit(1)).first() is not None
+
+    def build_fuzzy_index(self, batch_size=DEF_BATCH_SIZE):
+        """
+        (Re)build the FuzzyGrams index of the ssdeep hashes of all Contents, see core.fuzzyindex.
+        @return: number of hashes indexed
+        """
+        table = FuzzyGram.__table__
+        table.create(self._engine, checkfirst=True)
+        with self._engine.connect() as conn:
+            trans = conn.begin()
+            conn.execute(table.delete())
+            trans.commit()
+        count = 0
+        with self.bulk_writer(table=table, batch_size=batch_size) as writer:
+            for (content_id, fuzzyhash) in self.fuzzy_hashes(included=False):
+                for (blocksize, gram) in fuzzyindex.grams(fuzzyhash):
+                    writer.add({"blocksize": blocksize, "gram": gram, "content_id": content_id})
+                count += 1
+        _log.debug("%d ssdeep hashes indexed in %d grams", count, writer.written)
+        return count
+
+    def fuzzy_candidates(self, refdbpath, queries, batch_size=1000):
+        """
+        Generator function. Look up the Contents of the reference db that share an index gram with the query hashes,
+        for a batch of queries at a time with a single join against the reference FuzzyGrams.
+        @param queries: iterable of (content id, ssdeep hash)
+        @yield: (content id, ssdeep hash, list of (ref content id, shared grams, ref ssdeep hash, ref sha256))
+        """
+        queries = iter(queries)
+        with self.attached(refdbpath, alias="refdb") as conn:
+            while True:
+                batch = [query for (i, query) in zip(range(batch_size), queries)]
+                if not batch:
+                    return
+                trans = conn.begin()
+                conn.execute(sqla.text("CREATE TEMP TABLE IF NOT EXISTS QueryGrams (content_id INTEGER, blocksize INTEGER, gram INTEGER)"))
+                conn.execute(sqla.text("DELETE FROM QueryGrams"))
+                rows = [{"content_id": content_id, "blocksize": blocksize, "gram": gram}
+                        for (content_id, fuzzyhash) in batch for (blocksize, gram) in fuzzyindex.grams(fuzzyhash)]
+                if rows:
+                    conn.execute(sqla.text("INSERT INTO QueryGrams VALUES (:content_id, :blocksize, :gram)"), rows)
+                candidates = {}
+                for row in conn.execute(sqla.text("SELECT q.content_id, g.content_id, count(*), r.ssdeep, r.sha256 FROM QueryGrams q "
+                                                  "JOIN refdb.FuzzyGrams g ON g.blocksize = q.blocksize AND g.gram = q.gram "
+                                                  "JOIN refdb.Contents r ON r.id = g.content_id GROUP BY q.content_id, g.content_id")):
+                    candidates.setdefault(row[0], []).append(tuple(row[1:]))
+                trans.commit()
+                for (content_id, fuzzyhash) in batch:
+                    yield (content_id, fuzzyhash, candidates.get(content_id, []))
+
+    def content_paths(self, content_ids):
+        """
+        @return: dict of content id to the path of one of its MetaFiles
+        """
+        table = MetaFile.__table__
+        query = sqla.select(table.c.content_id, sqla.func.min(table.c.path)).where(table.c.content_id.in_(list(content_ids))).group_by(table.c.content_id)
+        with self._engine.connect() as conn:
+            return dict(conn.execute(query).fetchall())
+
+    def create_tables(self, *tables):
+        """
+        Add tables that were introduced after the database was created.
+        """
+        for table in tables:
+            table.create(self._engine, checkfirst=True)
+
+    def create_apk_tables(self):
+        """
+        Add the APK inspection tables. Inspections from before signers were verified are dropped, so their APKs are
+        inspected again.
+        """
+        if self.has_table(ApkSigner.__tablename__) and "verified" not in [col["name"] for col in sqla.inspect(self._engine).get_columns(ApkSigner.__tablename__)]:
+            _log.info("Dropping APK inspections without signature verification from %s", self._engine.url)
+            for table in reversed(APK_TABLES):
+                table.drop(self._engine)
+        self.create_tables(*APK_TABLES)
+
+    def uninspected_apks(self, extensions):
+        """
+        @param extensions: lower case extensions, with dot, of the files to inspect
+        @return: list of (sha256 (raw), path of one of its files) of the contents of existing files with one of the
+        extensions that are not in ApkFiles yet
+        """
+        metafiles = MetaFile.__table__
+        contents = Content.__table__
+        query = sqla.select(contents.c.sha256, sqla.func.min(metafiles.c.path))\
+            .join_from(metafiles, contents, metafiles.c.content_id == contents.c.id)\
+            .where(metafiles.c.removed == False, sqla.func.lower(metafiles.c.extension).in_(list(extensions)),
+                   contents.c.sha256.not_in(sqla.select(ApkFile.__table__.c.sha256)))\
+            .group_by(contents.c.sha256)
+        with self._engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    @staticmethod
+    def _copy_apk_inspections(conn, src, dest, contents_only):
+        """
+        Copy the inspections from the attached database src that dest does not have yet, members and signers first so
+        an APK in ApkFiles is always complete.
+        @param contents_only: only inspections of APKs that are in the Contents of dest
+        @return: number of APKs copied
+        """
+        apks = "SELECT sha256 FROM {0}.ApkFiles WHERE sha256 NOT IN (SELECT sha256 FROM {1}.ApkFiles)".format(src, dest)
+        if contents_only:
+            apks += " AND sha256 IN (SELECT sha256 FROM {}.Contents)".format(dest)
+        for (table, key) in ((ApkMember.__table__, "apk_sha256"), (ApkSigner.__table__, "apk_sha256"), (ApkFile.__table__, "sha256")):
+            columns = ", ".join(col.name for col in table.columns if col.name != "id")
+            res = conn.execute(sqla.text("INSERT INTO {1}.{2} ({3}) SELECT {3} FROM {0}.{2} WHERE {4} IN ({5})".format(src, dest, table.name, columns, key, apks)))
+        return res.rowcount
+
+    def import_apk_inspections(self, cachepath):
+        """
+        Copy the inspections of the APKs in this database from a cache shared by several databases.
+        @return: number of APKs imported
+        """
+        DbIf("sqlite:///{}".format(cachepath)).create_apk_tables()
+        with self.attached(cachepath, alias="apkcache") as conn:
+            trans = conn.begin()
+            count = DbIf._copy_apk_inspections(conn, "apkcache", "main", contents_only=True)
+            trans.commit()
+        return count
+
+    def export_apk_inspections(self, cachepath):
+        """
+        Copy the inspections of this database that a shared cache does not have to the cache.
+        @return: number of APKs exported
+        """
+        DbIf("sqlite:///{}".format(cachepath)).create_apk_tables()
+        with self.attached(cachepath, alias="apkcache") as conn:
+            trans = conn.begin()
+            count = DbIf._copy_apk_inspections(conn, "main", "apkcache", contents_only=False)
+            trans.commit()
+        return count
+
+    def signer_certificates(self, min_apks=1):
+        """
+        @param min_apks: only certificates that signed at least this many distinct APKs
+        @return: list of (fingerprint (raw), subject, number of APKs) of the verified signers of the inspected APKs
+        """
+        signers = ApkSigner.__table__
+        apks = ApkFile.__table__
+        napks = sqla.func.count(sqla.distinct(signers.c.apk_sha256))
+        query = sqla.select(signers.c.fingerprint, sqla.func.min(signers.c.subject), napks)\
+            .join_from(signers, apks, signers.c.apk_sha256 == apks.c.sha256).where(apks.c.error == None, signers.c.verified == True)\
+            .group_by(signers.c.fingerprint).having(napks >= min_apks)
+        with self._engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def add_trusted_certs(self, certs):
+        """
+        Add certificates to the TrustedCerts of a certificate whitelist, replacing the vendor and source of known ones.
+        @param certs: list of dicts with the fingerprint (raw), vendor, subject and source
+        @return: number of certificates added or replaced
+        """
+        if not certs:
+            return 0
+        insert = sqla.dialects.sqlite.insert(TrustedCert.__table__)
+        upsert = insert.on_conflict_do_update(index_elements=["fingerprint"], set_={"vendor": insert.excluded.vendor, "source": insert.excluded.source})
+        with self._engine.connect() as conn:
+            trans = conn.begin()
+            conn.execute(upsert, certs)
+            trans.commit()
+        return len(certs)
+
+    def exclude_by_certs(self, certdbpath):
+        """
+        Mark every not yet excluded MetaFile excluded if it is an inspected APK or JAR that is signed, and signed
+        only by certificates in the TrustedCerts of the certificate whitelist whose signatures were verified, in one set
+        operation inside sqlite. APKs with any unverified signer, like an (EC)DSA one, are never excluded.
+        @return: dict with the number of records excluded and the number of them per vendor
+        """
+        trusted = ("SELECT a.sha256 FROM ApkFiles a WHERE a.error IS NULL "
+                   "AND EXISTS (SELECT 1 FROM ApkSigners s WHERE s.apk_sha256 = a.sha256) "
+                   "AND NOT EXISTS (SELECT 1 FROM ApkSigners s WHERE s.apk_sha256 = a.sha256 "
+                   "AND (s.verified IS NOT 1 OR s.fingerprint NOT IN (SELECT fingerprint FROM certdb.TrustedCerts)))")
+        stats = {}
+        with self.attached(certdbpath, alias="certdb") as conn:
+            trans = conn.begin()
+            stats["vendors"] = dict(conn.execute(sqla.text(
+                "SELECT t.vendor, count(DISTINCT m.id) FROM MetaFiles m JOIN Contents c ON c.id = m.content_id "
+                "JOIN ApkSigners s ON s.apk_sha256 = c.sha256 JOIN certdb.TrustedCerts t ON t.fingerprint = s.fingerprint "
+                "WHERE m.excluded = 0 AND c.sha256 IN ({}) GROUP BY t.vendor".format(trusted))).fetchall())
+            res = conn.execute(sqla.text("UPDATE MetaFiles SET excluded = 1 WHERE excluded = 0 AND content_id IN "
+                                         "(SELECT id FROM Contents WHERE sha256 IN ({}))".format(trusted)))
+            stats["excluded"] = res.rowcount
+            trans.commit()
+        return stats
+
+    def add_module_run(self, name, config):
+        """
+        @return: id of the new ModuleRun
+        """
+        run = ModuleRun(name=name, config=config)
+        self.Session.add(run)
+        self.Session.commit()
+        return run.id
+
+    def remove_module_runs(self, prefix):
+        """
+        Delete the ModuleRuns whose name starts with prefix and their Indicators.
+        @return: number of Indicators deleted
+        """
+        runs = sqla.select(ModuleRun.__table__.c.id).where(ModuleRun.__table__.c.name.startswith(prefix, autoescape=True))
+        with self._engine.connect() as conn:
+            trans = conn.begin()
+            res = conn.execute(Indicator.__table__.delete().where(Indicator.__table__.c.modulerun_id.in_(runs)))
+            conn.execute(ModuleRun.__table__.delete().where(ModuleRun.__table__.c.id.in_(runs)))
+            trans.commit()
+        return res.rowcount
+
+    def indicator_scores(self, min_score=None, limit=None, modulerun_id=None):
+        """
+        The files with Indicators, by their total score.
+        @return: list of (path, total score, number of Indicators, descriptions), highest score first
+        """
+        indicators = Indicator.__table__
+        metafiles = MetaFile.__table__
+        total = sqla.func.sum(indicators.c.score)
+        query = sqla.select(metafiles.c.path, total, sqla.func.count(indicators.c.id), sqla.func.group_concat(indicators.c.description, "; "))\
+            .join_from(indicators, metafiles, indicators.c.metafile_id == metafiles.c.id)\
+            .group_by(metafiles.c.id).order_by(total.desc(), metafiles.c.path)
+        if modulerun_id is not None:
+            query = query.where(indicators.c.modulerun_id == modulerun_id)
+        if min_score is not None:
+            query = query.having(total >= min_score)
+        if limit:
+            query = query.limit(limit)
+        with self._engine.connect() as conn:
+            return [tuple(row) for row in conn.execute(query)]
+
+    def bulk_writer(self, table=None, batch_size=DEF_BATCH_SIZE, metrics=None):
+        """
+        @param metrics: Metrics to report the time spent writing to
+        @return: a BulkWriter for table, or a MetaFileWriter if no table is given
+        """
+        if table is None:
+            return MetaFileWriter(self, batch_size=batch_size, metrics=metrics)
+        return BulkWriter(self, table=table, batch_size=batch_size, metrics=metrics)
+
+class BulkWriter():
+    """
+    Streams rows into a table with executemany inserts and updates, bypassing the ORM.
+    Rows are buffered up to batch_size and every batch is committed, so memory stays flat and an interrupted run
+    keeps everything up to the last batch. Inserted rows of one writer must all have the same keys, as must the
+    updated rows. DbInfo values set with checkpoint are committed in the same transaction as the next batch, so
+    they always describe what is in the database.
+    """
+    def __init__(self, dbif, table=None, batch_size=DEF_BATCH_SIZE, pragmas=INGEST_PRAGMAS, metrics=None):
+        self.table = table if table is not None else MetaFile.__table__
+        self.batch_size = batch_size
+        self.metrics = metrics
+        self.written = 0
+        self._rows = []
+        self._updates = []
+        self._infos = {}
+        self._conn = dbif._engine.connect()
+        trans = self._conn.begin()
+        for pragma in pragmas:
+            self._conn.execute(sqla.text(pragma))
+        trans.commit()
+        self._insert = self.table.insert()
+        self._update = self.table.update().where(self.table.c.id == sqla.bindparam("_id")) if "id" in self.table.c else None
+        self._info_update = DbInfo.__table__.update().where(DbInfo.__table__.c.key == sqla.bindparam("_key"))
+        _log.debug("Bulk writer opened on %s (batch size %d)", self.table.name, batch_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def add(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.batch_size:
+            self.flush()
+
+    def update(self, rowid, row):
+        """
+        Queue an update of the row with id rowid to the values in row.
+        """
+        self._updates.append(dict(row, _id=rowid))
+        if len(self._updates) >= self.batch_size:
+            self.flush()
+
+    def checkpoint(self, value, key="checkpoint"):
+        """
+        Set the existing DbInfo key to value with the next batch.
+        """
+        self._infos[key] = value
+
+    def flush(self):
+        if not (self._rows or self._updates or self._infos):
+            return
+        start = time.perf_counter()
+        trans = self._conn.begin()
+        if self._rows:
+            self._conn.execute(self._insert, self._prepare(self._rows))
+        if self._updates:
+            self._conn.execute(self._update, self._prepare(self._updates))
+        if self._infos:
+            self._conn.execute(self._info_update, [{"_key": key, "value": value} for (key, value) in self._infos.items()])
+        trans.commit()
+        if self.metrics is not None:
+            self.metrics.add_time("db_insert", time.perf_counter() - start)
+            self.metrics.count("db_rows", len(self._rows) + len(self._updates))
+        self.written += len(self._rows) + len(self._updates)
+        _log.debug("%d rows written to %s", self.written, self.table.name)
+        self._rows = []
+        self._updates = []
+        self._infos = {}
+
+    def _prepare(self, rows):
+        """
+        Hook for subclasses to transform a batch of rows inside the transaction that writes them.
+        """
+        return rows
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.flush()
+        trans = self._conn.begin()
+        for pragma in POST_INGEST_PRAGMAS:
+            self._conn.execute(sqla.text(pragma))
+        trans.commit()
+        self._conn.close()
+        self._conn = None
+
+class MetaFileWriter(BulkWriter):
+    """
+    BulkWriter for MetaFiles that takes explored file dicts, with hex digests, magic and mimetype, and stores the
+    content columns once per distinct sha256 in Contents. Every batch inserts its new Contents and looks up their
+    ids with a few set based statements, so no content index is kept in memory. Known Contents get their empty
+    FILLED_COLUMNS filled in.
+    """
+    def __init__(self, dbif, batch_size=DEF_BATCH_SIZE, pragmas=INGEST_PRAGMAS, metrics=None):
+        BulkWriter.__init__(self, dbif, table=MetaFile.__table__, batch_size=batch_size, pragmas=pragmas, metrics=metrics)
+        contents = Content.__table__
+        insert = sqla.dialects.sqlite.insert(contents)
+        self._content_insert = insert.on_conflict_do_update(index_elements=["sha256"], set_={
+            col: sqla.func.coalesce(sqla.func.nullif(contents.c[col], ""), insert.excluded[col]) for col in FILLED_COLUMNS})
+        self._content_ids = sqla.select(contents.c.sha256, contents.c.id).where(contents.c.sha256.in_(sqla.bindparam("digests", expanding=True)))
+
+    def _prepare(self, rows):
+        contents = {}
+        for row in rows:
+            sha256 = _raw(row.get("sha256"))
+            if sha256 is None:
+                continue
+            if sha256 not in contents:
+                content = {col: row.get(col) for col in CONTENT_COLUMNS}
+                content.update({col: _raw(row.get(col)) for col in HASH_COLUMNS}, size=row.get("size"))
+                contents[sha256] = content
+            else:
+                content = contents[sha256]
+                for col in FILLED_COLUMNS:
+                    if not content[col]:
+                        content[col] = row.get(col)
+        ids = {}
+        if contents:
+            self._conn.execute(self._content_insert, list(contents.values()))
+            digests = list(contents)
+            for i in range(0, len(digests), MAX_IN_PARAMS):
+                ids.update(self._conn.execute(self._content_ids, {"digests": digests[i:i + MAX_IN_PARAMS]}).fetchall())
+        prepared = []
+        for row in rows:
+            metafile = {key: value for (key, value) in row.items() if key not in CONTENT_COLUMNS}
+            metafile["content_id"] = ids.get(_raw(row.get("sha256")))
+            prepared.append(metafile)
+        return prepared
+
+class ApkWriter(BulkWriter):
+    """
+    BulkWriter for ApkFiles that takes inspection dicts with their lists of members and signers, as returned by
+    support.apk.inspect, and writes the members and signers in the same transaction as their APK.
+    """
+    def __init__(self, dbif, batch_size=DEF_BATCH_SIZE, pragmas=INGEST_PRAGMAS, metrics=None):
+        BulkWriter.__init__(self, dbif, table=ApkFile.__table__, batch_size=batch_size, pragmas=pragmas, metrics=metrics)
+        self._member_insert = ApkMember.__table__.insert()
+        self._signer_insert = ApkSigner.__table__.insert()
+
+    def _prepare(self, rows):
+        members = []
+        signers = []
+        prepared = []
+        for row in rows:
+            members.extend(dict(member, apk_sha256=row["sha256"]) for member in row["members"])
+            signers.extend(dict(signer, apk_sha256=row["sha256"]) for signer in row["signers"])
+            prepared.append({key: value for (key, value) in row.items() if key not in ("members", "signers")})
+        if members:
+            self._conn.execute(self._member_insert, members)
+        if signers:
+            self._conn.execute(self._signer_insert, signers)
+        return prepared
+
 class DbInfo(_Base):
     __tablename__= "DbInfo"
 
@@ -62,8 +707,8 @@ class Indicator(_Base):
     id = Column(Integer, primary_key=True)
     score = Column(Integer)
     description = Column(String(4096))
-    metafile_id = Column(Integer, ForeignKey("MetaFiles.id"))
-    modulerun_id = Column(Integer, ForeignKey("ModuleRuns.id"))
+    metafile_id = Column(Integer, ForeignKey("MetaFiles.id"), index=True)
+    modulerun_id = Column(Integer, ForeignKey("ModuleRuns.id"), index=True)
 
     modulerun = relationship("ModuleRun")
     metafile = relationship("MetaFile")
@@ -80,7 +725,7 @@ class ModuleRun(_Base):
     config = Column(String(4096), nullable=False)
 
     def __repr__(self):
-        return "<ModuleRun(id={:d}, fingerprint={})>".format(self.id, self.fingerprint)
+        return "<ModuleRun(id={:d}, name={})>".format(self.id, self.name)
 
 class MetaFile(_Base):
     __tablename__ = "MetaFiles"
@@ -96,13 +741,109 @@ class MetaFile(_Base):
     lastmodified = Column(sqla.DateTime)
     created = Column(sqla.DateTime)
     size = Column(Integer)
+    content_id = Column(Integer, ForeignKey("Contents.id"), index=True)
+    inode = Column(Integer)
+    source = Column(String(1024), index=True)
+    excluded = Column(Boolean, default=False)
+    removed = Column(Boolean, default=False)
+
+    content = relationship("Content")
+
+    def __repr__(self):
+        return "<MetaFile(id={:d}, path={}, content_id={})>".format(self.id, self.path, self.content_id)
+
+class Content(_Base):
+    __tablename__ = "Contents"
+
+    id = Column(Integer, primary_key=True)
+    sha256 = Column(LargeBinary(32), nullable=False, unique=True)
+    sha1 = Column(LargeBinary(20), nullable=False, index=True)
+    md5 = Column(LargeBinary(16), nullable=False, index=True)
+    size = Column(Integer)
     mimetype = Column(String(1024), index=True)
     magic = Column(String(4096))
-    md5 = Column(String(256), nullable=False, index=True)
-    sha1 = Column(String(256), nullable=False, index=True)
-    sha256 = Column(String(256), nullable=False, index=True)
     ssdeep = Column(String(256))
-    excluded = Column(Boolean, default=False)
 
     def __repr__(self):
-        return "<MetaFile(id={:d}, path={}, md5={})>".format(self.id, self.path, self.md5)
+        return "<Content(id={:d}, sha256={}, mimetype={})>".format(self.id, _hex(self.sha256), self.mimetype)
+
+class FuzzyGram(_Base):
+    __tablename__ = "FuzzyGrams"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    blocksize = Column(Integer, primary_key=True)
+    gram = Column(Integer, primary_key=True)
+    content_id = Column(Integer, ForeignKey("Contents.id"), primary_key=True)
+
+    def __repr__(self):
+        return "<FuzzyGram(blocksize={:d}, gram={:d}, content_id={:d})>".format(self.blocksize, self.gram, self.content_id)
+
+class Similarity(_Base):
+    __tablename__ = "Similarities"
+
+    id = Column(Integer, primary_key=True)
+    content_id = Column(Integer, ForeignKey("Contents.id"), index=True)
+    score = Column(Integer)
+    ref_sha256 = Column(LargeBinary(32))
+    ref_path = Column(String(1024))
+
+    content = relationship("Content")
+
+    def __repr__(self):
+        return "<Similarity(id={:d}, content_id={:d}, score={:d}, ref_path={})>".format(self.id, self.content_id, self.score, self.ref_path)
+
+class ApkFile(_Base):
+    __tablename__ = "ApkFiles"
+
+    sha256 = Column(LargeBinary(32), primary_key=True)
+    path = Column(String(1024))
+    member_count = Column(Integer)
+    schemes = Column(String(64))
+    error = Column(String(1024))
+    inspected = Column(sqla.DateTime)
+
+    def __repr__(self):
+        return "<ApkFile(sha256={}, path={}, schemes={})>".format(_hex(self.sha256), self.path, self.schemes)
+
+class ApkMember(_Base):
+    __tablename__ = "ApkMembers"
+
+    id = Column(Integer, primary_key=True)
+    apk_sha256 = Column(LargeBinary(32), ForeignKey("ApkFiles.sha256"), index=True)
+    name = Column(String(1024))
+    size = Column(Integer)
+    compressed_size = Column(Integer)
+    crc = Column(Integer)
+    sha1 = Column(LargeBinary(20))
+    md5 = Column(LargeBinary(16))
+    sha256 = Column(LargeBinary(32), index=True)
+
+    def __repr__(self):
+        return "<ApkMember(id={:d}, apk={}, name={})>".format(self.id, _hex(self.apk_sha256), self.name)
+
+class ApkSigner(_Base):
+    __tablename__ = "ApkSigners"
+
+    id = Column(Integer, primary_key=True)
+    apk_sha256 = Column(LargeBinary(32), ForeignKey("ApkFiles.sha256"), index=True)
+    scheme = Column(String(8))
+    fingerprint = Column(LargeBinary(32), index=True)
+    subject = Column(String(1024))
+    issuer = Column(String(1024))
+    verified = Column(Boolean, default=False)
+
+    def __repr__(self):
+        return "<ApkSigner(id={:d}, apk={}, fingerprint={}, subject={})>".format(self.id, _hex(self.apk_sha256), _hex(self.fingerprint), self.subject)
+
+class TrustedCert(_Base):
+    __tablename__ = "TrustedCerts"
+
+    fingerprint = Column(LargeBinary(32), primary_key=True)
+    vendor = Column(String(1024), index=True)
+    subject = Column(String(1024))
+    source = Column(String(1024))
+
+    def __repr__(self):
+        return "<TrustedCert(fingerprint={}, vendor={})>".format(_hex(self.fingerprint), self.vendor)
+
+APK_TABLES = (ApkFile.__table__, ApkMember.__table__, ApkSigner.__table__)
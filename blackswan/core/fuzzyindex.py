@@ -0,0 +1,50 @@
+__author__ = 'ivo'
+
+import logging
+import re
+
+_log = logging.getLogger(__name__)
+
+# ssdeep only scores signatures that share a substring of its rolling window length, so every match shares a gram.
+NGRAM = 7
+_B64 = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/"
+_B64_VALUES = {char: i for (i, char) in enumerate(_B64)}
+_RUNS = re.compile(r"(.)\1{3,}")
+
+def parse(fuzzyhash):
+    """
+    @return: (blocksize, signature, double blocksize signature) of an ssdeep hash
+    @raise ValueError: if it is not an ssdeep hash
+    """
+    (blocksize, sig1, sig2) = fuzzyhash.split(":", 2)
+    return (int(blocksize), sig1, sig2.split(",", 1)[0])
+
+def _normalize(signature):
+    # ssdeep compares signatures with runs of more than three equal characters shortened to three
+    return _RUNS.sub(lambda match: match.group(1) * 3, signature)
+
+def _gram_value(gram):
+    # 7 base64 characters are 42 bits, so the integer is exact
+    value = 0
+    for char in gram:
+        value = (value << 6) | _B64_VALUES.get(char, 0)
+    return value
+
+def grams(fuzzyhash):
+    """
+    The index keys of an ssdeep hash. The signature is keyed on the block size and the double block size
+    signature on twice the block size, so hashes that ssdeep can compare (equal or neighbouring block sizes) and
+    that share a gram get a common key.
+    @return: set of (blocksize, gram value)
+    """
+    try:
+        (blocksize, sig1, sig2) = parse(fuzzyhash)
+    except ValueError:
+        _log.warning("Invalid ssdeep hash %s", fuzzyhash)
+        return set()
+    keys = set()
+    for (size, signature) in ((blocksize, sig1), (blocksize * 2, sig2)):
+        signature = _normalize(signature)
+        for i in range(len(signature) - NGRAM + 1):
+            keys.add((size, _gram_value(signature[i:i + NGRAM])))
+    return keys
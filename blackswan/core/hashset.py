@@ -0,0 +1,162 @@
+__author__ = 'ivo'
+
+import binascii
+import logging
+import math
+import mmap
+import os
+import struct
+
+_log = logging.getLogger(__name__)
+
+MAGIC = b"BSHSET01"
+# magic, digest name, digest size, bloom hashes, count, array offset, bloom offset, bloom bits
+_HEADER = struct.Struct("<8s8sHH4xQQQQ")
+DIGEST_SIZES = {"md5": 16, "sha1": 20, "sha256": 32}
+DEF_BITS_PER_ENTRY = 10
+
+def is_hashset(path):
+    try:
+        with open(path, "rb") as ifh:
+            return ifh.read(len(MAGIC)) == MAGIC
+    except (IOError, OSError):
+        return False
+
+def _bloom_indexes(digest, nbits, nhashes):
+    # Digests are uniformly distributed already, so two words of the digest serve as the double hashing pair.
+    h1 = int.from_bytes(digest[0:8], "little")
+    h2 = int.from_bytes(digest[8:16], "little") | 1
+    return [(h1 + i * h2) % nbits for i in range(nhashes)]
+
+def write_hashset(path, digests, name="sha1", bits_per_entry=DEF_BITS_PER_ENTRY):
+    """
+    Write a hash set file from raw digests. The digests must come in ascending order; duplicates are dropped.
+    The sorted array is streamed to disk, the Bloom filter is built from it afterwards, so memory use is only the
+    Bloom filter itself.
+    @return: number of digests written
+    """
+    size = DIGEST_SIZES[name]
+    count = 0
+    prev = None
+    with open(path, "wb") as ofh:
+        ofh.write(_HEADER.pack(MAGIC, name.encode("ascii"), size, 0, 0, 0, 0, 0))
+        for digest in digests:
+            if len(digest) != size:
+                raise ValueError("Digest of {:d} bytes in a {} hash set".format(len(digest), name))
+            if prev is not None:
+                if digest == prev:
+                    continue
+                if digest < prev:
+                    raise ValueError("Digests are not sorted")
+            ofh.write(digest)
+            prev = digest
+            count += 1
+    nbits = max(64, count * bits_per_entry)
+    nbits += -nbits % 8
+    nhashes = max(1, round(bits_per_entry * math.log(2)))
+    bloom = bytearray(nbits // 8)
+    with open(path, "r+b") as fh:
+        if count:
+            with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for pos in range(_HEADER.size, _HEADER.size + count * size, size):
+                    for idx in _bloom_indexes(mm[pos:pos + size], nbits, nhashes):
+                        bloom[idx >> 3] |= 1 << (idx & 7)
+        fh.seek(0, os.SEEK_END)
+        fh.write(bloom)
+        fh.seek(0)
+        fh.write(_HEADER.pack(MAGIC, name.encode("ascii"), size, nhashes, count, _HEADER.size, _HEADER.size + count * size, nbits))
+    _log.info("Hash set %s written: %d %s digests, %d bytes", path, count, name, os.path.getsize(path))
+    return count
+
+class HashSet(object):
+    '''
+    Read only, memory mapped set of digests: a sorted array of fixed width raw digests with a Bloom filter in front.
+    Opening costs nothing but the mmap, negative lookups mostly stop at the Bloom filter and positive ones use an
+    interpolation search, which suits uniformly distributed digests.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self._fh = open(path, "rb")
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, name, self.digest_size, self.nhashes, self.count, self._array, self._bloom, self.nbits) = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise Exception("{} is not a hash set".format(path))
+        self.name = name.rstrip(b"\0").decode("ascii")
+        _log.debug("Hash set %s opened: %d %s digests", path, self.count, self.name)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, digest):
+        return self.contains(digest)
+
+    def _digest(self, i):
+        pos = self._array + i * self.digest_size
+        return self._mm[pos:pos + self.digest_size]
+
+    def maybe_contains(self, digest):
+        """
+        @return: False if digest is certainly not in the set
+        """
+        mm = self._mm
+        bloom = self._bloom
+        for idx in _bloom_indexes(digest, self.nbits, self.nhashes):
+            if not mm[bloom + (idx >> 3)] & (1 << (idx & 7)):
+                return False
+        return True
+
+    def contains(self, digest):
+        """
+        @param digest: raw digest, or hex digest as str
+        """
+        if isinstance(digest, str):
+            digest = binascii.unhexlify(digest)
+        if len(digest) != self.digest_size or not self.count or not self.maybe_contains(digest):
+            return False
+        # interpolation guess, then widen until the digest is bracketed and binary search the window
+        guess = min(self.count - 1, int.from_bytes(digest[:8], "big") * self.count >> 64)
+        step = 16
+        lo = max(0, guess - step)
+        while lo > 0 and self._digest(lo) > digest:
+            step *= 4
+            lo = max(0, guess - step)
+        step = 16
+        hi = min(self.count, guess + step)
+        while hi < self.count and self._digest(hi - 1) < digest:
+            step *= 4
+            hi = min(self.count, guess + step)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            cur = self._digest(mid)
+            if cur < digest:
+                lo = mid + 1
+            elif cur > digest:
+                hi = mid
+            else:
+                return True
+        return False
+
+    def matches(self, digests):
+        """
+        Generator function. Filter (id, hex digest) pairs to the ones in the set.
+        @yield: id
+        """
+        for (rowid, hexdigest) in digests:
+            try:
+                if self.contains(binascii.unhexlify(hexdigest)):
+                    yield rowid
+            except (binascii.Error, TypeError):
+                _log.warning("Invalid %s %s for record %s", self.name, hexdigest, rowid)
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self._digest(i)
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
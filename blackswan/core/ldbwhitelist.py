@@ -0,0 +1,62 @@
+__author__ = 'ivo'
+
+import binascii
+import logging
+
+from blackswan.core import hashset
+
+_log = logging.getLogger(__name__)
+
+# sha1 keys are the bare digest, as in the original whitelists; other digests are prefixed. The prefixes are chosen so
+# that no prefixed key is as long as a bare sha1 key, which tells the key types apart by length alone.
+KEY_PREFIXES = {"sha1": b"", "md5": b"md5sum:", "sha256": b"sha256:"}
+HEX_LENGTHS = {32: "md5", 40: "sha1", 64: "sha256"}
+
+def digest_type(hexdigest):
+    """
+    @return: the digest type of a hex digest, judged by its length
+    @raise ValueError: if the length matches no supported digest
+    """
+    try:
+        return HEX_LENGTHS[len(hexdigest)]
+    except KeyError:
+        raise ValueError("Unsupported digest length {:d}".format(len(hexdigest)))
+
+def ldb_key(hexdigest, name=None):
+    """
+    @return: the ldb key for a hex digest
+    @raise ValueError: for malformed digests (binascii.Error is a ValueError)
+    """
+    if name is None:
+        name = digest_type(hexdigest)
+    return KEY_PREFIXES[name] + binascii.unhexlify(hexdigest)
+
+def key_type(key):
+    """
+    @return: the digest type of an ldb key, None for keys that are no digest
+    """
+    for (name, prefix) in KEY_PREFIXES.items():
+        if key.startswith(prefix) and len(key) == len(prefix) + hashset.DIGEST_SIZES[name]:
+            return name
+    return None
+
+def merge_join(ldb, items):
+    """
+    Generator function. Match keys against the ldb with a single forward iterator that only seeks when it is behind,
+    so for sorted keys the ldb is read sequentially. Unsorted keys are still matched correctly, just slower.
+    @param items: iterable of (key, payload), preferably sorted by key
+    @yield: (payload, value) for every item whose key is in the ldb
+    """
+    it = ldb.iterator()
+    try:
+        cur = next(it, None)
+        prev = b""
+        for (key, payload) in items:
+            if key < prev or (cur is not None and cur[0] < key):
+                it.seek(key)
+                cur = next(it, None)
+            if cur is not None and cur[0] == key:
+                yield (payload, cur[1])
+            prev = key
+    finally:
+        it.close()
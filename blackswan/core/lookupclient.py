@@ -0,0 +1,86 @@
+__author__ = 'ivo'
+
+import logging
+import os
+import socket
+import stat
+
+_log = logging.getLogger(__name__)
+
+DEF_SOCKET = "/tmp/blackswan-lookupd.sock"
+DEF_WINDOW = 10000
+
+def is_service(path):
+    try:
+        return stat.S_ISSOCK(os.stat(path).st_mode)
+    except OSError:
+        return False
+
+class LookupClient(object):
+    '''
+    Client of the lookup daemon (blackswan.utils.lookupd).
+    The protocol is line based: one hex digest per request line, one response line per request, in order.
+    Requests are pipelined in windows, so a batch costs a few round trips instead of one per hash.
+    '''
+    def __init__(self, path=DEF_SOCKET, window=DEF_WINDOW):
+        self.path = path
+        self.window = window
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(path)
+        self._rfile = self._sock.makefile("rb")
+        _log.debug("Connected to lookup service %s", path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def lookup(self, hexdigests):
+        """
+        Generator function. Look up md5, sha1 or sha256 hex digests.
+        @yield: (hexdigest, value or None, error or None) in the order of hexdigests
+        """
+        window = []
+        for hexdigest in hexdigests:
+            window.append(hexdigest)
+            if len(window) >= self.window:
+                yield from self._roundtrip(window)
+                window = []
+        if window:
+            yield from self._roundtrip(window)
+
+    def _roundtrip(self, hexdigests):
+        self._sock.sendall("".join(hexdigest + "\n" for hexdigest in hexdigests).encode("ascii", errors="replace"))
+        for hexdigest in hexdigests:
+            line = self._rfile.readline()
+            if not line:
+                raise IOError("Lookup service {} closed the connection".format(self.path))
+            (status, _, rest) = line.rstrip(b"\n").partition(b" ")
+            if status == b"F":
+                # paths are stored with surrogateescape, this gives back the str they were built from
+                yield (hexdigest, str(rest, encoding="utf8", errors="surrogateescape"), None)
+            elif status == b"N":
+                yield (hexdigest, None, None)
+            else:
+                yield (hexdigest, None, str(rest, encoding="utf8", errors="replace"))
+
+    def matches(self, digests):
+        """
+        Generator function. Filter (id, hex digest) pairs to the ones known to the service.
+        @yield: id
+        """
+        digests = list(digests)
+        for ((rowid, _), (hexdigest, value, err)) in zip(digests, self.lookup(digest for (_, digest) in digests)):
+            if err:
+                _log.warning("Lookup of %s for record %s failed: %s", hexdigest, rowid, err)
+            elif value is not None:
+                _log.debug("Found a match: %s", value)
+                yield rowid
+
+    def close(self):
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
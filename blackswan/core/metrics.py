@@ -0,0 +1,149 @@
+__author__ = 'ivo'
+
+import cProfile
+import contextlib
+import io
+import logging
+import pstats
+import threading
+import time
+import tracemalloc
+
+_log = logging.getLogger(__name__)
+
+PROFILE_TOP = 25
+TRACEMALLOC_TOP = 10
+
+class Metrics(object):
+    '''
+    Timers, counters and gauges that a module reports into while it works. Thread safe, so worker threads report
+    into the same instance. Timers add up over threads, so with workers a stage can take longer than the run.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.timers = {}
+        self.gauges = {}
+
+    def start(self):
+        with self._lock:
+            self.started = time.time()
+            self.counters = {}
+            self.timers = {}
+            self.gauges = {}
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name, seconds, calls=1):
+        with self._lock:
+            (total, count) = self.timers.get(name, (0.0, 0))
+            self.timers[name] = (total + seconds, count + calls)
+
+    def gauge(self, name, value):
+        """
+        Record the current value of something that goes up and down, like a queue depth. The maximum is kept.
+        """
+        with self._lock:
+            (last, peak) = self.gauges.get(name, (value, value))
+            self.gauges[name] = (value, max(peak, value))
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        """
+        Generator function. Yield from iterable, timing how long producing every item takes.
+        """
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                self.add_time(name, time.perf_counter() - start)
+            yield item
+
+    def report(self):
+        """
+        @return: dict with the elapsed time and all timers, counters and gauges, as stored in DbInfo
+        """
+        with self._lock:
+            return {"elapsed": time.time() - self.started,
+                    "counters": dict(self.counters),
+                    "timers": {name: {"seconds": total, "calls": count} for (name, (total, count)) in self.timers.items()},
+                    "gauges": {name: {"last": last, "max": peak} for (name, (last, peak)) in self.gauges.items()}}
+
+    def summary(self):
+        """
+        @return: one line with the counters and their rates, the time per stage and the gauges
+        """
+        report = self.report()
+        elapsed = report["elapsed"] or float("nan")
+        fields = ["elapsed {:.0f}s".format(report["elapsed"])]
+        for (name, value) in sorted(report["counters"].items()):
+            if name.endswith("bytes"):
+                fields.append("{} {:d} MB ({:.1f} MB/s)".format(name, value // 1024 // 1024, value / 1024 / 1024 / elapsed))
+            else:
+                fields.append("{} {:d} ({:.0f}/s)".format(name, value, value / elapsed))
+        for (name, timer) in sorted(report["timers"].items(), key=lambda item: -item[1]["seconds"]):
+            fields.append("{} {:.1f}s".format(name, timer["seconds"]))
+        for (name, gauge) in sorted(report["gauges"].items()):
+            fields.append("{} {}/{}".format(name, gauge["last"], gauge["max"]))
+        return " | ".join(fields)
+
+class Reporter(object):
+    '''
+    Logs the summary of a Metrics instance every interval seconds from a daemon thread until stopped.
+    '''
+    def __init__(self, metrics, interval, name="metrics"):
+        self.metrics = metrics
+        self.interval = interval
+        self.name = name
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="blackswan-" + name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            _log.info("%s: %s", self.name, self.metrics.summary())
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def profile(func, path=None):
+    """
+    Call func under cProfile and tracemalloc and log where the time and memory went. Only the calling thread is
+    profiled, so profile with worker threads disabled to see the workers' share.
+    @param path: file to write the cProfile stats to, for use with python -m pstats
+    @return: what func returns
+    """
+    profiler = cProfile.Profile()
+    tracemalloc.start()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        (current, peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        if path:
+            profiler.dump_stats(path)
+            _log.info("Profile written to %s", path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        _log.info("Profile:\n%s", out.getvalue())
+        _log.info("Traced memory: %d KB current, %d KB peak", current // 1024, peak // 1024)
+        for stat in snapshot.statistics("lineno")[:TRACEMALLOC_TOP]:
+            _log.info("Allocated: %s", stat)
@@ -2,8 +2,13 @@ __author__ = 'ivo'
 
 import logging
 import argparse
+import json
+import os.path
+
+import sqlalchemy as sqla
 
 from blackswan import config
+from blackswan.core import metrics, database
 
 _log = logging.getLogger(__name__)
 
@@ -12,11 +17,14 @@ class ModuleBase():
 
     def __init__(self):
         self.config = {}
+        self.metrics = metrics.Metrics()
 
     @classmethod
     def register(cls):
         cls.argparser = argparse.ArgumentParser(description=cls.description, prog=cls.modname, add_help=False)
         cls.argparser.add_argument("-b", "--db", default=config.def_db, help="The blackswan db file. Default: {}".format(config.def_db))
+        cls.argparser.add_argument("--stats-interval", type=float, default=60, help="Seconds between metrics summary lines, 0 for none. Default: 60")
+        cls.argparser.add_argument("--profile", nargs="?", const="", default=None, metavar="FILE", help="Run under cProfile and tracemalloc and log the results, writing the cProfile stats to FILE if given")
         cls.add_args()
         config.modules[cls.modname] = cls
         _log.debug("Module %s registered", cls.modname)
@@ -38,9 +46,38 @@ class ModuleBase():
 
     def run(self):
         _log.info("Module %s started", self.modname)
-        self.work()
+        self.metrics.start()
+        interval = self.config.get("stats_interval")
+        reporter = metrics.Reporter(self.metrics, interval, name=self.modname) if interval else None
+        try:
+            if self.config.get("profile") is not None:
+                metrics.profile(self.work, self.config["profile"])
+            else:
+                self.work()
+        finally:
+            if reporter is not None:
+                reporter.stop()
+        _log.info("Metrics: %s", self.metrics.summary())
+        self.store_metrics()
         _log.info("Module %s finished", self.modname)
 
+    def store_metrics(self):
+        """
+        Store the metrics report of the run in the DbInfo of the module's database, if it has one.
+        """
+        dbpath = self.config.get("db")
+        if not dbpath or not os.path.isfile(dbpath):
+            return False
+        dbif = database.DbIf("sqlite:///{}".format(dbpath))
+        try:
+            dbif.add_db_info(key="metrics_" + self.modname, value=json.dumps(self.metrics.report()), replace=True)
+        except sqla.exc.SQLAlchemyError as err:
+            _log.warning("Could not store metrics in %s: %s", dbpath, err)
+            return False
+        finally:
+            dbif.Session.remove()
+        return True
+
     def configure(self, **kwargs):
         self.config.update(kwargs)
         _log.info("Module %s configured: \n%s", self.modname, repr(self.config))
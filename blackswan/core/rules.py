@@ -0,0 +1,195 @@
+__author__ = 'ivo'
+
+import re
+import json
+import stat
+import logging
+
+import sqlalchemy as sqla
+
+from blackswan.core.database import MetaFile, Content, Indicator, PAGE_SIZE
+
+_log = logging.getLogger(__name__)
+
+SCORES = {"high": Indicator.SCORE_HIGH, "med": Indicator.SCORE_MED, "low": Indicator.SCORE_LOW, "neg_high": Indicator.SCORE_NEG_HIGH}
+MODE_BITS = {"setuid": stat.S_ISUID, "setgid": stat.S_ISGID, "sticky": stat.S_ISVTX,
+             "world_writable": stat.S_IWOTH, "group_writable": stat.S_IWGRP, "world_readable": stat.S_IROTH,
+             "executable": stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH}
+# conditions that are evaluated in python, on batches of rows the sql conditions of the rule selected
+FALLBACK_CONDITIONS = {"path_regex": "path", "magic_regex": "magic"}
+
+# Scores files of an Android image. Paths are relative to the explored root, whitelisted means excluded by a filter.
+DEFAULT_RULES = [
+    {"name": "setuid", "description": "Setuid file not in the whitelist", "score": "high",
+     "match": {"mode_all": ["setuid"], "whitelisted": False}},
+    {"name": "setgid", "description": "Setgid file not in the whitelist", "score": "med",
+     "match": {"mode_all": ["setgid"], "whitelisted": False}},
+    {"name": "su", "description": "su binary", "score": "high",
+     "match": {"path": ["su", "*/su"]}},
+    {"name": "world_writable_system", "description": "World writable file on the system partition", "score": "med",
+     "match": {"path": ["system/*", "vendor/*"], "mode_all": ["world_writable"]}},
+    {"name": "unknown_elf", "description": "Unknown ELF binary outside the binary and library dirs", "score": "med",
+     "match": {"mimetype": ["application/x-executable", "application/x-sharedlib", "application/x-pie-executable"],
+               "path_not": ["system/bin/*", "system/xbin/*", "system/lib/*", "system/lib64/*", "vendor/bin/*", "vendor/lib/*", "vendor/lib64/*"],
+               "whitelisted": False}},
+    {"name": "executable_data", "description": "Executable file on the data partition", "score": "low",
+     "match": {"path": ["data/*"], "mode_any": ["executable"], "whitelisted": False}},
+    {"name": "unknown_apk", "description": "APK not in the whitelist", "score": "low",
+     "match": {"extension": [".apk", ".odex", ".dex", ".jar"], "whitelisted": False}},
+    {"name": "hidden", "description": "Hidden file not in the whitelist", "score": "low",
+     "match": {"path_regex": r"(^|/)\.[^/]+$", "whitelisted": False}},
+    {"name": "large_unknown", "description": "Large file not in the whitelist", "score": "low",
+     "match": {"size": {"min": 100 * 1024 * 1024}, "whitelisted": False}},
+]
+
+class RuleError(Exception):
+    pass
+
+def _list(value):
+    return value if isinstance(value, (list, tuple)) else [value]
+
+def _mode_mask(value):
+    mask = 0
+    for bits in _list(value):
+        if isinstance(bits, int):
+            mask |= bits
+        elif bits in MODE_BITS:
+            mask |= MODE_BITS[bits]
+        else:
+            try:
+                mask |= int(bits, 8)
+            except ValueError:
+                raise RuleError("Unknown mode bits {}".format(bits))
+    return mask
+
+class Rule(object):
+    '''
+    A declarative rule: a name, a score for every file it matches and the conditions a file must all meet.
+    Conditions on path globs, extension, mimetype, mode bits, uid, gid, size, source and whitelisting compile to sql;
+    regular expressions are evaluated in python on the rows the sql conditions select.
+    '''
+    def __init__(self, spec):
+        try:
+            self.name = spec["name"]
+            self.description = spec.get("description", self.name)
+            score = spec["score"]
+            self.score = SCORES[score] if isinstance(score, str) else int(score)
+            conditions = spec["match"]
+        except (KeyError, TypeError, ValueError) as err:
+            raise RuleError("Invalid rule {}: {}".format(spec, err))
+        self.where = []
+        self.filters = []
+        for (key, value) in conditions.items():
+            if key in FALLBACK_CONDITIONS:
+                try:
+                    self.filters.append((FALLBACK_CONDITIONS[key], re.compile(value)))
+                except re.error as err:
+                    raise RuleError("Invalid {} of rule {}: {}".format(key, self.name, err))
+            else:
+                self.where.append(Rule.condition(key, value))
+
+    @staticmethod
+    def condition(key, value):
+        """
+        @return: the sql expression of a condition over the MetaFiles and Contents tables
+        @raise RuleError: if the condition is unknown or has no sql equivalent
+        """
+        metafiles = MetaFile.__table__
+        contents = Content.__table__
+        if key == "path":
+            return sqla.or_(*[metafiles.c.path.op("GLOB")(glob) for glob in _list(value)])
+        elif key == "path_not":
+            return sqla.not_(sqla.or_(*[metafiles.c.path.op("GLOB")(glob) for glob in _list(value)]))
+        elif key == "extension":
+            return sqla.func.lower(metafiles.c.extension).in_([ext.lower() for ext in _list(value)])
+        elif key == "mimetype":
+            return sqla.or_(*[contents.c.mimetype.op("GLOB")(glob) for glob in _list(value)])
+        elif key == "mode_all":
+            mask = _mode_mask(value)
+            return metafiles.c.permissions.op("&")(mask) == mask
+        elif key == "mode_any":
+            return metafiles.c.permissions.op("&")(_mode_mask(value)) != 0
+        elif key in ("uid", "gid", "source"):
+            return metafiles.c[key].in_(_list(value))
+        elif key == "size":
+            bounds = value if isinstance(value, dict) else {"min": value}
+            exprs = []
+            if bounds.get("min") is not None:
+                exprs.append(metafiles.c.size >= bounds["min"])
+            if bounds.get("max") is not None:
+                exprs.append(metafiles.c.size <= bounds["max"])
+            return sqla.and_(*exprs)
+        elif key == "whitelisted":
+            return metafiles.c.excluded == bool(value)
+        raise RuleError("Unknown condition {}".format(key))
+
+    @property
+    def pushdown(self):
+        """
+        True if the whole rule runs inside sqlite.
+        """
+        return not self.filters
+
+    def select(self, *columns):
+        """
+        @return: select of the columns of the existing files that meet the sql conditions
+        """
+        metafiles = MetaFile.__table__
+        join = metafiles.outerjoin(Content.__table__, metafiles.c.content_id == Content.__table__.c.id)
+        return sqla.select(*columns).select_from(join).where(metafiles.c.removed == False, *self.where)
+
+    def filter_batch(self, rows):
+        """
+        Apply the python conditions to a batch of rows of (id, value of every filter column).
+        @return: list of the ids of the matching rows
+        """
+        ids = [row[0] for row in rows]
+        keep = [True] * len(rows)
+        for (i, (column, pattern)) in enumerate(self.filters):
+            search = pattern.search
+            keep = [k and value is not None and search(value) is not None for (k, value) in zip(keep, (row[i + 1] for row in rows))]
+        return [rowid for (rowid, k) in zip(ids, keep) if k]
+
+    def apply(self, conn, modulerun_id, batch_size=PAGE_SIZE):
+        """
+        Insert an Indicator for every file the rule matches, inside the caller's transaction. Rules without python
+        conditions are a single INSERT ... SELECT; others stream the candidates the sql conditions select in batches.
+        @return: number of Indicators inserted
+        """
+        indicators = Indicator.__table__
+        if self.pushdown:
+            select = self.select(sqla.literal(self.score), sqla.literal(self.description), MetaFile.__table__.c.id, sqla.literal(modulerun_id))
+            res = conn.execute(indicators.insert().from_select(["score", "description", "metafile_id", "modulerun_id"], select))
+            return res.rowcount
+        metafiles = MetaFile.__table__
+        columns = [metafiles.c.id] + [(metafiles.c[col] if col in metafiles.c else Content.__table__.c[col]) for (col, _) in self.filters]
+        query = self.select(*columns).order_by(metafiles.c.id).limit(batch_size)
+        insert = indicators.insert()
+        count = 0
+        last = 0
+        while True:
+            rows = conn.execute(query.where(metafiles.c.id > last)).fetchall()
+            if not rows:
+                return count
+            last = rows[-1][0]
+            ids = self.filter_batch(rows)
+            if ids:
+                conn.execute(insert, [{"score": self.score, "description": self.description, "metafile_id": rowid, "modulerun_id": modulerun_id} for rowid in ids])
+                count += len(ids)
+
+def load_rules(path=None):
+    """
+    @param path: json file with a list of rule specs, see DEFAULT_RULES. None for the default rules
+    @return: list of Rules
+    @raise RuleError: if a rule is invalid
+    """
+    if path is None:
+        specs = DEFAULT_RULES
+    else:
+        with open(path) as ifh:
+            specs = json.load(ifh)
+    rules = [Rule(spec) for spec in specs]
+    names = [rule.name for rule in rules]
+    if len(set(names)) != len(names):
+        raise RuleError("Duplicate rule names in {}".format(path))
+    return rules
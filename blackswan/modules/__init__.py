@@ -1,5 +1,105 @@
 __author__ = 'ivo'
 
-__all__ = ["explore", "hashfilter", "ldb_hashfilter"]
+import ast
+import collections
+import importlib
+import importlib.util
+import logging
 
-from . import *
\ No newline at end of file
+from blackswan import config
+
+_log = logging.getLogger(__name__)
+
+# Packages add modules by declaring entry points in this group, e.g.
+# entry_points={"blackswan.modules": ["mymod = mypackage.mymod:MyModule"]}
+ENTRY_POINT_GROUP = "blackswan.modules"
+
+ModuleInfo = collections.namedtuple("ModuleInfo", ("name", "entrypoint"))
+
+# Modules are only imported when run or their help is displayed, so listing them needs none of their dependencies.
+BUILTIN_MODULES = (
+    ModuleInfo("explore", "blackswan.modules.explore:Explore"),
+    ModuleInfo("hashfilter", "blackswan.modules.hashfilter:HashFilter"),
+    ModuleInfo("ldb_hashfilter", "blackswan.modules.ldb_hashfilter:LdbHashFilter"),
+    ModuleInfo("build_whitelist", "blackswan.modules.build_whitelist:BuildWhitelist"),
+    ModuleInfo("corpus", "blackswan.modules.corpus:Corpus"),
+    ModuleInfo("similar", "blackswan.modules.similar:Similar"),
+    ModuleInfo("inspect_apks", "blackswan.modules.inspect_apks:InspectApks"),
+    ModuleInfo("build_certlist", "blackswan.modules.build_certlist:BuildCertlist"),
+    ModuleInfo("score", "blackswan.modules.score:Score"),
+)
+
+__all__ = [info.entrypoint.split(":")[0].rsplit(".", 1)[1] for info in BUILTIN_MODULES]
+
+def _entry_points():
+    try:
+        from importlib import metadata
+    except ImportError:
+        return ()
+    eps = metadata.entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=ENTRY_POINT_GROUP)
+    return eps.get(ENTRY_POINT_GROUP, ())
+
+def available(plugins=True):
+    """
+    @param plugins: also look up the modules of installed packages, which scans the installed distributions
+    @return: ordered dict of module name to ModuleInfo
+    """
+    infos = collections.OrderedDict((info.name, info) for info in BUILTIN_MODULES)
+    if plugins:
+        for entrypoint in _entry_points():
+            if entrypoint.name in infos:
+                _log.warning("Module %s of %s ignored, the name is taken", entrypoint.name, entrypoint.value)
+                continue
+            infos[entrypoint.name] = ModuleInfo(entrypoint.name, entrypoint.value)
+    return infos
+
+def description(info):
+    """
+    The description of a module. The class attribute is read from the source of modules that are not imported yet, so
+    the module and its dependencies are not imported.
+    @return: the description, None if it is not set literally in the class or the source is not available
+    """
+    if info.name in config.modules:
+        return config.modules[info.name].description
+    (modpath, _, attr) = info.entrypoint.partition(":")
+    try:
+        spec = importlib.util.find_spec(modpath)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None or not spec.has_location or not spec.origin.endswith(".py"):
+        return None
+    try:
+        with open(spec.origin, "rb") as ifh:
+            tree = ast.parse(ifh.read(), spec.origin)
+    except (IOError, OSError, SyntaxError, ValueError) as err:
+        _log.debug("Could not read the description of %s: %s", info.entrypoint, err)
+        return None
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == attr:
+            for stmt in node.body:
+                if isinstance(stmt, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "description" for target in stmt.targets):
+                    try:
+                        return ast.literal_eval(stmt.value)
+                    except ValueError:
+                        return None
+    return None
+
+def load(name):
+    """
+    Import a module by name.
+    @return: the registered ModuleBase subclass
+    """
+    if name in config.modules:
+        return config.modules[name]
+    info = available(plugins=False).get(name) or available().get(name)
+    if info is None:
+        _log.error("No module %s, see list_modules", name)
+        raise Exception("Unknown module {}".format(name))
+    (modpath, _, attr) = info.entrypoint.partition(":")
+    modcls = getattr(importlib.import_module(modpath), attr)
+    if "argparser" not in vars(modcls) or modcls.argparser is None:
+        # plugins may leave registering to the loader
+        modcls.register()
+    return config.modules.get(name, modcls)
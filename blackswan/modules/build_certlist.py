@@ -0,0 +1,104 @@
+__author__ = 'ivo'
+
+import logging
+import os.path
+import re
+import shutil
+import datetime
+import tempfile
+
+from blackswan.core import modularity,database
+from blackswan import modules
+from blackswan.modules import inspect_apks
+from blackswan.support import sanity
+
+_log = logging.getLogger(__name__)
+
+DEF_MIN_APKS = 1
+_ORGANIZATION = re.compile(r"(?:^|, )O=([^,]+)")
+_COMMON_NAME = re.compile(r"(?:^|, )CN=([^,]+)")
+
+class BuildCertlist(modularity.ModuleBase):
+
+    description = "Build or extend a whitelist of trusted APK signing certificates from blackswan databases or dir trees"
+    modname = "build_certlist"
+
+    @staticmethod
+    def vendor_name(subject):
+        """
+        The vendor of a certificate: the organization of its subject, or else its common name.
+        """
+        for pattern in (_ORGANIZATION, _COMMON_NAME):
+            match = pattern.search(subject or "")
+            if match:
+                return match.group(1).strip()
+        return "unknown"
+
+    def source_dbs(self, tempdir):
+        """
+        Generator function. Resolve the sources to databases with inspected APKs, exploring dir trees into temporary
+        databases. APKs in databases are inspected if they were not before.
+        @yield: db path
+        """
+        for (i, source) in enumerate(self.config["sources"] or [self.config["db"]]):
+            source = os.path.abspath(source)
+            sanity.assert_exists(source)
+            if os.path.isdir(source):
+                dbpath = os.path.join(tempdir, "{:d}.db".format(i))
+                explorer = modules.load("explore")()
+                explorer.configure(rootpath=source, db=dbpath)
+                explorer.run()
+            else:
+                dbpath = source
+            yield inspect_apks.InspectApks.inspect_db(dbpath, cache=self.config.get("apk_cache"), workers=self.config.get("workers"))
+
+    def work(self):
+        certspath = os.path.abspath(self.config["certs"])
+        certdbIf = database.DbIf("sqlite:///{}".format(certspath))
+        certdbIf.create_tables(database.DbInfo.__table__, database.TrustedCert.__table__)
+        if "rootpath" in certdbIf.get_db_info():
+            _log.error("%s is a blackswan database, not a certificate whitelist", certspath)
+            raise Exception("Not a certificate whitelist")
+        certdbIf.add_db_info(key="kind", value=database.KIND_CERTLIST, replace=True)
+        certdbIf.add_db_info(key="updated", value=str(datetime.datetime.now()), replace=True)
+        certdbIf.Session.remove()
+        _log.info("Certificate whitelist: %s", certspath)
+        tempdir = tempfile.mkdtemp(prefix="blackswan_certlist_")
+        try:
+            for dbpath in self.source_dbs(tempdir):
+                dbif = database.DbIf("sqlite:///{}".format(dbpath))
+                dbif.assert_schema()
+                rootpath = dbif.get_db_info().get("rootpath")
+                dbif.Session.remove()
+                name = os.path.basename(rootpath.rstrip(os.sep)) if rootpath else os.path.basename(dbpath)
+                certs = [{"fingerprint": fingerprint, "subject": subject, "source": name,
+                          "vendor": self.config.get("vendor") or BuildCertlist.vendor_name(subject)}
+                         for (fingerprint, subject, napks) in dbif.signer_certificates(min_apks=self.config.get("min_apks", DEF_MIN_APKS))]
+                for cert in certs:
+                    _log.debug("Trusted: %s %s (%s)", cert["fingerprint"].hex(), cert["subject"], cert["vendor"])
+                _log.info("%d certificates of %s added", certdbIf.add_trusted_certs(certs), name)
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+        total = certdbIf.Session.query(database.TrustedCert).count()
+        certdbIf.Session.remove()
+        _log.info("%d trusted certificates in %s", total, certspath)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("sources", nargs="*", help="Blackswan databases or dir trees of reference images. Default: the --db database")
+        cls.argparser.add_argument("--certs", "-c", required=True, help="The certificate whitelist database, created if missing")
+        cls.argparser.add_argument("--vendor", help="Vendor name stored with the certificates. Default: the organization in the certificate subject")
+        cls.argparser.add_argument("--min-apks", type=int, default=DEF_MIN_APKS, help="Only trust certificates that signed at least this many APKs of a source. Default: {:d}".format(DEF_MIN_APKS))
+        cls.argparser.add_argument("--apk-cache", help="APK inspection cache, see inspect_apks. Default: no cache")
+        cls.argparser.add_argument("--workers", "-w", type=int, default=None, help="Worker processes inspecting APKs. Default: the number of CPUs")
+
+BuildCertlist.register()
+
+def main():
+    builder = BuildCertlist()
+    builder.parse_args()
+    builder.run()
+
+if __name__ == "__main__":
+    main()
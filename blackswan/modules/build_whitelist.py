@@ -0,0 +1,129 @@
+__author__ = 'ivo'
+
+import logging
+import os.path
+import heapq
+import binascii
+import shutil
+import tempfile
+
+from blackswan.core import modularity,database,ldbwhitelist
+from blackswan import modules
+from blackswan.support import sanity
+
+import plyvel
+
+_log = logging.getLogger(__name__)
+
+DEF_BATCH_SIZE = 100000
+
+class BuildWhitelist(modularity.ModuleBase):
+
+    description = "Build or extend a LevelDb whitelist from blackswan databases or dir trees"
+    modname = "build_whitelist"
+
+    @staticmethod
+    def source_name(dbif, dbpath):
+        """
+        The name stored with every digest of a source: the explored root, or else the database file name.
+        """
+        rootpath = dbif.get_db_info().get("rootpath")
+        dbif.Session.remove()
+        return os.path.basename(rootpath.rstrip(os.sep)) if rootpath else os.path.basename(dbpath)
+
+    @staticmethod
+    def keyed_rows(dbif, name, column):
+        """
+        Generator function. The ldb keys and values of one source for one digest type, in ascending key order.
+        @yield: (key, value)
+        """
+        prefix = name.encode("utf8") + b":"
+        for (hexdigest, path) in dbif.digest_rows(column):
+            try:
+                key = ldbwhitelist.ldb_key(hexdigest, column)
+            except binascii.Error:
+                _log.warning("Invalid %s %s for %s in %s", column, hexdigest, path, name)
+                continue
+            yield (key, prefix + path.encode("utf8", errors="surrogateescape"))
+
+    @staticmethod
+    def write_sorted(ldb, items, batch_size):
+        """
+        Write (key, value) items in ascending key order with write batches. Of duplicate keys the first is kept.
+        @return: number of keys written
+        """
+        count = 0
+        prev = None
+        batch = ldb.write_batch()
+        inbatch = 0
+        for (key, value) in items:
+            if key == prev:
+                continue
+            batch.put(key, value)
+            prev = key
+            inbatch += 1
+            if inbatch >= batch_size:
+                batch.write()
+                count += inbatch
+                batch = ldb.write_batch()
+                inbatch = 0
+        batch.write()
+        return count + inbatch
+
+    def source_dbs(self, tempdir):
+        """
+        Generator function. Resolve the sources to databases, exploring dir trees into temporary databases.
+        @yield: db path
+        """
+        for (i, source) in enumerate(self.config["sources"] or [self.config["db"]]):
+            source = os.path.abspath(source)
+            sanity.assert_exists(source)
+            if os.path.isdir(source):
+                tempdb = os.path.join(tempdir, "{:d}.db".format(i))
+                explorer = modules.load("explore")()
+                explorer.configure(rootpath=source, db=tempdb, workers=self.config.get("workers", 0))
+                explorer.run()
+                yield tempdb
+            else:
+                yield source
+
+    def work(self):
+        ldbpath = os.path.abspath(self.config["ldb"])
+        ldb = plyvel.DB(ldbpath, create_if_missing=True)
+        _log.info("Whitelist: %s", ldbpath)
+        tempdir = tempfile.mkdtemp(prefix="blackswan_whitelist_")
+        try:
+            sources = []
+            for dbpath in self.source_dbs(tempdir):
+                dbif = database.DbIf("sqlite:///{}".format(dbpath))
+                dbif.assert_schema()
+                sources.append((dbif, BuildWhitelist.source_name(dbif, dbpath)))
+                _log.info("Source: %s (%s)", dbpath, sources[-1][1])
+            # One pass per digest type. Every source streams in key order, so a heap merge yields all keys sorted
+            # while holding only one row per source.
+            for column in self.config["digests"]:
+                merged = heapq.merge(*[BuildWhitelist.keyed_rows(dbif, name, column) for (dbif, name) in sources])
+                count = BuildWhitelist.write_sorted(ldb, merged, self.config.get("batch_size", DEF_BATCH_SIZE))
+                _log.info("%d %s keys written", count, column)
+        finally:
+            ldb.close()
+            shutil.rmtree(tempdir, ignore_errors=True)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("sources", nargs="*", help="Blackswan databases or dir trees to add. Default: the --db database")
+        cls.argparser.add_argument("--ldb", "-l", required=True, help="The whitelist ldb database, created if missing")
+        cls.argparser.add_argument("--digests", type=lambda arg: [col for col in arg.split(",") if col], default=list(database.HASH_COLUMNS), help="Comma separated digest types to index. Default: {}".format(",".join(database.HASH_COLUMNS)))
+        cls.argparser.add_argument("--batch-size", type=int, default=DEF_BATCH_SIZE, help="Number of keys per write batch. Default: {:d}".format(DEF_BATCH_SIZE))
+        cls.argparser.add_argument("--workers", "-w", type=int, default=0, help="Worker threads when exploring dir tree sources. Default: 0")
+
+BuildWhitelist.register()
+
+def main():
+    builder = BuildWhitelist()
+    builder.parse_args()
+    builder.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+__author__ = 'ivo'
+
+import logging
+import os
+import os.path
+import datetime
+import shutil
+import tempfile
+import concurrent.futures
+
+import blackswan
+from blackswan.core import modularity,database
+from blackswan.modules import explore
+from blackswan.support import sanity, mounting, fsimage, progressbar, digestcache
+
+_log = logging.getLogger(__name__)
+
+def explore_item(name, path, tempdb, options):
+    """
+    Explore one corpus item into its own database. Runs in a worker process.
+    Images that fsimage can read are explored without mounting; other images are unpacked or mounted once.
+    @return: (name, tempdb)
+    """
+    explorer = explore.Explore()
+    explorer.configure(db=tempdb, source=name, **options)
+    if not os.path.isdir(path) and options.get("cache") and options.get("cache_key", "stat") == "stat":
+        # device and inode numbers of image files, mounts and unpacked trees are reused across images
+        _log.info("%s is explored without the digest cache, use --cache-key prehash to cache images", name)
+        explorer.configure(cache=None)
+    if os.path.isdir(path):
+        explorer.configure(rootpath=path)
+        explorer.run()
+        return (name, tempdb)
+    if fsimage.image_type(path):
+        explorer.configure(rootpath=path, image=True)
+        explorer.run()
+        return (name, tempdb)
+    workdir = tempfile.mkdtemp(prefix="blackswan_corpus_")
+    mountdir = None
+    try:
+        if mounting.is_yaffs_image(path):
+            rootpath = mounting.unpack_yaffs(path, workdir)
+        else:
+            rootpath = mountdir = mounting.mount_image(path, workdir)
+        explorer.configure(rootpath=rootpath)
+        explorer.run()
+    finally:
+        if mountdir is not None:
+            mounting.unmount_image(mountdir)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return (name, tempdb)
+
+class Corpus(modularity.ModuleBase):
+
+    description = "Explore a corpus of images and dir trees in parallel into one database"
+    modname = "corpus"
+
+    @staticmethod
+    def read_manifest(manifest):
+        """
+        Manifest lines hold a path, optionally preceded by a name and a tab. Empty lines and # comments are skipped.
+        @return: list of (name or None, path)
+        """
+        items = []
+        with open(manifest) as ifh:
+            for line in ifh:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                (name, _, path) = line.rpartition("\t")
+                items.append((name.strip() or None, path.strip()))
+        return items
+
+    def items(self):
+        """
+        @return: list of (unique name, absolute path)
+        """
+        items = [(None, path) for path in self.config.get("items", [])]
+        if self.config.get("manifest"):
+            items.extend(Corpus.read_manifest(self.config["manifest"]))
+        named = []
+        names = set()
+        for (name, path) in items:
+            path = os.path.abspath(path)
+            sanity.assert_exists(path)
+            base = name or os.path.basename(path.rstrip(os.sep))
+            name = base
+            i = 1
+            while name in names:
+                i += 1
+                name = "{}_{:d}".format(base, i)
+            names.add(name)
+            named.append((name, path))
+        return named
+
+    def open_db(self, dbpath):
+        dbif = database.DbIf("sqlite:///{}".format(dbpath))
+        if not os.path.isfile(dbpath):
+            dbif.init_db(dbinfos={"program_version": blackswan.__version__,
+                                  "dbpath": dbpath,
+                                  "created": str(datetime.datetime.now()),
+                                  "module": __file__})
+        else:
+            dbif.assert_schema()
+        return dbif
+
+    def work(self):
+        dbpath = os.path.abspath(self.config["db"])
+        dbif = self.open_db(dbpath)
+        done = {value.split("\t", 1)[0] for (key, value) in dbif.Session.query(database.DbInfo.key, database.DbInfo.value) if key == "source"}
+        dbif.Session.remove()
+        items = [(name, path) for (name, path) in self.items() if name not in done]
+        if len(done):
+            _log.info("%d sources already in %s", len(done), dbpath)
+        options = {"workers": self.config.get("workers", 0), "ssdeep": self.config.get("ssdeep", False)}
+        if self.config.get("cache"):
+            options.update(cache=os.path.abspath(self.config["cache"]), cache_key=self.config.get("cache_key", "stat"))
+        tempdir = tempfile.mkdtemp(prefix="blackswan_corpus_", dir=os.path.dirname(dbpath))
+        pbar = progressbar.Progressbar(len(items), "Exploring corpus...", unit="sources")
+        errcount = total = 0
+        try:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=self.config.get("processes") or None) as executor:
+                futures = {executor.submit(explore_item, name, path, os.path.join(tempdir, "{:d}.db".format(i)), options): (name, path)
+                           for (i, (name, path)) in enumerate(items)}
+                # Only this process writes the shared database, one finished source at a time.
+                for future in concurrent.futures.as_completed(futures):
+                    (name, path) = futures[future]
+                    try:
+                        (name, tempdb) = future.result()
+                    except Exception as exc:
+                        _log.error("Error exploring %s: %s (skipping)", path, exc)
+                        errcount += 1
+                    else:
+                        count = dbif.merge_db(tempdb, name)
+                        dbif.add_db_info(key="source", value="{}\t{}".format(name, path))
+                        dbif.Session.remove()
+                        os.remove(tempdb)
+                        total += count
+                        _log.info("%s: %d records", name, count)
+                    pbar.update(1)
+        finally:
+            shutil.rmtree(tempdir, ignore_errors=True)
+        pbar.finish()
+        distinct = dbif.Session.query(database.Content).count()
+        dbif.Session.remove()
+        _log.info("%d records from %d sources, %d distinct contents", total, len(items) - errcount, distinct)
+        _log.info("%d problematic sources encountered", errcount)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("items", nargs="*", help="Images and dir trees to explore")
+        cls.argparser.add_argument("--manifest", "-m", help="File listing the images and dir trees, one per line, optionally as name<TAB>path")
+        cls.argparser.add_argument("--processes", "-p", type=int, default=None, help="Number of sources explored in parallel. Default: number of cpus")
+        cls.argparser.add_argument("--workers", "-w", type=int, default=0, help="Worker threads per source. Default: 0")
+        cls.argparser.add_argument("--cache", help="Digest cache shared by all sources and runs. Default: no cache")
+        cls.argparser.add_argument("--cache-key", choices=digestcache.KEY_MODES, default="stat", help="Cache on device/inode/size/mtime (stat), which only applies to dir tree sources, or on size and crc of first and last block (prehash), which also finds identical content across sources and whose hits are confirmed with a sha256 of the file. Default: stat")
+        cls.argparser.add_argument("--ssdeep", action="store_true", help="Also compute ssdeep fuzzy hashes")
+
+Corpus.register()
+
+def main():
+    corpus = Corpus()
+    corpus.parse_args()
+    corpus.run()
+
+if __name__ == "__main__":
+    main()
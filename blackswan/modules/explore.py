@@ -3,76 +3,341 @@ import logging
 import os
 import datetime
 import stat
-import hashlib
+import threading
+import collections
+import concurrent.futures
 
 import magic
 
 import blackswan
-from blackswan.support import progressbar
+from blackswan.support import progressbar, hashing, digestcache, fsimage
 from blackswan.core import modularity
 from blackswan.core import database
 from blackswan import config
 
 _log = logging.getLogger(__name__)
+_local = threading.local()
+
+WINDOW_PER_WORKER = 16
+# libmagic itself never looks beyond the first MB of a file
+MAGIC_HEAD_SIZE = 1024 * 1024
+
+def _to_str(magicres):
+    """
+    python-magic returns bytes in older and str in newer versions.
+    """
+    if not magicres:
+        return ""
+    if isinstance(magicres, bytes):
+        return str(magicres, "utf-8", errors="replace")
+    return magicres
+
+def _extensions(arg):
+    return tuple(ext.strip().lower() if ext.strip().startswith(".") else "." + ext.strip().lower() for ext in arg.split(",") if ext.strip())
+
+def imap_ordered(executor, func, iterable, window, metrics=None):
+    """
+    Generator function. Like executor.map, but keeps at most window calls in flight so the input is consumed lazily.
+    @param metrics: Metrics to report the number of calls in flight and of results waiting to be consumed to
+    @yield: results of func in the order of iterable
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            if metrics is not None:
+                metrics.gauge("queue_depth", len(pending))
+                metrics.gauge("queue_ready", sum(1 for future in pending if future.done()))
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
 
 class Explore(modularity.ModuleBase):
     description = "Explore filesystem and store file metadata in sqlite database file."
     modname = "explore"
 
+    UNCHANGED = "unchanged"
+
+    def __init__(self):
+        super().__init__()
+        self._known = {}
+        self._cache = None
+        self._image = None
+        self._resume_after = None
+
     @staticmethod
-    def hash_file(fp, hexdigest=True):
-        if isinstance(fp, str):
-            fp = open(fp, "br")
-        BUF_SIZE = 4096
-        hasher_sha1 = hashlib.sha1()
-        hasher_md5 = hashlib.md5()
-        hasher_sha256 = hashlib.sha256()
-        while True:
-            chunk = fp.read(BUF_SIZE)
-            if not chunk:
-                break
-            hasher_sha1.update(chunk)
-            hasher_md5.update(chunk)
-            hasher_sha256.update(chunk)
-        if hexdigest:
-            return hasher_sha1.hexdigest(), hasher_md5.hexdigest(), hasher_sha256.hexdigest()
-        else:
-            return hasher_sha1.digest(), hasher_md5.digest(), hasher_sha256.digest()
+    def hash_file(fp, hexdigest=True, bufsize=None):
+        """
+        Hash a file object or path in a single pass.
+        @return: (sha1, md5, sha256)
+        """
+        return hashing.hash_file(fp, digests=("sha1", "md5", "sha256"), hexdigest=hexdigest, bufsize=bufsize)
 
     @staticmethod
-    def files(rootdir):
+    def path_key(relpath):
         """
-        Generator function. Traverse filesystem from rootdir.
-        Does not yield symbolic links and does not follow symlinks to dirs (due to os.walk functionality).
-        @yield: absolute filepath
+        @return: sort key of a relative path in the order files() yields them
+        """
+        return tuple(relpath.split(os.sep))
+
+    @staticmethod
+    def files(rootdir, after=None):
+        """
+        Generator function. Traverse filesystem from rootdir in a single os.scandir pass, depth first with the entries
+        of every dir sorted by name, so files come in ascending path_key order and in the same order on every run.
+        Yields symbolic links to files but does not follow symlinks to dirs.
+        @param after: relative path. Only files after it are yielded, dirs entirely before it are not even listed
+        @yield: (relative filepath, absolute filepath, lstat result or None if it could not be retrieved)
         """
         if not os.path.exists(rootdir):
             _log.error("Dir %s does not exist", rootdir)
             raise Exception("Dir {} does not exist", rootdir)
-        for (root, dirs, files) in os.walk(rootdir, followlinks=False):
-            for fn in files:
-                yield (os.path.relpath(os.path.join(root, fn), rootdir), os.path.join(root, fn))
+        afterkey = Explore.path_key(after) if after else None
+        stack = [(rootdir, (), None)]
+        while stack:
+            (path, key, entry) = stack.pop()
+            if entry is not None:
+                try:
+                    sinfo = entry.stat(follow_symlinks=False)
+                except OSError:
+                    sinfo = None
+                yield (os.sep.join(key), path, sinfo)
+                continue
+            try:
+                with os.scandir(path) as entries:
+                    entries = sorted(entries, key=lambda entry: entry.name)
+            except OSError as err:
+                _log.warning("Could not list %s: %s", path, err)
+                continue
+            for entry in reversed(entries):
+                entrykey = key + (entry.name,)
+                isdir = Explore._is_dir(entry)
+                if isdir and entry.is_symlink():
+                    continue
+                if afterkey is not None and entrykey <= afterkey and not (isdir and afterkey[:len(entrykey)] == entrykey):
+                    continue
+                stack.append((entry.path, entrykey, None if isdir else entry))
+
+    @staticmethod
+    def _is_dir(entry):
+        try:
+            return entry.is_dir()
+        except OSError:
+            return False
 
     @staticmethod
-    def get_dirtree_size(rootdir):
-        """ Get total dir tree size.
-        @return: (total files, total bytes, skipped)
+    def count_files(rootdir):
+        """
+        Count the files below rootdir the way files() yields them. Only reads the directories, no file is stat'ed.
+        @return: total files
         """
-        total_size = 0
         total_files = 0
-        skipped = 0
-        for (root, dirs, files) in os.walk(rootdir, followlinks=False):
-            total_files += len(files)
-            for fl in files:
-                try:
-                    total_size += os.lstat(os.path.join(root, fl)).st_size
-                except OSError:
-                    skipped += 1
-        return (total_files, total_size, skipped)
+        stack = [rootdir]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as entries:
+                    for entry in entries:
+                        if not Explore._is_dir(entry):
+                            total_files += 1
+                        elif not entry.is_symlink():
+                            stack.append(entry.path)
+            except OSError:
+                pass
+        return total_files
 
+    @staticmethod
+    def _magic_handles():
+        """
+        libmagic handles are not thread safe, so every thread gets its own pair.
+        @return: (magic handle, mime handle)
+        """
+        if not hasattr(_local, "magic"):
+            _local.magic = magic.Magic(mime=False)
+            _local.mime = magic.Magic(mime=True)
+        return (_local.magic, _local.mime)
 
-    def work(self):
-        fsdb = self.config["db"]
+    @staticmethod
+    def file_state(sinfo):
+        """
+        The part of the stat info that is compared to decide whether a file changed since the last run.
+        @return: (size, lastmodified, inode)
+        """
+        return (sinfo.st_size, datetime.datetime.fromtimestamp(sinfo.st_mtime), sinfo.st_ino)
+
+    @staticmethod
+    def identify(head, fullpath):
+        """
+        Identify a file from its first bytes with the calling thread's libmagic handles.
+        @return: (magic, mimetype)
+        """
+        (magichandle, mimehandle) = Explore._magic_handles()
+        try:
+            magicstr = _to_str(magichandle.from_buffer(head))
+        except magic.MagicException as exc: # Magic is buggy as of 0.4.6
+            _log.warning("Magic failed identifying magic of %s", fullpath)
+            magicstr = ""
+        try:
+            mimetype = _to_str(mimehandle.from_buffer(head))
+        except magic.MagicException as exc:
+            _log.warning("Magic failed identifying mimetype of %s", fullpath)
+            mimetype = ""
+        return (magicstr, mimetype)
+
+    def skip_magic(self, metafile):
+        """
+        @return: True if magic is not wanted for this file because of its extension or size
+        """
+        maxsize = self.config.get("magic_max_size")
+        if maxsize is not None and metafile["size"] > maxsize:
+            return True
+        return metafile["extension"].lower() in self.config.get("magic_skip_ext", ())
+
+    def explore_file(self, relpath, fullpath, sinfo=None):
+        """
+        Collect the metadata of a single file. Safe to call from worker threads.
+        @param sinfo: lstat result of fullpath if already available
+        @return: dict of MetaFile column values or None if fullpath is not a regular file
+        @raise IOError, OSError: if the file could not be read
+        """
+        if sinfo is None:
+            sinfo = os.lstat(fullpath)
+        if not stat.S_ISREG(sinfo.st_mode):
+            return None
+        metafile = {"size": sinfo.st_size,
+                    "lastmodified": datetime.datetime.fromtimestamp(sinfo.st_mtime),
+                    "created": datetime.datetime.fromtimestamp(sinfo.st_mtime),
+                    "lastaccess": datetime.datetime.fromtimestamp(sinfo.st_mtime),
+                    "uid": sinfo.st_uid,
+                    "gid": sinfo.st_gid,
+                    "permissions": sinfo.st_mode,
+                    "inode": sinfo.st_ino,
+                    "removed": False,
+                    "source": self.config.get("source"),
+                    "stmode_type": "regular",
+                    "path": relpath,
+                    "extension": os.path.splitext(relpath)[1]}
+        if self._cache is not None:
+            cachekey = self._cache.key(fullpath, sinfo, opener=self.open_file)
+            cached = self._cache.get(cachekey)
+            if cached is not None and (cached["ssdeep"] or not self.config.get("ssdeep")) and self.confirm_cached(fullpath, sinfo, cached):
+                self.metrics.count("cache_hits")
+                metafile.update(cached)
+                return metafile
+            self.metrics.count("cache_misses")
+        with self.metrics.timer("hash"):
+            with self.open_file(fullpath) as ifh:
+                hasher = hashing.thread_hasher(bufsize=self.config.get("bufsize"), fuzzy=self.config.get("ssdeep", False))
+                (digests, head) = hasher.hash_file_head(ifh, hexdigest=True, headsize=MAGIC_HEAD_SIZE)
+        self.metrics.count("read_bytes", sinfo.st_size)
+        metafile.update(digests)
+        if self.skip_magic(metafile):
+            metafile["magic"] = metafile["mimetype"] = ""
+        else:
+            with self.metrics.timer("magic"):
+                (metafile["magic"], metafile["mimetype"]) = Explore.identify(head, fullpath)
+        if self._cache is not None:
+            self._cache.put(cachekey, metafile)
+        return metafile
+
+    def confirm_cached(self, fullpath, sinfo, cached):
+        """
+        Cache keys that do not identify the content, like prehash keys, only give a candidate. Its values are used if
+        the sha256 of the file matches, which spares the other digests, magic and fuzzy hash.
+        @return: True if the cached values belong to the file
+        """
+        if not self._cache.confirm:
+            return True
+        with self.metrics.timer("hash"):
+            with self.open_file(fullpath) as ifh:
+                hasher = hashing.thread_hasher(digests=("sha256",), bufsize=self.config.get("bufsize"))
+                sha256 = hasher.hash_file(ifh, hexdigest=True)["sha256"]
+        self.metrics.count("read_bytes", sinfo.st_size)
+        if sha256 == cached["sha256"]:
+            return True
+        _log.debug("Cache entry of %s is for other content with the same prehash", fullpath)
+        self.metrics.count("cache_conflicts")
+        return False
+
+    def open_file(self, fullpath):
+        """
+        Open a file yielded by the traversal for binary reading, from the image when exploring an image.
+        """
+        if self._image is not None:
+            return self._image.open(fullpath)
+        return open(fullpath, "rb")
+
+    def source_files(self, rootpath, after=None):
+        if self._image is not None:
+            if after:
+                return Explore.skip_through(self._image.files(), after)
+            return self._image.files()
+        return Explore.files(rootpath, after=after)
+
+    @staticmethod
+    def skip_through(files, after):
+        """
+        Generator function. Skip the files up to and including relpath after, for traversals that are deterministic
+        but not in path order, like the on-disk order of images.
+        """
+        files = iter(files)
+        for (relpath, fullpath, sinfo) in files:
+            if relpath == after:
+                break
+        else:
+            _log.warning("Checkpoint %s not found, nothing left to explore", after)
+        for paths in files:
+            yield paths
+
+    def _explore_file_safe(self, paths):
+        """
+        Wrapper around explore_file for the worker pool. Returns errors instead of raising them so the ordering
+        of the results is not disturbed. Files that did not change since the last run are not explored again.
+        @return: (relpath, metafile dict, None or UNCHANGED, error or None)
+        """
+        (relpath, fullpath, sinfo) = paths
+        try:
+            if sinfo is None:
+                sinfo = os.lstat(fullpath)
+            known = self._known.get(relpath)
+            if known is not None and not known[4] and known[1:4] == Explore.file_state(sinfo):
+                return (relpath, Explore.UNCHANGED, None)
+            return (relpath, self.explore_file(relpath, fullpath, sinfo), None)
+        except (IOError, OSError) as err:
+            return (relpath, None, err)
+
+    def explored_files(self, rootpath, after=None):
+        """
+        Generator function. Explore all files under rootpath, serially or on a pool of worker threads.
+        Results are yielded in traversal order, regardless of the number of workers.
+        @param after: relative path of the last file already explored when resuming
+        @yield: (relpath, metafile dict, None or UNCHANGED, error or None)
+        """
+        workers = self.config.get("workers", 0)
+        paths = self.metrics.timed_iter("stat", self.source_files(rootpath, after=after))
+        if not workers:
+            for entry in paths:
+                yield self._explore_file_safe(entry)
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for res in imap_ordered(executor, self._explore_file_safe, paths, window=workers*WINDOW_PER_WORKER, metrics=self.metrics):
+                yield res
+
+    def open_db(self, fsdb):
+        """
+        Create a new database, or open the existing one in update or resume mode.
+        """
+        if self.config.get("resume"):
+            return self.resume_db(fsdb)
+        if self.config.get("update"):
+            _log.info("Updating database %s...", fsdb)
+            if not os.path.isfile(fsdb):
+                raise Exception("{} does not exist!".format(fsdb))
+            dbif = database.DbIf("sqlite:///{}".format(fsdb))
+            self.check_rootpath(dbif, fsdb)
+            self._known = dbif.file_states()
+            dbif.add_db_info(key="updated", value=str(datetime.datetime.now()), replace=True)
+            _log.info("%d known files", len(self._known))
+            return dbif
         _log.info("Initializing database %s...", fsdb)
         if os.path.isfile(fsdb):
             raise Exception("{} allready exists!".format(fsdb))
@@ -82,67 +347,161 @@ class Explore(modularity.ModuleBase):
                               "dbpath": os.path.abspath(fsdb),
                               "created": str(datetime.datetime.now()),
                               "module": __file__})
-        _log.info("Calculating file system size...")
-        (total_files, total_size, skipped) = Explore.get_dirtree_size(self.config["rootpath"])
-        if skipped:
-            _log.warning("File system size calc skipped %d files due to errors", skipped)
-        _log.info("Total files found: %d (%d MB)", total_files, round(total_size/1024/1024))
-        _log.info("Exploring dir tree at %s", self.config["rootpath"])
+        return dbif
+
+    def check_rootpath(self, dbif, fsdb):
+        """
+        Refuse to continue a database explored from another rootpath, its files would all be marked removed
+        and the new ones added under paths relative to a different root. --force continues anyway.
+        """
+        rootpath = dbif.get_db_info().get("rootpath")
+        dbif.Session.remove()
+        if rootpath == os.path.abspath(self.config["rootpath"]):
+            return
+        _log.error("Database %s was explored from %s", fsdb, rootpath)
+        if not self.config.get("force"):
+            raise Exception("Database was explored from another rootpath, use --force to continue anyway")
+        _log.warning("Continuing from %s on --force", self.config["rootpath"])
+        dbif.add_db_info(key="rootpath", value=os.path.abspath(self.config["rootpath"]), replace=True)
+
+    def resume_db(self, fsdb):
+        """
+        Open the database of an interrupted run. Everything it committed is treated as known from a previous run,
+        so the rest of the files are added, or updated if the interrupted run was an update.
+        """
+        _log.info("Resuming database %s...", fsdb)
+        if not os.path.isfile(fsdb):
+            raise Exception("{} does not exist!".format(fsdb))
+        dbif = database.DbIf("sqlite:///{}".format(fsdb))
+        dbinfos = dbif.get_db_info()
+        dbif.Session.remove()
+        if dbinfos.get("explore_state") != "running":
+            _log.error("Database %s has no interrupted explore run", fsdb)
+            raise Exception("Nothing to resume")
+        self.check_rootpath(dbif, fsdb)
+        self._known = dbif.file_states()
+        self._resume_after = dbinfos.get("checkpoint") or None
+        dbif.add_db_info(key="updated", value=str(datetime.datetime.now()), replace=True)
+        _log.info("%d files explored up to %s", len(self._known), self._resume_after)
+        return dbif
+
+    def forget_explored(self, after):
+        """
+        Drop the known states of the files up to and including after, which the interrupted run already handled.
+        @return: number of files up to after
+        """
+        if self._image is not None:
+            for (i, (relpath, fullpath, sinfo)) in enumerate(self._image.files()):
+                self._known.pop(relpath, None)
+                if relpath == after:
+                    return i + 1
+            return 0
+        afterkey = Explore.path_key(after)
+        done = [relpath for relpath in self._known if Explore.path_key(relpath) <= afterkey]
+        for relpath in done:
+            del self._known[relpath]
+        return len(done)
+
+    def work(self):
+        if self.config.get("image") and self.config.get("cache") and self.config.get("cache_key", "stat") == "stat":
+            raise Exception("stat cache keys only apply to mounted file systems, use --cache-key prehash for images")
+        if self.config.get("ssdeep") and not hashing.fuzzy_available():
+            raise Exception("--ssdeep needs the ssdeep or ppdeep package")
+        dbif = self.open_db(self.config["db"])
+        if self.config.get("image"):
+            self._image = fsimage.open_image(self.config["rootpath"])
+            dbif.add_db_info(key="image_type", value=self._image.imagetype, replace=True)
+        if self.config.get("cache"):
+            self._cache = digestcache.DigestCache(self.config["cache"], maxentries=self.config.get("cache_size", digestcache.DEF_MAX_ENTRIES),
+                                                  keymode=self.config.get("cache_key", "stat"))
+        try:
+            self.explore(dbif)
+        finally:
+            if self._cache is not None:
+                self._cache.close()
+                self._cache = None
+            if self._image is not None:
+                self._image.close()
+                self._image = None
+
+    def explore(self, dbif):
+        if self._image is not None:
+            total_files = self._image.count_files()
+        elif self.config.get("precount", "none") == "names":
+            _log.info("Counting files...")
+            total_files = Explore.count_files(self.config["rootpath"])
+            _log.info("Total files found: %d", total_files)
+        elif self._known:
+            total_files = len(self._known)
+            _log.info("Estimating %d files from previous run", total_files)
+        else:
+            total_files = None
+        _log.info("Exploring %s at %s (%d workers)", self._image.imagetype + " image" if self._image else "dir tree", self.config["rootpath"], self.config.get("workers", 0))
         pbar = progressbar.Progressbar(total_files, "Exploring file system...", "files")
+        if self._resume_after:
+            pbar.update(self.forget_explored(self._resume_after))
+        dbif.add_db_info(key="explore_state", value="running", replace=True)
+        dbif.add_db_info(key="checkpoint", value=self._resume_after or "", replace=True)
+        dbif.Session.remove()
         count = 0
         errcount = 0
-        for (relpath, fullpath) in Explore.files(self.config["rootpath"]):
-            count += 1
-            metafile = database.MetaFile()
-            _log.debug("Processing %s...", relpath)
-            try:
-                sinfo = os.lstat(fullpath)
-                metafile.size = sinfo.st_size
-                metafile.lastmodified = datetime.datetime.fromtimestamp(sinfo.st_mtime)
-                metafile.created = datetime.datetime.fromtimestamp(sinfo.st_mtime)
-                metafile.lastaccess = datetime.datetime.fromtimestamp(sinfo.st_mtime)
-                metafile.uid = sinfo.st_uid
-                metafile.gid = sinfo.st_gid
-                metafile.permissions = sinfo.st_mode
-                if stat.S_ISLNK(sinfo.st_mode):
-                    metafile.stmode_type = "symlink"
-                elif not stat.S_ISREG(sinfo.st_mode):
-                    metafile.stmode_type = "other"
-                else:
-                    metafile.stmode_type = "regular"
-                    try:
-                        magicbytes = magic.from_file(fullpath, mime=False)
-                        metafile.magic = str(magicbytes, "utf-8") if magicbytes else ""
-                    except magic.MagicException as exc: # Magic is buggy as of 0.4.6
-                        _log.warning("Magic failed identifying magic of %s", fullpath)
-                        metafile.magic = ""
-                    try:
-                        magicbytes = magic.from_file(fullpath, mime=True)
-                        metafile.mimetype = str(magicbytes, "utf-8") if magicbytes else ""
-                    except magic.MagicException as exc:
-                        _log.warning("Magic failed identifying mimetype of %s", fullpath)
-                        metafile.mimetype = ""
-                    metafile.path = relpath
-                    metafile.extension = os.path.splitext(relpath)[1]
-                    with open(fullpath, "rb") as ifh:
-                        (metafile.sha1, metafile.md5, metafile.sha256) = self.hash_file(ifh, hexdigest=True)
-                    dbif.Session.add(metafile)
-            except IOError:
-                _log.error("Error processing %s (skipping)", relpath)
-                errcount += 1
-            except OSError:
-                _log.error("Error processing %s (skipping)", relpath)
-                errcount += 1
-            finally:
-                pbar.update(1)
-        dbif.Session.commit()
+        changedcount = 0
+        hashedbytes = 0
+        # Only this thread writes to the database, the workers just produce column values. Results come in
+        # traversal order, so every committed batch carries the path up to which the run is complete.
+        with dbif.bulk_writer(batch_size=self.config.get("batchsize", database.DEF_BATCH_SIZE), metrics=self.metrics) as writer:
+            for (relpath, metafile, err) in self.explored_files(self.config["rootpath"], after=self._resume_after):
+                count += 1
+                size = 0
+                self.metrics.count("files")
+                _log.debug("Processing %s...", relpath)
+                writer.checkpoint(relpath)
+                if err is not None:
+                    _log.error("Error processing %s (skipping)", relpath)
+                    errcount += 1
+                    self.metrics.count("errors")
+                    self._known.pop(relpath, None)
+                elif metafile is Explore.UNCHANGED:
+                    self._known.pop(relpath)
+                elif metafile is not None:
+                    size = metafile["size"]
+                    hashedbytes += size
+                    known = self._known.pop(relpath, None)
+                    if known is None:
+                        writer.add(metafile)
+                    else:
+                        writer.update(known[0], metafile)
+                        changedcount += 1
+                pbar.update(1, nbytes=size)
         pbar.finish()
-        _log.info("%d files found", count)
+        _log.info("%d files found, %d MB explored", count, round(hashedbytes/1024/1024))
         _log.info("%d problematic files encountered", errcount)
+        if self.config.get("update") or self.config.get("resume"):
+            removed = [known[0] for known in self._known.values() if not known[4]]
+            dbif.update_ids(removed, removed=True)
+            _log.info("%d files changed, %d files removed", changedcount, len(removed))
+            self._known = {}
+            _log.debug("%d unreferenced contents pruned", dbif.prune_contents())
+        dbif.add_db_info(key="explore_state", value="finished", replace=True)
 
     @classmethod
     def add_args(cls):
-        cls.argparser.add_argument("rootpath", help="The root of the dirtree to traverse")
+        cls.argparser.add_argument("rootpath", help="The root of the dirtree to traverse, or the image file with --image")
+        cls.argparser.add_argument("--source", help="Name of the image or device the files come from, stored with every record")
+        cls.argparser.add_argument("--image", "-i", action="store_true", help="Read the files straight from a sparse ext4, ext4 or yaffs2 image instead of a mounted dir tree")
+        cls.argparser.add_argument("--workers", "-w", type=int, default=0, help="Number of worker threads for magic and hashing. Default: 0 (no workers)")
+        cls.argparser.add_argument("--ssdeep", action="store_true", help="Also compute the ssdeep fuzzy hash, in the same read pass as the other digests")
+        cls.argparser.add_argument("--bufsize", type=int, default=None, help="Read size in bytes used for hashing. Default: adaptive")
+        cls.argparser.add_argument("--update", "-u", action="store_true", help="Update an existing database, only exploring new and changed files")
+        cls.argparser.add_argument("--resume", "-r", action="store_true", help="Continue an interrupted run on its database after the last committed file")
+        cls.argparser.add_argument("--force", "-f", action="store_true", help="Update or resume a database explored from another rootpath")
+        cls.argparser.add_argument("--cache", help="Digest cache file shared across runs. Default: no cache")
+        cls.argparser.add_argument("--cache-size", type=int, default=digestcache.DEF_MAX_ENTRIES, help="Maximum number of cache entries. Default: {}".format(digestcache.DEF_MAX_ENTRIES))
+        cls.argparser.add_argument("--cache-key", choices=digestcache.KEY_MODES, default="stat", help="Cache on device/inode/size/mtime (stat) or on size and crc of first and last block (prehash), whose hits are confirmed with a sha256 of the file. Default: stat")
+        cls.argparser.add_argument("--magic-skip-ext", type=_extensions, default=(), help="Comma separated extensions for which magic is not identified, e.g. .odex,.so")
+        cls.argparser.add_argument("--magic-max-size", type=int, default=None, help="Do not identify magic of files larger than this many bytes. Default: no limit")
+        cls.argparser.add_argument("--precount", choices=("names", "none"), default="none", help="Count the files up front for an exact progress total, at the cost of a second walk listing the dirs (names), or explore in a single walk with an open-ended progress bar (none). Default: none")
+        cls.argparser.add_argument("--batchsize", type=int, default=database.DEF_BATCH_SIZE, help="Number of records inserted and committed at once, which is also the checkpoint interval. Default: {}".format(database.DEF_BATCH_SIZE))
 
 Explore.register()
 
@@ -4,13 +4,12 @@ import logging
 import os.path
 import datetime
 
-from sqlalchemy import or_
-
-from blackswan.core import modularity,database
+from blackswan.core import modularity,database,hashset,lookupclient
+from blackswan.core.metrics import Metrics
 from blackswan.core.database import MetaFile
-from blackswan import config
-from blackswan.modules import explore
-from blackswan.support import sanity, progressbar
+from blackswan import modules
+from blackswan.modules import explore,inspect_apks
+from blackswan.support import sanity
 
 _log = logging.getLogger(__name__)
 
@@ -22,16 +21,23 @@ class HashFilter(modularity.ModuleBase):
     modname = "hashfilter"
 
     @staticmethod
-    def create_db(rootpath, tempdb):
-        explorer = modularity.modules["Explore"]()
-        explorer.configure(rootpath=rootpath, db=tempdb)
+    def create_db(rootpath, tempdb, cache=None):
+        explorer = modules.load("explore")()
+        explorer.configure(rootpath=rootpath, db=tempdb, cache=cache)
         explorer.run()
         return tempdb
 
     @staticmethod
     def filter_type(dbpath):
         if os.path.isfile(dbpath):
+            if hashset.is_hashset(dbpath):
+                return "hashset"
+            # every database created with the current models has an (empty) TrustedCerts table, so dispatch on the kind
+            if database.DbIf("sqlite:///{}".format(dbpath)).kind() == database.KIND_CERTLIST:
+                return "certs"
             return "sqlite"
+        elif lookupclient.is_service(dbpath):
+            return "service"
         elif os.path.isdir(dbpath):
             return "dirtree"
         else:
@@ -47,38 +53,71 @@ class HashFilter(modularity.ModuleBase):
         sanity.assert_exists(filterpath)
         _log.info("Filter: %s (assuming %s)", os.path.abspath(filterpath), HashFilter.filter_type(filterpath))
 
+        refdb = None
         if HashFilter.filter_type(filterpath) == "sqlite":
-            filterDbIf = database.DbIf("sqlite:///{}".format(filterpath))
-        else:
+            refdb = filterpath
+        elif HashFilter.filter_type(filterpath) == "dirtree":
             tempdb = DEF_FILTERDB
             if os.path.exists(tempdb):
                 os.remove(tempdb)
-            tempdb = HashFilter.create_db(filterpath, tempdb)
-            filterDbIf = database.DbIf("sqlite:///{}".format(tempdb))
+            refdb = HashFilter.create_db(filterpath, tempdb, cache=self.config.get("cache"))
 
         destdbIf = database.DbIf("sqlite:///{}".format(dbpath))
+        destdbIf.assert_schema()
         destdbIf.add_db_info(key="filter_applied", value=filterpath)
         destdbIf.add_db_info(key="updated", value=datetime.datetime.now(), replace=True)
         total = destdbIf.Session.query(database.MetaFile).filter(MetaFile.excluded == False).count()
-        exclcnt = cnt = 0
-        pbar = progressbar.Progressbar(total, "Filtering database...", unit="files")
-        for mf in destdbIf.Session.query(MetaFile).filter(MetaFile.excluded == False):
-            if filterDbIf.Session.query(MetaFile).filter(or_(MetaFile.sha1 == mf.sha1, MetaFile.md5 == mf.md5, MetaFile.sha256 == mf.sha256)).first() is not None:
-                _log.debug("Found a match: %s", mf.path)
-                mf.excluded = True
-                exclcnt += 1
-            cnt += 1
-            if not (cnt % 10):
-                pbar.update(10)
         destdbIf.Session.commit()
-        pbar.finish()
-        _log.info("%d of %d records excluded from %s", exclcnt, total, dbpath)
+        _log.info("Filtering %d records...", total)
+        if HashFilter.filter_type(filterpath) == "certs":
+            # parsed certificates are kept per APK sha256, so only APKs new to the database are read
+            inspect_apks.InspectApks.inspect_db(dbpath, cache=self.config.get("apk_cache"), workers=self.config.get("apk_workers"))
+            with self.metrics.timer("filter_lookup"):
+                stats = destdbIf.exclude_by_certs(filterpath)
+            for (vendor, count) in sorted(stats["vendors"].items()):
+                _log.info("%d records signed by %s", count, vendor)
+        elif refdb is not None:
+            # lookups and updates are one set operation inside sqlite
+            with self.metrics.timer("filter_lookup"):
+                stats = destdbIf.exclude_by_refdb(os.path.abspath(refdb))
+        elif HashFilter.filter_type(filterpath) == "service":
+            with lookupclient.LookupClient(filterpath) as client:
+                stats = HashFilter.exclude_by_matcher(destdbIf, client, "sha1", metrics=self.metrics)
+        else:
+            hs = hashset.HashSet(filterpath)
+            try:
+                stats = HashFilter.exclude_by_matcher(destdbIf, hs, hs.name, metrics=self.metrics)
+            finally:
+                hs.close()
+        self.metrics.count("lookups", total)
+        self.metrics.count("matches", stats["excluded"])
+        for col in database.HASH_COLUMNS:
+            if col in stats:
+                _log.info("%d records matched on %s", stats[col], col)
+        _log.info("%d of %d records excluded from %s", stats["excluded"], total, dbpath)
         return True
-        pass
+
+    @staticmethod
+    def exclude_by_matcher(destdbIf, matcher, digestname, metrics=None):
+        """
+        Exclude the records whose digest the matcher (a hash set or lookup service client) knows.
+        Only the given digest type is compared.
+        @param metrics: Metrics to report the time of the lookups and of the update to
+        @return: dict with the number of matches for the digest type and the number of records excluded
+        """
+        metrics = metrics if metrics is not None else Metrics()
+        with metrics.timer("filter_lookup"):
+            matches = list(matcher.matches(destdbIf.included_digests(digestname, ordered=True)))
+        with metrics.timer("db_update"):
+            excluded = destdbIf.exclude_ids(matches)
+        return {digestname: len(matches), "excluded": excluded}
 
     @classmethod
     def add_args(cls):
-        cls.argparser.add_argument("--filter", "-f", required=True, help="Reference set against which is compared. May be dir or sqlite file")
+        cls.argparser.add_argument("--filter", "-f", required=True, help="Reference set against which is compared. May be dir, sqlite file, hash set file, lookup service socket or certificate whitelist (see build_certlist), which excludes APKs and JARs signed only by trusted certificates")
+        cls.argparser.add_argument("--cache", help="Digest cache file used when exploring a dir tree filter. Default: no cache")
+        cls.argparser.add_argument("--apk-cache", help="APK inspection cache used with a certificate whitelist filter, see inspect_apks. Default: no cache")
+        cls.argparser.add_argument("--apk-workers", type=int, default=None, help="Worker processes inspecting APKs with a certificate whitelist filter. Default: the number of CPUs")
         pass
 
 HashFilter.register()
@@ -0,0 +1,155 @@
+__author__ = 'ivo'
+
+import io
+import os
+import os.path
+import time
+import zlib
+import logging
+import zipfile
+import datetime
+import concurrent.futures
+
+from blackswan.core import modularity,database
+from blackswan import modules
+from blackswan.modules import explore
+from blackswan.support import sanity,progressbar,apk,fsimage
+
+_log = logging.getLogger(__name__)
+
+DEF_EXTENSIONS = (".apk", ".jar")
+DEF_BATCH_SIZE = 100
+WINDOW_PER_WORKER = 4
+
+# state of a worker process, set up once by _init_worker
+_worker = {}
+
+def _init_worker(rootpath, image, bufsize):
+    _worker["rootpath"] = rootpath
+    _worker["bufsize"] = bufsize
+    _worker["image"] = fsimage.open_image(rootpath) if image else None
+
+def _close_worker():
+    if _worker.get("image") is not None:
+        _worker["image"].close()
+    _worker.clear()
+
+def inspect_file(item):
+    """
+    Inspect one APK in a worker process. Errors end up in the row, so one broken archive does not stop the pool.
+    @param item: (sha256 (raw), path relative to the root or in the image)
+    @return: (ApkFiles row dict with the lists of members and signers, seconds spent)
+    """
+    (sha256, relpath) = item
+    start = time.perf_counter()
+    row = {"sha256": sha256, "path": relpath, "inspected": datetime.datetime.now(), "members": [], "signers": [], "error": None}
+    try:
+        image = _worker.get("image")
+        if image is not None:
+            fh = io.BufferedReader(image.open(relpath))
+        else:
+            fh = open(os.path.join(_worker["rootpath"], relpath), "rb")
+        with fh:
+            row.update(apk.inspect(fh, bufsize=_worker.get("bufsize")))
+    except (IOError, OSError, EOFError, zipfile.BadZipFile, zipfile.LargeZipFile, zlib.error, NotImplementedError, RuntimeError, apk.ApkError) as err:
+        row["error"] = "{}: {}".format(type(err).__name__, err)
+    row["member_count"] = len(row["members"])
+    row["schemes"] = ",".join(sorted(set(signer["scheme"] for signer in row["signers"])))
+    return (row, time.perf_counter() - start)
+
+class InspectApks(modularity.ModuleBase):
+
+    description = "Hash the members and verify the signer certificates of the APK and JAR files in the database"
+    modname = "inspect_apks"
+
+    @staticmethod
+    def inspect_db(dbpath, cache=None, workers=None):
+        """
+        Inspect the APKs of an explored database that were not inspected before.
+        """
+        inspector = modules.load("inspect_apks")()
+        inspector.configure(db=dbpath, cache=cache, workers=os.cpu_count() if workers is None else workers)
+        inspector.run()
+        return dbpath
+
+    def inspected(self, todo, initargs):
+        """
+        Generator function. Inspect the APKs on a pool of worker processes, or serially without workers.
+        @yield: ApkFiles row dicts with their members and signers
+        """
+        workers = self.config.get("workers", os.cpu_count())
+        if not workers:
+            _init_worker(*initargs)
+            try:
+                for (row, seconds) in map(inspect_file, todo):
+                    self.metrics.add_time("inspect", seconds)
+                    yield row
+            finally:
+                _close_worker()
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=initargs) as executor:
+            for (row, seconds) in explore.imap_ordered(executor, inspect_file, todo, window=workers*WINDOW_PER_WORKER, metrics=self.metrics):
+                self.metrics.add_time("inspect", seconds)
+                yield row
+
+    def work(self):
+        dbpath = os.path.abspath(self.config["db"])
+        sanity.assert_exists(dbpath)
+        _log.info("Database: %s", dbpath)
+        dbif = database.DbIf("sqlite:///{}".format(dbpath))
+        dbif.assert_schema()
+        dbif.create_apk_tables()
+        dbinfos = dbif.get_db_info()
+        dbif.Session.commit()
+        rootpath = self.config.get("rootpath") or dbinfos.get("rootpath")
+        if not rootpath:
+            _log.error("%s does not record where it was explored from, use --rootpath", dbpath)
+            raise Exception("No rootpath")
+        sanity.assert_exists(rootpath)
+        image = "image_type" in dbinfos
+
+        cache = os.path.abspath(self.config["cache"]) if self.config.get("cache") else None
+        if cache is not None and os.path.exists(cache):
+            _log.info("%d APK inspections taken from cache %s", dbif.import_apk_inspections(cache), cache)
+        todo = dbif.uninspected_apks(self.config.get("extensions", DEF_EXTENSIONS))
+        _log.info("Inspecting %d APKs in %s %s (%s workers)", len(todo), "image" if image else "dir tree", rootpath, self.config.get("workers", os.cpu_count()))
+
+        errcount = 0
+        pbar = progressbar.Progressbar(len(todo), "Inspecting APKs...", "files")
+        with database.ApkWriter(dbif, batch_size=self.config.get("batch_size", DEF_BATCH_SIZE), metrics=self.metrics) as writer:
+            for row in self.inspected(todo, (rootpath, image, self.config.get("bufsize"))):
+                size = sum(member["size"] for member in row["members"])
+                self.metrics.count("apks")
+                self.metrics.count("members", len(row["members"]))
+                self.metrics.count("signers", len(row["signers"]))
+                self.metrics.count("member_bytes", size)
+                if row["error"] is not None:
+                    _log.warning("%s: %s", row["path"], row["error"])
+                    errcount += 1
+                    self.metrics.count("errors")
+                writer.add(row)
+                pbar.update(1, nbytes=size)
+        pbar.finish()
+        _log.info("%d APKs inspected, %d with errors", writer.written, errcount)
+        if cache is not None:
+            _log.info("%d APK inspections added to cache %s", dbif.export_apk_inspections(cache), cache)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("--rootpath", help="Dir tree or image the database was explored from. Default: the rootpath stored in the database")
+        cls.argparser.add_argument("--cache", help="Database of APK inspections shared across runs and images, so every APK is inspected only once. Default: no cache")
+        cls.argparser.add_argument("--workers", "-w", type=int, default=os.cpu_count(), help="Number of worker processes. Default: {:d} (the number of CPUs)".format(os.cpu_count()))
+        cls.argparser.add_argument("--extensions", type=explore._extensions, default=DEF_EXTENSIONS, help="Comma separated extensions of the files to inspect. Default: {}".format(",".join(DEF_EXTENSIONS)))
+        cls.argparser.add_argument("--bufsize", type=int, default=None, help="Read size in bytes used for hashing members. Default: adaptive")
+        cls.argparser.add_argument("--batch-size", type=int, default=DEF_BATCH_SIZE, help="Number of APKs per transaction. Default: {:d}".format(DEF_BATCH_SIZE))
+
+InspectApks.register()
+
+def main():
+    inspector = InspectApks()
+    inspector.parse_args()
+    inspector.run()
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,7 @@ import os.path
 import datetime
 import binascii
 
-from blackswan.core import modularity,database
+from blackswan.core import modularity,database,ldbwhitelist,lookupclient
 from blackswan.core.database import MetaFile
 from blackswan import config
 from blackswan.support import sanity, progressbar
@@ -26,38 +26,92 @@ class LdbHashFilter(modularity.ModuleBase):
         sanity.assert_exists(dbpath)
         _log.info("Database: %s", os.path.abspath(dbpath))
         sanity.assert_exists(filterpath)
-        try:
-            filterDbIf = plyvel.DB(filterpath, create_if_missing=False)
-        except plyvel.IOError as err:
-            _log.error("Could not open as ldb database %s", filterpath)
-            _log.error(repr(err))
-            raise err
+        if lookupclient.is_service(filterpath):
+            filterDbIf = None
+        else:
+            try:
+                filterDbIf = plyvel.DB(filterpath, create_if_missing=False)
+            except plyvel.IOError as err:
+                _log.error("Could not open as ldb database %s", filterpath)
+                _log.error(repr(err))
+                raise err
         _log.info("Filter: %s", os.path.abspath(filterpath))
 
         destdbIf = database.DbIf("sqlite:///{}".format(dbpath))
+        destdbIf.assert_schema()
         destdbIf.add_db_info(key="filter_applied", value=filterpath)
         destdbIf.add_db_info(key="updated", value=datetime.datetime.now(), replace=True)
         total = destdbIf.Session.query(database.MetaFile).filter(MetaFile.excluded == False).count()
-        exclcnt = cnt = 0
+        destdbIf.Session.commit()
         pbar = progressbar.Progressbar(total, "Filtering database...", unit="files")
-        for mf in destdbIf.Session.query(MetaFile).filter(MetaFile.excluded == False):
-            res = filterDbIf.get(binascii.unhexlify(mf.sha1))
+        with self.metrics.timer("filter_lookup"):
+            if filterDbIf is None:
+                with lookupclient.LookupClient(filterpath) as client:
+                    matches = list(client.matches(destdbIf.included_digests("sha1", ordered=True)))
+            elif self.config.get("merge"):
+                matches = LdbHashFilter.merge_matches(filterDbIf, destdbIf.included_digests("sha1", ordered=True), pbar)
+            else:
+                matches = LdbHashFilter.get_matches(filterDbIf, destdbIf.included_digests("sha1"), pbar)
+        self.metrics.count("lookups", total)
+        self.metrics.count("matches", len(matches))
+        with self.metrics.timer("db_update"):
+            exclcnt = destdbIf.exclude_ids(matches)
+        if filterDbIf is not None:
+            filterDbIf.close()
+        pbar.finish()
+        _log.info("%d of %d records excluded from %s", exclcnt, total, dbpath)
+        return True
+
+    @staticmethod
+    def get_matches(ldb, digests, pbar):
+        """
+        Lookup every digest with a random get.
+        @param digests: iterable of (id, hex sha1)
+        @return: list of matching ids
+        """
+        matches = []
+        cnt = 0
+        for (mfid, sha1) in digests:
+            try:
+                res = ldb.get(binascii.unhexlify(sha1))
+            except binascii.Error:
+                _log.warning("Invalid sha1 %s for record %d", sha1, mfid)
+                res = None
             if res:
                 _log.debug("Found a match: %s", str(res, encoding="utf8"))
-                mf.excluded = True
-                exclcnt += 1
+                matches.append(mfid)
             cnt += 1
             if not (cnt % 10):
                 pbar.update(10)
-        destdbIf.Session.commit()
-        filterDbIf.close()
-        pbar.finish()
-        _log.info("%d of %d records excluded from %s", exclcnt, total, dbpath)
-        return True
+        return matches
+
+    @staticmethod
+    def merge_matches(ldb, digests, pbar):
+        """
+        Merge join the digests against the ldb keys with a single forward iterator.
+        @param digests: iterable of (id, hex sha1), preferably sorted by sha1
+        @return: list of matching ids
+        """
+        def keyed():
+            cnt = 0
+            for (mfid, sha1) in digests:
+                cnt += 1
+                if not (cnt % 10):
+                    pbar.update(10)
+                try:
+                    yield (ldbwhitelist.ldb_key(sha1, "sha1"), mfid)
+                except binascii.Error:
+                    _log.warning("Invalid sha1 %s for record %d", sha1, mfid)
+        matches = []
+        for (mfid, value) in ldbwhitelist.merge_join(ldb, keyed()):
+            _log.debug("Found a match: %s", str(value, encoding="utf8"))
+            matches.append(mfid)
+        return matches
 
     @classmethod
     def add_args(cls):
-        cls.argparser.add_argument("--filter", "-f", required=True, help="Reference set against which is compared. Should be ldb database")
+        cls.argparser.add_argument("--filter", "-f", required=True, help="Reference set against which is compared. Should be ldb database or lookup service socket")
+        cls.argparser.add_argument("--merge", action="store_true", help="Walk the ldb once in key order instead of a random lookup per record")
         pass
 
 LdbHashFilter.register()
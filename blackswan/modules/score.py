@@ -0,0 +1,74 @@
+__author__ = 'ivo'
+
+import json
+import logging
+import os.path
+import datetime
+
+from blackswan.core import modularity,database,rules
+from blackswan.support import sanity,progressbar
+
+_log = logging.getLogger(__name__)
+
+class Score(modularity.ModuleBase):
+
+    description = "Score the files in the database with indicator rules and store the Indicators"
+    modname = "score"
+
+    def work(self):
+        if self.config.get("dump_rules"):
+            print(json.dumps(rules.DEFAULT_RULES, indent=2))
+            return True
+        dbpath = os.path.abspath(self.config["db"])
+        sanity.assert_exists(dbpath)
+        _log.info("Database: %s", dbpath)
+        try:
+            ruleset = rules.load_rules(self.config.get("rules"))
+        except (rules.RuleError, ValueError, IOError) as err:
+            _log.error("Could not load rules from %s: %s", self.config.get("rules"), err)
+            raise
+        _log.info("%d rules loaded from %s, %d evaluated in sqlite", len(ruleset), self.config.get("rules") or "the defaults",
+                  sum(1 for rule in ruleset if rule.pushdown))
+
+        dbif = database.DbIf("sqlite:///{}".format(dbpath))
+        dbif.assert_schema()
+        if not self.config.get("keep"):
+            _log.info("%d indicators of previous runs removed", dbif.remove_module_runs(self.modname + "@"))
+        runname = "{}@{}".format(self.modname, datetime.datetime.now().isoformat())
+        runid = dbif.add_module_run(runname, json.dumps({"rules": self.config.get("rules") or "default",
+                                                         "names": [rule.name for rule in ruleset]}))
+        dbif.Session.remove()
+
+        total = 0
+        pbar = progressbar.Progressbar(len(ruleset), "Scoring files...", "rules")
+        with dbif._engine.connect() as conn:
+            for rule in ruleset:
+                trans = conn.begin()
+                with self.metrics.timer("pushdown" if rule.pushdown else "fallback"):
+                    count = rule.apply(conn, runid, batch_size=self.config.get("batch_size", database.PAGE_SIZE))
+                trans.commit()
+                _log.info("Rule %s (%+d): %d files", rule.name, rule.score, count)
+                self.metrics.count("rules")
+                self.metrics.count("indicators", count)
+                total += count
+                pbar.update(1)
+        pbar.finish()
+        _log.info("%d indicators stored for run %s (id %d), see list_indicators", total, runname, runid)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("--rules", "-r", help="JSON file with a list of rules. Default: the built in Android rules, see --dump-rules")
+        cls.argparser.add_argument("--dump-rules", action="store_true", help="Print the built in rules as JSON, as a starting point for a rules file")
+        cls.argparser.add_argument("--keep", action="store_true", help="Keep the indicators of previous runs of this module")
+        cls.argparser.add_argument("--batch-size", type=int, default=database.PAGE_SIZE, help="Rows per batch for rules evaluated in python. Default: {:d}".format(database.PAGE_SIZE))
+
+Score.register()
+
+def main():
+    score = Score()
+    score.parse_args()
+    score.run()
+
+if __name__ == "__main__":
+    main()
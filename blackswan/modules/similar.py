@@ -0,0 +1,113 @@
+__author__ = 'ivo'
+
+import logging
+import os.path
+import heapq
+import datetime
+
+import sqlalchemy as sqla
+
+from blackswan.core import modularity,database
+from blackswan.core.database import Content,MetaFile,Similarity
+from blackswan.support import sanity,hashing,progressbar
+
+_log = logging.getLogger(__name__)
+
+DEF_TOP = 3
+DEF_THRESHOLD = 40
+DEF_MAX_CANDIDATES = 100
+
+class Similar(modularity.ModuleBase):
+
+    description = "Find the most similar files of a reference database for every included file, by ssdeep hash"
+    modname = "similar"
+
+    def best_matches(self, fuzzyhash, candidates):
+        """
+        Score the candidates that share the most index grams with ssdeep and keep the best ones.
+        @param candidates: list of (ref content id, shared grams, ref ssdeep hash, ref sha256)
+        @return: list of (score, ref content id, ref sha256), best first
+        """
+        top = self.config.get("top", DEF_TOP)
+        threshold = self.config.get("threshold", DEF_THRESHOLD)
+        candidates = heapq.nlargest(self.config.get("max_candidates", DEF_MAX_CANDIDATES), candidates, key=lambda cand: cand[1])
+        scored = []
+        with self.metrics.timer("compare"):
+            for (refid, shared, refhash, refsha256) in candidates:
+                score = hashing.fuzzy_compare(fuzzyhash, refhash)
+                if score >= threshold:
+                    scored.append((score, refid, refsha256))
+        self.metrics.count("comparisons", len(candidates))
+        return heapq.nlargest(top, scored)
+
+    def work(self):
+        dbpath = os.path.abspath(self.config["db"])
+        refpath = os.path.abspath(self.config["reference"])
+        sanity.assert_exists(dbpath)
+        sanity.assert_exists(refpath)
+        _log.info("Database: %s", dbpath)
+        _log.info("Reference: %s", refpath)
+        if not hashing.fuzzy_available():
+            _log.error("ssdeep hashes can not be compared: neither ssdeep nor ppdeep is installed")
+            raise Exception("No ssdeep implementation available")
+
+        refdbIf = database.DbIf("sqlite:///{}".format(refpath))
+        refdbIf.assert_schema()
+        if self.config.get("reindex") or not refdbIf.has_fuzzy_index():
+            _log.info("Indexing the ssdeep hashes of %s...", refpath)
+            with self.metrics.timer("index"):
+                indexed = refdbIf.build_fuzzy_index(batch_size=self.config.get("batch_size", database.DEF_BATCH_SIZE))
+            _log.info("%d reference ssdeep hashes indexed", indexed)
+            if not indexed:
+                _log.warning("The reference has no ssdeep hashes, explore it with --ssdeep")
+
+        destdbIf = database.DbIf("sqlite:///{}".format(dbpath))
+        destdbIf.assert_schema()
+        Similarity.__table__.create(destdbIf._engine, checkfirst=True)
+        destdbIf.Session.query(Similarity).delete()
+        destdbIf.add_db_info(key="similar_reference", value=refpath, replace=True)
+        destdbIf.add_db_info(key="updated", value=datetime.datetime.now(), replace=True)
+        total = destdbIf.Session.query(sqla.func.count(sqla.distinct(Content.id))).join(MetaFile, MetaFile.content_id == Content.id)\
+            .filter(MetaFile.excluded == False, Content.ssdeep != None).scalar()
+        destdbIf.Session.commit()
+        if not total:
+            _log.warning("No ssdeep hashes in %s, explore it with --ssdeep", dbpath)
+        _log.info("Looking up %d ssdeep hashes...", total)
+
+        matched = 0
+        pbar = progressbar.Progressbar(total, "Looking up similar files", unit="hashes")
+        with destdbIf.bulk_writer(table=Similarity.__table__, batch_size=self.config.get("batch_size", database.DEF_BATCH_SIZE),
+                                  metrics=self.metrics) as writer:
+            lookups = destdbIf.fuzzy_candidates(refpath, destdbIf.fuzzy_hashes())
+            for (content_id, fuzzyhash, candidates) in self.metrics.timed_iter("candidate_lookup", lookups):
+                self.metrics.count("lookups")
+                best = self.best_matches(fuzzyhash, candidates) if candidates else []
+                if best:
+                    matched += 1
+                    paths = refdbIf.content_paths([refid for (score, refid, refsha256) in best])
+                    for (score, refid, refsha256) in best:
+                        writer.add({"content_id": content_id, "score": score, "ref_sha256": refsha256, "ref_path": paths.get(refid)})
+                pbar.update(1)
+        pbar.finish()
+        self.metrics.count("matches", matched)
+        _log.info("%d of %d contents are similar to a reference file, %d matches stored", matched, total, writer.written)
+        return True
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("--reference", "-r", required=True, help="Blackswan database explored with --ssdeep to compare against, typically the whitelist. It gets a similarity index on first use")
+        cls.argparser.add_argument("--top", type=int, default=DEF_TOP, help="Number of best matches stored per file. Default: {:d}".format(DEF_TOP))
+        cls.argparser.add_argument("--threshold", type=int, default=DEF_THRESHOLD, help="Minimum ssdeep score (0-100) of a match. Default: {:d}".format(DEF_THRESHOLD))
+        cls.argparser.add_argument("--max-candidates", type=int, default=DEF_MAX_CANDIDATES, help="Number of index candidates per file that are scored with ssdeep. Default: {:d}".format(DEF_MAX_CANDIDATES))
+        cls.argparser.add_argument("--reindex", action="store_true", help="Rebuild the similarity index of the reference database")
+        cls.argparser.add_argument("--batch-size", type=int, default=database.DEF_BATCH_SIZE, help="Number of records per transaction. Default: {:d}".format(database.DEF_BATCH_SIZE))
+
+Similar.register()
+
+def main():
+    similar = Similar()
+    similar.parse_args()
+    similar.run()
+
+if __name__ == "__main__":
+    main()
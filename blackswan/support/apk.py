@@ -0,0 +1,544 @@
+__author__ = 'ivo'
+
+import base64
+import hashlib
+import logging
+import struct
+import zipfile
+
+from blackswan.support import hashing
+
+_log = logging.getLogger(__name__)
+
+EOCD_MAGIC = b"PK\x05\x06"
+EOCD_SIZE = 22
+MAX_COMMENT_SIZE = 0xffff
+SIGBLOCK_MAGIC = b"APK Sig Block 42"
+SIGBLOCK_IDS = {0x7109871a: "v2", 0xf05368c0: "v3", 0x1b93ad61: "v3.1"}
+V1_SIGNATURE_EXTENSIONS = (".RSA", ".DSA", ".EC")
+V1_MANIFEST = "META-INF/MANIFEST.MF"
+# v2 and v3 signature algorithm ids that are verified: (padding, digest of the signed data and of the content).
+# (EC)DSA and verity algorithms are not, signers using only those stay unverified.
+SIG_ALGORITHMS = {0x0101: ("pss", "sha256"), 0x0102: ("pss", "sha512"), 0x0103: ("pkcs1", "sha256"), 0x0104: ("pkcs1", "sha512")}
+CHUNK_SIZE = 1024 * 1024
+# digest names of jar manifests and signature files
+_MANIFEST_DIGESTS = {"SHA1": "sha1", "SHA-1": "sha1", "SHA-256": "sha256", "SHA-384": "sha384", "SHA-512": "sha512"}
+# DER tags
+SEQUENCE = 0x30
+SET = 0x31
+OID = 0x06
+INTEGER = 0x02
+BIT_STRING = 0x03
+OCTET_STRING = 0x04
+CONTEXT_0 = 0xa0
+# OIDs, as their DER content
+_DIGEST_OIDS = {b"\x2b\x0e\x03\x02\x1a": "sha1", b"\x60\x86\x48\x01\x65\x03\x04\x02\x01": "sha256",
+                b"\x60\x86\x48\x01\x65\x03\x04\x02\x02": "sha384", b"\x60\x86\x48\x01\x65\x03\x04\x02\x03": "sha512"}
+_PKCS1 = b"\x2a\x86\x48\x86\xf7\x0d\x01\x01"
+# rsaEncryption and sha1/sha256/sha384/sha512WithRSAEncryption
+_RSA_OIDS = tuple(_PKCS1 + bytes([n]) for n in (0x01, 0x05, 0x0b, 0x0c, 0x0d))
+_MESSAGE_DIGEST_OID = b"\x2a\x86\x48\x86\xf7\x0d\x01\x09\x04"
+# DER DigestInfo up to the digest, the payload of PKCS#1 v1.5 signatures
+_DIGEST_INFOS = {"sha1": bytes.fromhex("3021300906052b0e03021a05000414"),
+                 "sha256": bytes.fromhex("3031300d060960864801650304020105000420"),
+                 "sha384": bytes.fromhex("3041300d060960864801650304020205000430"),
+                 "sha512": bytes.fromhex("3051300d060960864801650304020305000440")}
+_STRING_TAGS = {0x0c: "utf-8", 0x13: "latin-1", 0x14: "latin-1", 0x16: "latin-1", 0x1e: "utf-16-be"}
+# attribute type OIDs (2.5.4.x) of distinguished names
+_NAME_ATTRIBUTES = {b"\x55\x04\x03": "CN", b"\x55\x04\x06": "C", b"\x55\x04\x07": "L", b"\x55\x04\x08": "ST",
+                    b"\x55\x04\x0a": "O", b"\x55\x04\x0b": "OU"}
+
+class ApkError(Exception):
+    pass
+
+def _der(data, pos):
+    """
+    @return: (tag, start of the content, end of the content) of the DER element at pos
+    """
+    if pos + 2 > len(data):
+        raise ApkError("Truncated DER element")
+    tag = data[pos]
+    length = data[pos + 1]
+    pos += 2
+    if length & 0x80:
+        nbytes = length & 0x7f
+        length = int.from_bytes(data[pos:pos + nbytes], "big")
+        pos += nbytes
+    if pos + length > len(data):
+        raise ApkError("Truncated DER element")
+    return (tag, pos, pos + length)
+
+def _der_children(data, start, end):
+    """
+    Generator function.
+    @yield: (tag, element start, content start, content end) of the elements between start and end
+    """
+    pos = start
+    while pos < end:
+        (tag, cstart, cend) = _der(data, pos)
+        yield (tag, pos, cstart, cend)
+        pos = cend
+
+def _name(data, start, end):
+    """
+    @return: the distinguished name between start and end as a string like "CN=Android, O=Google Inc., C=US"
+    """
+    parts = []
+    for (_, _, rdnstart, rdnend) in _der_children(data, start, end):
+        for (_, _, atvstart, atvend) in _der_children(data, rdnstart, rdnend):
+            ((oidtag, _, oidstart, oidend), (valtag, _, valstart, valend)) = list(_der_children(data, atvstart, atvend))[:2]
+            label = _NAME_ATTRIBUTES.get(bytes(data[oidstart:oidend]))
+            if label is None:
+                continue
+            value = bytes(data[valstart:valend]).decode(_STRING_TAGS.get(valtag, "latin-1"), errors="replace")
+            parts.append("{}={}".format(label, value))
+    return ", ".join(parts)
+
+def certificate_info(der):
+    """
+    @param der: a DER encoded X.509 certificate
+    @return: dict with the sha256 fingerprint (raw) of the certificate and its subject and issuer
+    """
+    (tag, start, end) = _der(der, 0)
+    (tbstag, _, tbsstart, tbsend) = next(_der_children(der, start, end))
+    fields = list(_der_children(der, tbsstart, tbsend))
+    if fields and fields[0][0] == CONTEXT_0:
+        fields = fields[1:]
+    # serial, signature algorithm, issuer, validity, subject
+    if tag != SEQUENCE or tbstag != SEQUENCE or len(fields) < 5:
+        raise ApkError("Not an X.509 certificate")
+    return {"fingerprint": hashlib.sha256(der).digest(),
+            "issuer": _name(der, fields[2][2], fields[2][3]),
+            "subject": _name(der, fields[4][2], fields[4][3])}
+
+def certificate_public_key(der):
+    """
+    @return: the DER encoded SubjectPublicKeyInfo of a certificate
+    """
+    (tag, start, end) = _der(der, 0)
+    (tbstag, _, tbsstart, tbsend) = next(_der_children(der, start, end))
+    fields = list(_der_children(der, tbsstart, tbsend))
+    if fields and fields[0][0] == CONTEXT_0:
+        fields = fields[1:]
+    if len(fields) < 6:
+        raise ApkError("Not an X.509 certificate")
+    return bytes(der[fields[5][1]:fields[5][3]])
+
+def rsa_public_key(spki):
+    """
+    @param spki: a DER encoded SubjectPublicKeyInfo
+    @return: (modulus, public exponent)
+    @raise ApkError: if it is not an RSA key
+    """
+    (tag, start, end) = _der(spki, 0)
+    ((algtag, _, algstart, algend), (keytag, _, keystart, keyend)) = list(_der_children(spki, start, end))[:2]
+    (oidtag, oidstart, oidend) = _der(spki, algstart)
+    if oidtag != OID or bytes(spki[oidstart:oidend]) != _RSA_OIDS[0] or keytag != BIT_STRING:
+        raise ApkError("Not an RSA public key")
+    (seqtag, seqstart, seqend) = _der(spki, keystart + 1)
+    numbers = [int.from_bytes(spki[cstart:cend], "big") for (numtag, _, cstart, cend) in _der_children(spki, seqstart, seqend) if numtag == INTEGER]
+    if len(numbers) != 2:
+        raise ApkError("Invalid RSA public key")
+    return tuple(numbers)
+
+def _rsa_message(key, signature):
+    """
+    @return: the encoded message of an RSA signature, None if the signature does not fit the key
+    """
+    (modulus, exponent) = key
+    size = (modulus.bit_length() + 7) // 8
+    value = int.from_bytes(signature, "big")
+    if len(signature) != size or value >= modulus:
+        return None
+    return pow(value, exponent, modulus).to_bytes(size, "big")
+
+def verify_pkcs1(key, digestname, digest, signature):
+    """
+    Verify an RSASSA-PKCS1-v1_5 signature.
+    @param digest: the digest of the signed data
+    @return: True if the signature is valid
+    """
+    message = _rsa_message(key, signature)
+    payload = _DIGEST_INFOS[digestname] + digest
+    if message is None or len(message) < len(payload) + 11:
+        return False
+    return message == b"\x00\x01" + b"\xff" * (len(message) - len(payload) - 3) + b"\x00" + payload
+
+def _mgf1(digestname, seed, length):
+    mask = b""
+    counter = 0
+    while len(mask) < length:
+        mask += hashlib.new(digestname, seed + struct.pack(">I", counter)).digest()
+        counter += 1
+    return mask[:length]
+
+def verify_pss(key, digestname, digest, signature, saltlen):
+    """
+    Verify an RSASSA-PSS signature with MGF1 over the same digest.
+    @param digest: the digest of the signed data
+    @return: True if the signature is valid
+    """
+    message = _rsa_message(key, signature)
+    if message is None:
+        return False
+    embits = key[0].bit_length() - 1
+    emlen = (embits + 7) // 8
+    if len(message) > emlen and message[0] != 0:
+        return False
+    message = message[-emlen:]
+    hlen = len(digest)
+    if emlen < hlen + saltlen + 2 or message[-1] != 0xbc:
+        return False
+    (masked, hashed) = (message[:emlen - hlen - 1], message[emlen - hlen - 1:-1])
+    unused = 8 * emlen - embits
+    if masked[0] & (0xff00 >> unused) & 0xff:
+        return False
+    block = bytearray(a ^ b for (a, b) in zip(masked, _mgf1(digestname, hashed, len(masked))))
+    block[0] &= 0xff >> unused
+    padlen = emlen - hlen - saltlen - 2
+    if any(block[:padlen]) or block[padlen] != 1:
+        return False
+    salt = bytes(block[len(block) - saltlen:]) if saltlen else b""
+    return hashlib.new(digestname, b"\x00" * 8 + digest + salt).digest() == hashed
+
+def _signed_data(data):
+    """
+    @return: list of the (tag, element start, content start, content end) of the fields of the PKCS#7 SignedData
+    """
+    (tag, start, end) = _der(data, 0)
+    children = list(_der_children(data, start, end))
+    if tag != SEQUENCE or len(children) < 2 or children[1][0] != CONTEXT_0:
+        raise ApkError("Not a PKCS#7 ContentInfo")
+    (sdtag, sdstart, sdend) = _der(data, children[1][2])
+    return list(_der_children(data, sdstart, sdend))
+
+def pkcs7_certificates(data):
+    """
+    @param data: a DER encoded PKCS#7 SignedData, like the META-INF/*.RSA file of a signed jar
+    @return: list of DER encoded certificates
+    """
+    for (childtag, elstart, cstart, cend) in _signed_data(data):
+        if childtag == CONTEXT_0:
+            return [bytes(data[certstart:certend]) for (_, certstart, _, certend) in _der_children(data, cstart, cend)]
+    return []
+
+def pkcs7_signer_infos(data):
+    """
+    @param data: a DER encoded PKCS#7 SignedData
+    @return: list of dicts with the digest name (None if unsupported), whether the signature is RSA, the DER encoded
+    authenticated attributes as they are signed (None if there are none), the messageDigest attribute and the
+    signature of every SignerInfo
+    """
+    fields = _signed_data(data)
+    if not fields or fields[-1][0] != SET:
+        raise ApkError("No PKCS#7 SignerInfos")
+    infos = []
+    for (_, _, sistart, siend) in _der_children(data, fields[-1][2], fields[-1][3]):
+        children = list(_der_children(data, sistart, siend))
+        (oidtag, oidstart, oidend) = _der(data, children[2][2])
+        info = {"digest": _DIGEST_OIDS.get(bytes(data[oidstart:oidend])), "attributes": None, "message_digest": None}
+        pos = 3
+        if children[pos][0] == CONTEXT_0:
+            (_, elstart, astart, aend) = children[pos]
+            # the attributes are signed with the SET OF tag instead of the implicit context tag
+            info["attributes"] = bytes([SET]) + bytes(data[elstart + 1:aend])
+            for (_, _, attrstart, attrend) in _der_children(data, astart, aend):
+                ((_, _, typestart, typeend), (_, _, valstart, valend)) = list(_der_children(data, attrstart, attrend))[:2]
+                if bytes(data[typestart:typeend]) == _MESSAGE_DIGEST_OID:
+                    (valtag, digeststart, digestend) = _der(data, valstart)
+                    info["message_digest"] = bytes(data[digeststart:digestend])
+            pos += 1
+        (oidtag, oidstart, oidend) = _der(data, children[pos][2])
+        info["rsa"] = bytes(data[oidstart:oidend]) in _RSA_OIDS
+        if children[pos + 1][0] != OCTET_STRING:
+            raise ApkError("No PKCS#7 signature")
+        info["signature"] = bytes(data[children[pos + 1][2]:children[pos + 1][3]])
+        infos.append(info)
+    return infos
+
+def manifest_sections(data):
+    """
+    @param data: a jar manifest or signature file
+    @return: list of dicts of the attributes of every section, the main section first
+    """
+    sections = []
+    attributes = {}
+    last = None
+    for line in data.decode("utf-8", errors="replace").replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        if not line:
+            if attributes:
+                sections.append(attributes)
+            attributes = {}
+            last = None
+        elif line.startswith(" ") and last is not None:
+            attributes[last] += line[1:]
+        else:
+            (key, sep, value) = line.partition(": ")
+            if not sep:
+                raise ApkError("Invalid manifest line {}".format(line))
+            attributes[key] = value
+            last = key
+    if attributes:
+        sections.append(attributes)
+    return sections
+
+def _manifest_digests(attributes, suffix):
+    """
+    @return: list of (digest name, raw digest) of the digest attributes that end with suffix
+    """
+    digests = []
+    for (key, value) in attributes.items():
+        if key.endswith(suffix) and key[:-len(suffix)].upper() in _MANIFEST_DIGESTS:
+            digests.append((_MANIFEST_DIGESTS[key[:-len(suffix)].upper()], base64.b64decode(value)))
+    return digests
+
+def _is_v1_signature_file(name):
+    upper = name.upper()
+    return upper.startswith("META-INF/") and upper.count("/") == 1 and (upper == V1_MANIFEST or upper.endswith((".SF",) + V1_SIGNATURE_EXTENSIONS))
+
+def verify_manifest(manifest, members):
+    """
+    Check that the jar manifest lists every member but the signature files with a digest that matches.
+    @param members: the member dicts of inspect, with their raw digests
+    @return: True if every member is covered by a digest that matches
+    """
+    if manifest is None:
+        return False
+    entries = {section["Name"]: section for section in manifest_sections(manifest)[1:] if "Name" in section}
+    for member in members:
+        if _is_v1_signature_file(member["name"]):
+            continue
+        digests = _manifest_digests(entries.get(member["name"], {}), "-Digest")
+        if not digests or any(member.get(name) != digest for (name, digest) in digests):
+            return False
+    return True
+
+def v1_signers(sigfile, sf, manifest, manifest_verified):
+    """
+    Verify a v1 (jar) signature: the PKCS#7 signature over the .SF file, the digest of the manifest in the .SF file and,
+    passed in, the digests of the members in the manifest. Only RSA signatures are verified.
+    @param sigfile: the META-INF/*.RSA, .DSA or .EC file
+    @param sf: the .SF file of the same name, None if missing
+    @param manifest_verified: whether the manifest covers all members, see verify_manifest
+    @return: list of signer dicts: the certificates that made a valid signature with verified True, or else all
+    certificates of the signature file with verified False
+    """
+    certificates = pkcs7_certificates(sigfile)
+    signing = []
+    if sf is not None and manifest_verified and manifest is not None:
+        sfdigests = _manifest_digests(manifest_sections(sf)[0], "-Digest-Manifest")
+        if sfdigests and all(hashlib.new(name, manifest).digest() == digest for (name, digest) in sfdigests):
+            for info in pkcs7_signer_infos(sigfile):
+                if info["digest"] is None or not info["rsa"]:
+                    continue
+                signed = sf
+                if info["attributes"] is not None:
+                    if info["message_digest"] != hashlib.new(info["digest"], sf).digest():
+                        continue
+                    signed = info["attributes"]
+                digest = hashlib.new(info["digest"], signed).digest()
+                for der in certificates:
+                    try:
+                        key = rsa_public_key(certificate_public_key(der))
+                    except ApkError:
+                        continue
+                    if der not in signing and verify_pkcs1(key, info["digest"], digest, info["signature"]):
+                        signing.append(der)
+    if signing:
+        return [dict(certificate_info(der), scheme="v1", verified=True) for der in signing]
+    return [dict(certificate_info(der), scheme="v1", verified=False) for der in certificates]
+
+def _length_prefixed(data):
+    """
+    Generator function. Split the uint32 length prefixed items of an APK signing block value.
+    """
+    pos = 0
+    while pos + 4 <= len(data):
+        (length,) = struct.unpack_from("<I", data, pos)
+        if pos + 4 + length > len(data):
+            raise ApkError("Truncated APK signing block")
+        yield data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+
+def signing_block(fp):
+    """
+    Read the APK Signing Block, which sits between the last zip member and the central directory.
+    @return: dict of block id to value, empty if the APK has none
+    """
+    return _signing_block(fp)[0]
+
+def _signing_block(fp):
+    """
+    @return: (dict of block id to value, offset of the block, offset of the central directory, offset of the end of
+    central directory record) of an APK
+    """
+    fp.seek(0, 2)
+    size = fp.tell()
+    tailsize = min(size, EOCD_SIZE + MAX_COMMENT_SIZE)
+    fp.seek(size - tailsize)
+    tail = fp.read(tailsize)
+    eocd = tail.rfind(EOCD_MAGIC)
+    if eocd < 0 or eocd + EOCD_SIZE > len(tail):
+        raise ApkError("No zip end of central directory")
+    (cdoffset,) = struct.unpack_from("<I", tail, eocd + 16)
+    eocdoffset = size - tailsize + eocd
+    if cdoffset < 24:
+        return ({}, cdoffset, cdoffset, eocdoffset)
+    fp.seek(cdoffset - 24)
+    footer = fp.read(24)
+    if footer[8:] != SIGBLOCK_MAGIC:
+        return ({}, cdoffset, cdoffset, eocdoffset)
+    (blocksize,) = struct.unpack_from("<Q", footer, 0)
+    if blocksize + 8 > cdoffset:
+        raise ApkError("Invalid APK signing block size")
+    fp.seek(cdoffset - blocksize - 8)
+    block = fp.read(blocksize - 24 + 8)[8:]
+    pairs = {}
+    pos = 0
+    while pos + 12 <= len(block):
+        (length, blockid) = struct.unpack_from("<QI", block, pos)
+        pairs[blockid] = block[pos + 12:pos + 8 + length]
+        pos += 8 + length
+    return (pairs, cdoffset - blocksize - 8, cdoffset, eocdoffset)
+
+def content_digests(fp, blockoffset, cdoffset, eocdoffset, digestnames):
+    """
+    Compute the digests v2 and v3 signatures sign: the chunked digest of the zip entries, the central directory and the
+    end of central directory record pointing at the signing block instead of the central directory.
+    @return: dict of digest name to raw digest
+    """
+    chunkdigests = {name: [] for name in digestnames}
+    fp.seek(eocdoffset)
+    eocd = bytearray(fp.read())
+    struct.pack_into("<I", eocd, 16, blockoffset)
+    for (start, end) in ((0, blockoffset), (cdoffset, eocdoffset), (None, None)):
+        if start is not None:
+            fp.seek(start)
+        remaining = len(eocd) if start is None else end - start
+        while remaining > 0:
+            chunk = bytes(eocd) if start is None else fp.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ApkError("Truncated APK")
+            prefix = b"\xa5" + struct.pack("<I", len(chunk))
+            for name in digestnames:
+                chunkdigests[name].append(hashlib.new(name, prefix + chunk).digest())
+            remaining -= len(chunk)
+    return {name: hashlib.new(name, b"\x5a" + struct.pack("<I", len(chunks)) + b"".join(chunks)).digest()
+            for (name, chunks) in chunkdigests.items()}
+
+def _pairs(data):
+    """
+    @return: list of (uint32 id, length prefixed value) of the length prefixed items of data
+    """
+    pairs = []
+    for item in _length_prefixed(data):
+        (pairid,) = struct.unpack_from("<I", item, 0)
+        pairs.append((pairid, next(_length_prefixed(item[4:]))))
+    return pairs
+
+def scheme_signers(value, scheme):
+    """
+    Parse the signers of a v2 or v3 APK signature scheme block.
+    @return: list of dicts with the signed data, the certificates, the (algorithm id, digest) pairs of the signed data,
+    the (algorithm id, signature) pairs and the public key of every signer
+    """
+    signers = []
+    for signerseq in _length_prefixed(value):
+        for signer in _length_prefixed(signerseq):
+            (length,) = struct.unpack_from("<I", signer, 0)
+            signeddata = signer[4:4 + length]
+            pos = 4 + length
+            if scheme != "v2":
+                # minimum and maximum SDK version
+                pos += 8
+            (signatures, publickey) = list(_length_prefixed(signer[pos:]))[:2]
+            (digests, certificates) = list(_length_prefixed(signeddata))[:2]
+            signers.append({"signed_data": signeddata, "certificates": list(_length_prefixed(certificates)),
+                            "digests": _pairs(digests), "signatures": _pairs(signatures), "public_key": publickey})
+    return signers
+
+def verify_scheme_signer(signer, contentdigests):
+    """
+    Verify a v2 or v3 signer: every signature with a supported algorithm over its signed data with its public key, the
+    public key against its certificate and the content digests it signed.
+    @param contentdigests: dict of digest name to the content digest of the APK, see content_digests
+    @return: True if the signer has a supported signature and all of them are valid
+    """
+    if not signer["certificates"] or certificate_public_key(signer["certificates"][0]) != bytes(signer["public_key"]):
+        return False
+    if [algid for (algid, _) in signer["digests"]] != [algid for (algid, _) in signer["signatures"]]:
+        return False
+    try:
+        key = rsa_public_key(signer["public_key"])
+    except ApkError:
+        return False
+    digests = dict(signer["digests"])
+    verified = False
+    for (algid, signature) in signer["signatures"]:
+        if algid not in SIG_ALGORITHMS:
+            continue
+        (padding, digestname) = SIG_ALGORITHMS[algid]
+        digest = hashlib.new(digestname, signer["signed_data"]).digest()
+        if padding == "pss":
+            valid = verify_pss(key, digestname, digest, bytes(signature), saltlen=len(digest))
+        else:
+            valid = verify_pkcs1(key, digestname, digest, bytes(signature))
+        if not valid or bytes(digests[algid]) != contentdigests.get(digestname):
+            return False
+        verified = True
+    return verified
+
+def inspect(fp, digests=hashing.DIGESTS, bufsize=None):
+    """
+    Hash all members of an APK or JAR and collect and verify its signers. Members are streamed from the archive into
+    the hashers, nothing is extracted. Signers are verified as far as RSA signatures go, see v1_signers and
+    verify_scheme_signer.
+    @param fp: seekable binary file object
+    @return: dict with "members", a list of dicts with the name, sizes, crc and digests (raw) of every member,
+    "signers", a list of dicts with the signature scheme, fingerprint, subject and issuer of every signer certificate
+    and whether its signature is verified, and "error", why signatures could not be read or None
+    @raise zipfile.BadZipFile: if the file is not a valid archive
+    """
+    hasher = hashing.thread_hasher(digests=digests, bufsize=bufsize)
+    members = []
+    signers = []
+    error = None
+    sigfiles = {}
+    with zipfile.ZipFile(fp) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            with zf.open(info) as mfh:
+                member = hasher.hash_file(mfh, hexdigest=False)
+            member.update(name=info.filename, size=info.file_size, compressed_size=info.compress_size, crc=info.CRC)
+            members.append(member)
+            if _is_v1_signature_file(info.filename):
+                sigfiles[info.filename.upper()] = zf.read(info)
+    manifest = sigfiles.get(V1_MANIFEST)
+    manifest_verified = None
+    for (name, sigfile) in sorted(sigfiles.items()):
+        if not name.endswith(V1_SIGNATURE_EXTENSIONS):
+            continue
+        try:
+            if manifest_verified is None:
+                manifest_verified = verify_manifest(manifest, members)
+            signers.extend(v1_signers(sigfile, sigfiles.get(name.rsplit(".", 1)[0] + ".SF"), manifest, manifest_verified))
+        except (ApkError, ValueError, IndexError, StopIteration, struct.error) as err:
+            error = "Invalid signature {}: {}".format(name, err)
+    try:
+        (pairs, blockoffset, cdoffset, eocdoffset) = _signing_block(fp)
+        schemes = [(SIGBLOCK_IDS[blockid], scheme_signers(value, SIGBLOCK_IDS[blockid])) for (blockid, value) in pairs.items() if blockid in SIGBLOCK_IDS]
+        digestnames = set(SIG_ALGORITHMS[algid][1] for (_, schemesigners) in schemes for signer in schemesigners
+                          for (algid, _) in signer["signatures"] if algid in SIG_ALGORITHMS)
+        contentdigests = content_digests(fp, blockoffset, cdoffset, eocdoffset, digestnames) if digestnames else {}
+        for (scheme, schemesigners) in schemes:
+            for signer in schemesigners:
+                verified = verify_scheme_signer(signer, contentdigests)
+                signers.extend([dict(certificate_info(der), scheme=scheme, verified=verified) for der in signer["certificates"][:1]])
+    except (ApkError, ValueError, IndexError, StopIteration, struct.error) as err:
+        error = "Invalid APK signing block: {}".format(err)
+    # a certificate is listed once per scheme
+    unique = {}
+    for signer in signers:
+        unique.setdefault((signer["scheme"], signer["fingerprint"]), signer)
+    return {"members": members, "signers": list(unique.values()), "error": error}
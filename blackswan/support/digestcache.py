@@ -0,0 +1,154 @@
+__author__ = 'ivo'
+
+import logging
+import struct
+import threading
+import time
+import zlib
+
+import sqlalchemy as sqla
+
+_log = logging.getLogger(__name__)
+
+DEF_MAX_ENTRIES = 10000000
+PREHASH_BLOCK = 64 * 1024
+KEY_MODES = ("stat", "prehash")
+VALUE_COLUMNS = ("md5", "sha1", "sha256", "magic", "mimetype", "ssdeep")
+
+_metadata = sqla.MetaData()
+_cachetable = sqla.Table("DigestCache", _metadata,
+                         sqla.Column("key", sqla.LargeBinary(64), primary_key=True),
+                         sqla.Column("md5", sqla.String(256)),
+                         sqla.Column("sha1", sqla.String(256)),
+                         sqla.Column("sha256", sqla.String(256)),
+                         sqla.Column("magic", sqla.String(4096)),
+                         sqla.Column("mimetype", sqla.String(1024)),
+                         sqla.Column("ssdeep", sqla.String(256)),
+                         sqla.Column("lastused", sqla.Float, index=True))
+
+def _open_binary(path):
+    return open(path, "rb")
+
+def stat_key(fullpath, sinfo, opener=_open_binary):
+    """
+    Key on (device, inode, size, mtime_ns). Only valid for the same mounted file system.
+    """
+    return b"s" + struct.pack("<QQQq", sinfo.st_dev, sinfo.st_ino, sinfo.st_size, sinfo.st_mtime_ns)
+
+def prehash_key(fullpath, sinfo, opener=_open_binary):
+    """
+    Key on the size and a crc32 of the first and last block. Stable across images and mounts, but not collision
+    proof: files that only differ in the middle share a key, so a hit is only a candidate, see DigestCache.confirm.
+    """
+    with opener(fullpath) as ifh:
+        head = ifh.read(PREHASH_BLOCK)
+        if sinfo.st_size > 2 * PREHASH_BLOCK:
+            ifh.seek(-PREHASH_BLOCK, 2)
+        tail = ifh.read(PREHASH_BLOCK)
+    return b"p" + struct.pack("<QII", sinfo.st_size, zlib.crc32(head), zlib.crc32(tail))
+
+class DigestCache(object):
+    '''
+    Persistent cache of file digests and magic, shared across explore runs.
+    Stored in a sqlite file and capped at maxentries, evicting the least recently used entries on close. New entries
+    and the last use of hits are written in batches of batch_size.
+    Thread safe: lookups and stores of all threads share one connection behind a lock.
+    With prehash keys the caller has to confirm a hit with the sha256 of the file before using it (confirm is True).
+    '''
+    def __init__(self, path, maxentries=DEF_MAX_ENTRIES, keymode="stat", batch_size=1000):
+        if keymode not in KEY_MODES:
+            raise Exception("Unknown cache key mode {}".format(keymode))
+        self.path = path
+        self.maxentries = maxentries
+        self.key = stat_key if keymode == "stat" else prehash_key
+        self.confirm = keymode == "prehash"
+        self.batch_size = batch_size
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._used = {}
+        self._engine = sqla.create_engine("sqlite:///{}".format(path), connect_args={"check_same_thread": False})
+        _metadata.create_all(self._engine)
+        self._conn = self._engine.connect()
+        if "ssdeep" not in [col["name"] for col in sqla.inspect(self._engine).get_columns(_cachetable.name)]:
+            # caches from before fuzzy hashing
+            trans = self._conn.begin()
+            self._conn.execute(sqla.text("ALTER TABLE {} ADD COLUMN ssdeep VARCHAR(256)".format(_cachetable.name)))
+            trans.commit()
+        self._select = sqla.select(*[_cachetable.c[col] for col in VALUE_COLUMNS]).where(_cachetable.c.key == sqla.bindparam("_key"))
+        self._insert = _cachetable.insert().prefix_with("OR REPLACE")
+        self._touch = _cachetable.update().where(_cachetable.c.key == sqla.bindparam("_key")).values(lastused=sqla.bindparam("_lastused"))
+        _log.debug("Digest cache %s opened (%s keys)", path, keymode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def get(self, key):
+        """
+        @return: dict with the cached VALUE_COLUMNS or None
+        """
+        with self._lock:
+            values = self._pending.get(key)
+            if values is None:
+                trans = self._conn.begin()
+                row = self._conn.execute(self._select, {"_key": key}).first()
+                trans.commit()
+                if row is not None:
+                    values = dict(zip(VALUE_COLUMNS, row))
+            if values is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used[key] = time.time()
+            if len(self._used) >= self.batch_size:
+                self._flush()
+            return dict((col, values[col]) for col in VALUE_COLUMNS)
+
+    def put(self, key, values):
+        with self._lock:
+            self._pending[key] = dict(((col, values.get(col)) for col in VALUE_COLUMNS), key=key, lastused=time.time())
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        trans = self._conn.begin()
+        if self._pending:
+            self._conn.execute(self._insert, list(self._pending.values()))
+        used = [{"_key": key, "_lastused": lastused} for (key, lastused) in self._used.items() if key not in self._pending]
+        if used:
+            self._conn.execute(self._touch, used)
+        trans.commit()
+        self._pending = {}
+        self._used = {}
+
+    def evict(self):
+        """
+        Drop the least recently used entries above maxentries.
+        @return: number of entries evicted
+        """
+        with self._lock:
+            self._flush()
+            trans = self._conn.begin()
+            count = self._conn.execute(sqla.select(sqla.func.count()).select_from(_cachetable)).scalar()
+            excess = count - self.maxentries
+            if excess > 0:
+                oldest = sqla.select(_cachetable.c.key).order_by(_cachetable.c.lastused).limit(excess)
+                self._conn.execute(_cachetable.delete().where(_cachetable.c.key.in_(oldest)))
+            trans.commit()
+        if excess > 0:
+            _log.info("Evicted %d entries from digest cache %s", excess, self.path)
+            return excess
+        return 0
+
+    def close(self):
+        if self._conn is None:
+            return
+        self.evict()
+        self._conn.close()
+        self._conn = None
+        self._engine.dispose()
+        _log.info("Digest cache %s: %d hits, %d misses", self.path, self.hits, self.misses)
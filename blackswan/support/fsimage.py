@@ -0,0 +1,593 @@
+__author__ = 'ivo'
+
+import io
+import os
+import stat
+import bisect
+import struct
+import logging
+
+_log = logging.getLogger(__name__)
+
+class ImageError(Exception):
+    pass
+
+class FileSource(object):
+    '''
+    Positional reads from a file. Thread safe since no file position is shared.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = os.fstat(self.fd).st_size
+
+    def preadinto(self, view, offset):
+        """
+        Read into view at offset, until view is full or the end of the source is reached.
+        @return: number of bytes read
+        """
+        total = 0
+        while total < len(view):
+            n = os.preadv(self.fd, [view[total:]], offset + total)
+            if not n:
+                break
+            total += n
+        return total
+
+    def pread(self, size, offset):
+        buf = bytearray(size)
+        n = self.preadinto(memoryview(buf), offset)
+        return bytes(buf[:n])
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+RUN_RAW = 0
+RUN_FILL = 1
+RUN_ZERO = 2
+
+class RunReader(object):
+    '''
+    A virtual byte range assembled from runs of another source: raw data at some physical offset, a repeated 4 byte
+    fill pattern or zeroes. Bytes not covered by any run read as zeroes.
+    '''
+    def __init__(self, source, runs, size):
+        """
+        @param runs: list of (logical offset, length, kind, physical offset or fill pattern)
+        """
+        self.source = source
+        self.runs = sorted(runs)
+        self.size = size
+        self._starts = [run[0] for run in self.runs]
+
+    def first_offset(self):
+        """
+        @return: physical offset of the first raw run, used to read files in on-disk order
+        """
+        for (_, _, kind, arg) in self.runs:
+            if kind == RUN_RAW:
+                return arg
+        return 0
+
+    def preadinto(self, view, offset):
+        end = min(offset + len(view), self.size)
+        if offset >= end:
+            return 0
+        pos = offset
+        idx = max(bisect.bisect_right(self._starts, offset) - 1, 0)
+        while pos < end:
+            if idx < len(self.runs) and self.runs[idx][0] + self.runs[idx][1] <= pos:
+                idx += 1
+                continue
+            if idx >= len(self.runs) or self.runs[idx][0] > pos:
+                # hole up to the next run
+                holeend = end if idx >= len(self.runs) else min(end, self.runs[idx][0])
+                view[pos - offset:holeend - offset] = bytes(holeend - pos)
+                pos = holeend
+                continue
+            (start, length, kind, arg) = self.runs[idx]
+            runend = min(end, start + length)
+            sub = view[pos - offset:runend - offset]
+            if kind == RUN_RAW:
+                n = self.source.preadinto(sub, arg + pos - start)
+                if n < len(sub):
+                    sub[n:] = bytes(len(sub) - n)
+            elif kind == RUN_FILL:
+                skew = (pos - start) % len(arg)
+                pattern = (arg[skew:] + arg[:skew]) * (len(sub) // len(arg) + 1)
+                sub[:] = pattern[:len(sub)]
+            else:
+                sub[:] = bytes(len(sub))
+            pos = runend
+            idx += 1
+        return end - offset
+
+    def pread(self, size, offset):
+        buf = bytearray(size)
+        n = self.preadinto(memoryview(buf), offset)
+        return bytes(buf[:n])
+
+    def close(self):
+        self.source.close()
+
+class ImageFileIO(io.RawIOBase):
+    '''
+    Read only file object over a RunReader, with its own file position.
+    '''
+    def __init__(self, reader):
+        super().__init__()
+        self.reader = reader
+        self.size = reader.size
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        view = memoryview(b).cast("B")
+        n = self.reader.preadinto(view, self._pos)
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        else:
+            self._pos = self.size + offset
+        self._pos = max(self._pos, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
+
+SPARSE_MAGIC = 0xed26ff3a
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+def desparse(source):
+    """
+    De-sparse an Android sparse image on the fly. No data is copied: the chunks are mapped as runs.
+    See ext4_utils/sparse_format.h for the format.
+    @return: RunReader presenting the raw image
+    """
+    header = source.pread(28, 0)
+    (magic, major, minor, file_hdr_sz, chunk_hdr_sz, blk_sz, total_blks, total_chunks, checksum) = struct.unpack("<I4H4I", header)
+    if magic != SPARSE_MAGIC:
+        raise ImageError("Not a sparse image")
+    if major != 1:
+        raise ImageError("Unsupported sparse image version {:d}".format(major))
+    runs = []
+    offset = file_hdr_sz
+    block = 0
+    for _ in range(total_chunks):
+        (chunk_type, _, chunk_sz, total_sz) = struct.unpack("<2H2I", source.pread(12, offset))
+        data = offset + chunk_hdr_sz
+        length = chunk_sz * blk_sz
+        if chunk_type == CHUNK_TYPE_RAW:
+            runs.append((block * blk_sz, length, RUN_RAW, data))
+        elif chunk_type == CHUNK_TYPE_FILL:
+            pattern = source.pread(4, data)
+            if pattern == b"\0\0\0\0":
+                runs.append((block * blk_sz, length, RUN_ZERO, None))
+            else:
+                runs.append((block * blk_sz, length, RUN_FILL, pattern))
+        elif chunk_type not in (CHUNK_TYPE_DONT_CARE, CHUNK_TYPE_CRC32):
+            raise ImageError("Unknown sparse chunk type 0x{:x}".format(chunk_type))
+        block += chunk_sz
+        offset += total_sz
+    _log.debug("Sparse image: %d chunks, %d blocks of %d bytes", total_chunks, total_blks, blk_sz)
+    return RunReader(source, runs, total_blks * blk_sz)
+
+def _stat_result(mode, ino, nlink, uid, gid, size, atime, mtime, ctime):
+    return os.stat_result((mode, ino, 0, nlink, uid, gid, size, atime, mtime, ctime))
+
+class ImageEntry(object):
+    '''
+    A file inside an image: its path, stat info and, for regular files, the reader for its content.
+    '''
+    __slots__ = ("relpath", "sinfo", "reader")
+
+    def __init__(self, relpath, sinfo, reader=None):
+        self.relpath = relpath
+        self.sinfo = sinfo
+        self.reader = reader
+
+class FsImage(object):
+    '''
+    Base for file system images that are read without mounting.
+    Subclasses fill self.entries with the non-directory ImageEntries, in the order they are best read.
+    '''
+    imagetype = None
+
+    def __init__(self, source):
+        self.source = source
+        self.entries = []
+        self._byrelpath = None
+
+    def files(self):
+        """
+        Generator function. Same contract as Explore.files: the relpath doubles as the path to open.
+        @yield: (relpath, relpath, stat result)
+        """
+        for entry in self.entries:
+            yield (entry.relpath, entry.relpath, entry.sinfo)
+
+    def count_files(self):
+        return len(self.entries)
+
+    def open(self, relpath):
+        if self._byrelpath is None:
+            self._byrelpath = {entry.relpath: entry for entry in self.entries}
+        entry = self._byrelpath.get(relpath)
+        if entry is None or entry.reader is None:
+            raise IOError("No regular file {} in image".format(relpath))
+        return ImageFileIO(entry.reader)
+
+    def _sort_entries(self):
+        # Reading the files in on-disk order turns ingestion into one sequential pass over the image.
+        self.entries.sort(key=lambda entry: (entry.reader.first_offset() if entry.reader is not None else -1, entry.relpath))
+
+    def close(self):
+        self.source.close()
+
+EXT4_MAGIC = 0xEF53
+EXT4_INCOMPAT_FILETYPE = 0x2
+EXT4_INCOMPAT_64BIT = 0x80
+EXT4_EXTENTS_FL = 0x80000
+EXT4_INLINE_DATA_FL = 0x10000000
+EXT4_XATTR_MAGIC = 0xEA020000
+EXT4_XATTR_INDEX_SYSTEM = 7
+# size of the ext2 inode, the in-inode extended attributes follow the extra fields after it
+EXT4_GOOD_OLD_INODE_SIZE = 128
+EXTENT_MAGIC = 0xF30A
+EXT4_ROOT_INO = 2
+
+class Ext4Image(FsImage):
+    '''
+    Reads an ext2/3/4 file system: superblock, group descriptors, inodes, extent trees, classic block maps and inline
+    data. Directories are read linearly, which also covers htree indexed directories.
+    '''
+    imagetype = "ext4"
+
+    def __init__(self, source):
+        super().__init__(source)
+        sb = source.pread(1024, 1024)
+        if len(sb) < 1024 or struct.unpack_from("<H", sb, 0x38)[0] != EXT4_MAGIC:
+            raise ImageError("Not an ext4 file system")
+        (self.inodes_count, blocks_lo, _, _, _, self.first_data_block, log_block_size, _, self.blocks_per_group, _,
+         self.inodes_per_group) = struct.unpack_from("<11I", sb, 0)
+        self.block_size = 1024 << log_block_size
+        rev_level = struct.unpack_from("<I", sb, 0x4C)[0]
+        self.inode_size = struct.unpack_from("<H", sb, 0x58)[0] if rev_level else 128
+        self.feature_incompat = struct.unpack_from("<I", sb, 0x60)[0]
+        blocks_hi = 0
+        self.desc_size = 32
+        if self.feature_incompat & EXT4_INCOMPAT_64BIT:
+            blocks_hi = struct.unpack_from("<I", sb, 0x150)[0]
+            self.desc_size = struct.unpack_from("<H", sb, 0xFE)[0] or 32
+        self.blocks_count = blocks_lo | (blocks_hi << 32)
+        groups = -(-(self.blocks_count - self.first_data_block) // self.blocks_per_group)
+        gdt = source.pread(groups * self.desc_size, (self.first_data_block + 1) * self.block_size)
+        self.inode_tables = []
+        for group in range(groups):
+            table = struct.unpack_from("<I", gdt, group * self.desc_size + 8)[0]
+            if self.desc_size >= 64:
+                table |= struct.unpack_from("<I", gdt, group * self.desc_size + 0x28)[0] << 32
+            self.inode_tables.append(table)
+        _log.debug("ext4: %d blocks of %d bytes, %d groups, %d byte inodes", self.blocks_count, self.block_size, groups, self.inode_size)
+        self._walk()
+        self._sort_entries()
+
+    def read_inode(self, ino):
+        """
+        @return: (stat result, flags, raw inode)
+        """
+        (group, index) = divmod(ino - 1, self.inodes_per_group)
+        raw = self.source.pread(self.inode_size, self.inode_tables[group] * self.block_size + index * self.inode_size)
+        (mode, uid, size_lo, atime, ctime, mtime, _, gid, nlink, _, flags) = struct.unpack_from("<2H5I2H2I", raw, 0)
+        size_hi = struct.unpack_from("<I", raw, 108)[0]
+        (uid_hi, gid_hi) = struct.unpack_from("<2H", raw, 120)
+        sinfo = _stat_result(mode, ino, nlink, uid | (uid_hi << 16), gid | (gid_hi << 16), size_lo | (size_hi << 32), atime, mtime, ctime)
+        return (sinfo, flags, raw)
+
+    @staticmethod
+    def inline_data(inode):
+        """
+        @param inode: raw inode with the inline data flag
+        @return: the inline data: the i_block bytes followed by the value of the system.data extended attribute, which
+        is always stored in the inode itself
+        """
+        data = inode[40:100]
+        if len(inode) <= EXT4_GOOD_OLD_INODE_SIZE + 2:
+            return data
+        pos = EXT4_GOOD_OLD_INODE_SIZE + struct.unpack_from("<H", inode, EXT4_GOOD_OLD_INODE_SIZE)[0]
+        if pos + 4 > len(inode) or struct.unpack_from("<I", inode, pos)[0] != EXT4_XATTR_MAGIC:
+            return data
+        # value offsets count from the first entry
+        first = pos + 4
+        pos = first
+        while pos + 16 <= len(inode) and struct.unpack_from("<I", inode, pos)[0] != 0:
+            (name_len, name_index, value_offs, value_inum, value_size) = struct.unpack_from("<BBHII", inode, pos)
+            if name_index == EXT4_XATTR_INDEX_SYSTEM and inode[pos + 16:pos + 16 + name_len] == b"data":
+                if value_inum or first + value_offs + value_size > len(inode):
+                    raise ImageError("Invalid inline data attribute")
+                return data + inode[first + value_offs:first + value_offs + value_size]
+            pos += (16 + name_len + 3) & ~3
+        return data
+
+    def _extent_runs(self, node, runs):
+        (magic, entries, _, depth) = struct.unpack_from("<4H", node, 0)
+        if magic != EXTENT_MAGIC:
+            raise ImageError("Corrupt extent header")
+        for i in range(entries):
+            off = 12 + i * 12
+            if depth:
+                (_, leaf_lo, leaf_hi) = struct.unpack_from("<IIH", node, off)
+                self._extent_runs(self.source.pread(self.block_size, ((leaf_hi << 32) | leaf_lo) * self.block_size), runs)
+            else:
+                (lblock, length, start_hi, start_lo) = struct.unpack_from("<IHHI", node, off)
+                if length > 32768:
+                    # uninitialized extent, reads as zeroes
+                    continue
+                runs.append((lblock * self.block_size, length * self.block_size, RUN_RAW, ((start_hi << 32) | start_lo) * self.block_size))
+        return runs
+
+    def _blockmap_runs(self, iblock, nblocks):
+        pointers_per_block = self.block_size // 4
+        runs = []
+        lblock = [0]
+
+        def add(pblock):
+            if pblock:
+                runs.append((lblock[0] * self.block_size, self.block_size, RUN_RAW, pblock * self.block_size))
+            lblock[0] += 1
+
+        def indirect(pblock, level):
+            if not pblock:
+                lblock[0] += pointers_per_block ** level
+                return
+            for ptr in struct.unpack("<{:d}I".format(pointers_per_block), self.source.pread(self.block_size, pblock * self.block_size)):
+                if lblock[0] >= nblocks:
+                    return
+                if level == 1:
+                    add(ptr)
+                else:
+                    indirect(ptr, level - 1)
+
+        pointers = struct.unpack("<15I", iblock)
+        for ptr in pointers[:12]:
+            if lblock[0] >= nblocks:
+                return runs
+            add(ptr)
+        for (level, ptr) in zip((1, 2, 3), pointers[12:]):
+            if lblock[0] >= nblocks:
+                break
+            indirect(ptr, level)
+        return runs
+
+    def inode_reader(self, sinfo, flags, inode):
+        if flags & EXT4_INLINE_DATA_FL:
+            data = Ext4Image.inline_data(inode)
+            if sinfo.st_size > len(data):
+                raise ImageError("Inline data of {:d} bytes is shorter than the file".format(len(data)))
+            return RunReader(InlineSource(data), [(0, sinfo.st_size, RUN_RAW, 0)], sinfo.st_size)
+        iblock = inode[40:100]
+        if flags & EXT4_EXTENTS_FL:
+            runs = self._extent_runs(iblock, [])
+        else:
+            runs = self._blockmap_runs(iblock, -(-sinfo.st_size // self.block_size))
+        return RunReader(self.source, runs, sinfo.st_size)
+
+    def _dir_entries(self, data):
+        """
+        Generator function.
+        @param data: directory blocks, or a part of inline directory data
+        @yield: (name, inode number) of the entries but . and ..
+        """
+        pos = 0
+        while pos + 8 <= len(data):
+            (ino, rec_len) = struct.unpack_from("<IH", data, pos)
+            if self.feature_incompat & EXT4_INCOMPAT_FILETYPE:
+                name_len = data[pos + 6]
+            else:
+                name_len = struct.unpack_from("<H", data, pos + 6)[0]
+            if rec_len < 8:
+                break
+            if ino:
+                name = data[pos + 8:pos + 8 + name_len].decode("utf-8", errors="surrogateescape")
+                if name not in (".", ".."):
+                    yield (name, ino)
+            pos += rec_len
+
+    def _walk(self):
+        seen = set()
+        stack = [("", EXT4_ROOT_INO)]
+        while stack:
+            (dirpath, dirino) = stack.pop()
+            (sinfo, flags, inode) = self.read_inode(dirino)
+            # a directory that cannot be read would silently leave its files out, so it fails the image
+            try:
+                if flags & EXT4_INLINE_DATA_FL:
+                    # the parent inode number, then entries up to the end of i_block and in the system.data attribute
+                    data = Ext4Image.inline_data(inode)
+                    entries = list(self._dir_entries(data[4:60])) + list(self._dir_entries(data[60:]))
+                else:
+                    reader = self.inode_reader(sinfo, flags, inode)
+                    entries = list(self._dir_entries(reader.pread(reader.size, 0)))
+            except (ImageError, struct.error) as err:
+                _log.error("Could not read directory %s: %s", dirpath or "/", err)
+                raise ImageError("Unreadable directory {}: {}".format(dirpath or "/", err))
+            subdirs = []
+            for (name, ino) in entries:
+                relpath = os.path.join(dirpath, name)
+                (sinfo, flags, inode) = self.read_inode(ino)
+                if stat.S_ISDIR(sinfo.st_mode):
+                    if ino not in seen:
+                        seen.add(ino)
+                        subdirs.append((relpath, ino))
+                    continue
+                reader = None
+                if stat.S_ISREG(sinfo.st_mode):
+                    try:
+                        reader = self.inode_reader(sinfo, flags, inode)
+                    except (ImageError, struct.error) as err:
+                        _log.warning("Could not map %s: %s", relpath, err)
+                self.entries.append(ImageEntry(relpath, sinfo, reader))
+            stack.extend(reversed(subdirs))
+
+class InlineSource(object):
+    '''
+    Source for data stored inside the inode itself.
+    '''
+    def __init__(self, data):
+        self.data = data
+
+    def preadinto(self, view, offset):
+        chunk = self.data[offset:offset + len(view)]
+        view[:len(chunk)] = chunk
+        return len(chunk)
+
+YAFFS_OBJECT_TYPE_FILE = 1
+YAFFS_OBJECT_TYPE_SYMLINK = 2
+YAFFS_OBJECT_TYPE_DIRECTORY = 3
+YAFFS_OBJECT_TYPE_HARDLINK = 4
+YAFFS_OBJECTID_ROOT = 1
+EXTRA_HEADER_INFO_FLAG = 0x80000000
+EXTRA_OBJECT_TYPE_MASK = 0x0FFFFFFF
+YAFFS_GEOMETRIES = ((2048, 64), (4096, 128), (512, 16), (1024, 32))
+
+class Yaffs2Image(FsImage):
+    '''
+    Reads a yaffs2 image as written by mkyaffs2image: data chunks each followed by a spare area that starts with the
+    packed tags (sequence number, object id, chunk id, byte count). Chunks with chunk id 0 hold object headers.
+    Later chunks override earlier ones, as in the file system itself.
+    '''
+    imagetype = "yaffs2"
+
+    def __init__(self, source, chunksize=None, sparesize=None):
+        super().__init__(source)
+        if chunksize is None:
+            (chunksize, sparesize) = Yaffs2Image.detect_geometry(source)
+        self.chunksize = chunksize
+        self.sparesize = sparesize
+        self._scan()
+        self._sort_entries()
+
+    @staticmethod
+    def _tags(source, offset, chunksize):
+        (seq, objid, chunkid, nbytes) = struct.unpack("<4I", source.pread(16, offset + chunksize))
+        return (seq, objid, chunkid, nbytes)
+
+    @staticmethod
+    def detect_geometry(source):
+        for (chunksize, sparesize) in YAFFS_GEOMETRIES:
+            if source.size % (chunksize + sparesize):
+                continue
+            (seq, objid, chunkid, nbytes) = Yaffs2Image._tags(source, 0, chunksize)
+            if (chunkid == 0 or chunkid & EXTRA_HEADER_INFO_FLAG) and 0 < (objid & EXTRA_OBJECT_TYPE_MASK) < 0x40000 and seq != 0xFFFFFFFF:
+                return (chunksize, sparesize)
+        raise ImageError("Could not determine yaffs2 chunk geometry")
+
+    def _scan(self):
+        headers = {}
+        chunks = {}
+        stride = self.chunksize + self.sparesize
+        for offset in range(0, self.source.size - stride + 1, stride):
+            (seq, objid, chunkid, nbytes) = Yaffs2Image._tags(self.source, offset, self.chunksize)
+            if seq in (0, 0xFFFFFFFF):
+                continue # erased or unused chunk
+            if chunkid == 0 or chunkid & EXTRA_HEADER_INFO_FLAG:
+                objid &= EXTRA_OBJECT_TYPE_MASK
+                headers[objid] = self._header(self.source.pread(512, offset))
+            else:
+                chunks.setdefault(objid, {})[chunkid] = (offset, nbytes)
+        _log.debug("yaffs2: %d objects in %d byte chunks", len(headers), self.chunksize)
+        self._build(headers, chunks)
+
+    @staticmethod
+    def _header(raw):
+        (objtype, parent) = struct.unpack_from("<Ii", raw, 0)
+        name = raw[10:266].split(b"\0", 1)[0].decode("utf-8", errors="surrogateescape")
+        (mode, uid, gid, atime, mtime, ctime, size, equiv) = struct.unpack_from("<7Ii", raw, 268)
+        return (objtype, parent, name, mode, uid, gid, atime, mtime, ctime, size, equiv)
+
+    def _path(self, headers, objid):
+        parts = []
+        while objid != YAFFS_OBJECTID_ROOT:
+            header = headers.get(objid)
+            if header is None or len(parts) > 256:
+                return None
+            parts.append(header[2])
+            objid = header[1]
+        return os.path.join(*reversed(parts)) if parts else ""
+
+    def _build(self, headers, chunks):
+        for (objid, header) in headers.items():
+            (objtype, parent, name, mode, uid, gid, atime, mtime, ctime, size, equiv) = header
+            if objtype == YAFFS_OBJECT_TYPE_DIRECTORY or objid == YAFFS_OBJECTID_ROOT:
+                continue
+            relpath = self._path(headers, objid)
+            if not relpath:
+                _log.warning("yaffs2 object %d is not connected to the root, skipping", objid)
+                continue
+            dataid = objid
+            if objtype == YAFFS_OBJECT_TYPE_HARDLINK:
+                if equiv not in headers:
+                    _log.warning("Hardlink %s to missing object %d, skipping", relpath, equiv)
+                    continue
+                dataid = equiv
+                (objtype, _, _, mode, uid, gid, atime, mtime, ctime, size, _) = headers[equiv]
+            reader = None
+            if objtype == YAFFS_OBJECT_TYPE_FILE:
+                runs = [((chunkid - 1) * self.chunksize, nbytes, RUN_RAW, offset) for (chunkid, (offset, nbytes)) in chunks.get(dataid, {}).items()]
+                reader = RunReader(self.source, runs, size)
+            sinfo = _stat_result(mode, dataid, 1, uid, gid, size, atime, mtime, ctime)
+            self.entries.append(ImageEntry(relpath, sinfo, reader))
+
+def image_type(path):
+    """
+    Cheap check whether open_image can read a file, without parsing the file system.
+    @return: "sparse ext4", "ext4", "yaffs2" or None
+    """
+    source = FileSource(path)
+    try:
+        if struct.unpack("<I", source.pread(4, 0).ljust(4, b"\0"))[0] == SPARSE_MAGIC:
+            return "sparse ext4"
+        if struct.unpack("<H", source.pread(2, 1024 + 0x38).ljust(2, b"\0"))[0] == EXT4_MAGIC:
+            return "ext4"
+        try:
+            Yaffs2Image.detect_geometry(source)
+            return "yaffs2"
+        except (ImageError, struct.error):
+            return None
+    finally:
+        source.close()
+
+def open_image(path):
+    """
+    Open a file system image for reading without mounting. Detects sparse ext4, ext4 and yaffs2 images.
+    @return: FsImage
+    """
+    source = FileSource(path)
+    try:
+        if struct.unpack("<I", source.pread(4, 0).ljust(4, b"\0"))[0] == SPARSE_MAGIC:
+            image = Ext4Image(desparse(source))
+            image.imagetype = "sparse ext4"
+        elif struct.unpack("<H", source.pread(2, 1024 + 0x38).ljust(2, b"\0"))[0] == EXT4_MAGIC:
+            image = Ext4Image(source)
+        else:
+            image = Yaffs2Image(source)
+    except Exception:
+        source.close()
+        raise
+    _log.info("Opened %s image %s: %d files", image.imagetype, path, image.count_files())
+    return image
@@ -0,0 +1,203 @@
+__author__ = 'ivo'
+
+import os
+import mmap
+import hashlib
+import threading
+import logging
+
+try:
+    import ssdeep
+except ImportError:
+    ssdeep = None
+try:
+    import ppdeep
+except ImportError:
+    ppdeep = None
+
+_log = logging.getLogger(__name__)
+
+DIGESTS = ("sha1", "md5", "sha256")
+MIN_BUF_SIZE = 64 * 1024
+MAX_BUF_SIZE = 1024 * 1024
+DEF_MMAP_THRESHOLD = 64 * 1024 * 1024
+# ppdeep needs the whole file in memory, larger files get no fuzzy hash
+MAX_PPDEEP_SIZE = 256 * 1024 * 1024
+
+_local = threading.local()
+
+def fuzzy_available():
+    return ssdeep is not None or ppdeep is not None
+
+def fuzzy_compare(hash1, hash2):
+    """
+    @return: ssdeep match score of two fuzzy hashes, 0 to 100
+    """
+    if ssdeep is not None:
+        return ssdeep.compare(hash1, hash2)
+    return ppdeep.compare(hash1, hash2)
+
+class FuzzyHash(object):
+    '''
+    Incremental ssdeep hash with the hashlib update interface. Streams with the ssdeep (libfuzzy) bindings; the
+    pure python ppdeep fallback buffers the data and is much slower.
+    '''
+    def __init__(self):
+        if ssdeep is not None:
+            self._hash = ssdeep.Hash()
+            self._buf = None
+        elif ppdeep is not None:
+            self._hash = None
+            self._buf = bytearray()
+        else:
+            raise Exception("Fuzzy hashing needs the ssdeep or ppdeep package")
+
+    def update(self, data):
+        if self._hash is not None:
+            self._hash.update(bytes(data))
+        elif self._buf is not None:
+            if len(self._buf) + len(data) > MAX_PPDEEP_SIZE:
+                self._buf = None
+            else:
+                self._buf += data
+
+    def digest(self):
+        """
+        @return: the ssdeep hash, or None if the data was too large for ppdeep
+        """
+        if self._hash is not None:
+            return self._hash.digest()
+        if self._buf is None:
+            return None
+        return ppdeep.hash(bytes(self._buf))
+
+class FileHasher(object):
+    '''
+    Computes several digests over a file in a single pass.
+    Data is read with readinto in a reused buffer, or fed straight from a memory map for large files, so no
+    objects are allocated per chunk. Not thread safe: use one instance per thread.
+    '''
+    def __init__(self, digests=DIGESTS, bufsize=None, mmap_threshold=DEF_MMAP_THRESHOLD, fuzzy=False):
+        '''
+        @param digests: names of the hashlib algorithms to compute
+        @param bufsize: read size in bytes. None means adaptive: the buffer grows with the files up to MAX_BUF_SIZE
+        @param mmap_threshold: files of at least this size are memory mapped. None disables mmap
+        @param fuzzy: also compute the ssdeep hash, returned as "ssdeep"
+        '''
+        for name in digests:
+            hashlib.new(name)
+        if fuzzy and not fuzzy_available():
+            raise Exception("Fuzzy hashing needs the ssdeep or ppdeep package")
+        self.digests = tuple(digests)
+        self.fuzzy = fuzzy
+        self.bufsize = bufsize
+        self.mmap_threshold = mmap_threshold
+        self._buf = bytearray(bufsize or MIN_BUF_SIZE)
+        self._view = memoryview(self._buf)
+        return
+
+    def _buffer_for(self, size):
+        if self.bufsize is None and size > len(self._buf) and len(self._buf) < MAX_BUF_SIZE:
+            self._buf = bytearray(min(max(size, MIN_BUF_SIZE), MAX_BUF_SIZE))
+            self._view = memoryview(self._buf)
+        return self._view
+
+    def hash_file(self, fp, hexdigest=True):
+        """
+        Hash an open binary file object from its current position, or a path.
+        @return: dict of digest name to (hex)digest
+        """
+        return self.hash_file_head(fp, hexdigest=hexdigest, headsize=0)[0]
+
+    def hash_file_head(self, fp, hexdigest=True, headsize=MAX_BUF_SIZE):
+        """
+        Hash a file like hash_file and also return its first headsize bytes, so the caller can inspect the file
+        without reading it again.
+        @return: (dict of digest name to (hex)digest, head bytes)
+        """
+        if isinstance(fp, str):
+            with open(fp, "rb") as ifh:
+                return self.hash_file_head(ifh, hexdigest=hexdigest, headsize=headsize)
+        hashers = self._hashers()
+        head = bytearray()
+        try:
+            size = os.fstat(fp.fileno()).st_size
+            mappable = True
+        except (AttributeError, OSError, ValueError):
+            # not backed by a file descriptor, e.g. a file inside an image
+            size = getattr(fp, "size", None)
+            mappable = False
+        if mappable and size and self.mmap_threshold is not None and size >= self.mmap_threshold and fp.tell() == 0:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # one pass over the map: every hasher takes a slice while it is still in the cpu caches
+                with memoryview(mm) as mmview:
+                    for pos in range(0, len(mm), MAX_BUF_SIZE):
+                        with mmview[pos:pos + MAX_BUF_SIZE] as chunk:
+                            for hasher in hashers:
+                                hasher.update(chunk)
+                if headsize:
+                    head = mm[:headsize]
+        else:
+            view = self._buffer_for(size or 0)
+            readinto = getattr(fp, "readinto", None)
+            while True:
+                if readinto is not None:
+                    n = readinto(view)
+                    if not n:
+                        break
+                    chunk = view[:n]
+                else:
+                    chunk = fp.read(len(view))
+                    if not chunk:
+                        break
+                for hasher in hashers:
+                    hasher.update(chunk)
+                if len(head) < headsize:
+                    head += chunk[:headsize - len(head)]
+        return (self._results(hashers, hexdigest), bytes(head))
+
+    def hash_chunks(self, chunks, hexdigest=True):
+        """
+        Hash data from an iterable of bytes-like chunks, e.g. a stream that is not a regular file.
+        @return: dict of digest name to (hex)digest
+        """
+        hashers = self._hashers()
+        for chunk in chunks:
+            for hasher in hashers:
+                hasher.update(chunk)
+        return self._results(hashers, hexdigest)
+
+    def _hashers(self):
+        hashers = [hashlib.new(name) for name in self.digests]
+        if self.fuzzy:
+            hashers.append(FuzzyHash())
+        return hashers
+
+    def _results(self, hashers, hexdigest):
+        if hexdigest:
+            res = {name: hasher.hexdigest() for (name, hasher) in zip(self.digests, hashers)}
+        else:
+            res = {name: hasher.digest() for (name, hasher) in zip(self.digests, hashers)}
+        if self.fuzzy:
+            res["ssdeep"] = hashers[-1].digest()
+        return res
+
+def thread_hasher(digests=DIGESTS, bufsize=None, mmap_threshold=DEF_MMAP_THRESHOLD, fuzzy=False):
+    """
+    Get a FileHasher with the given configuration that is private to the calling thread.
+    """
+    key = (tuple(digests), bufsize, mmap_threshold, fuzzy)
+    hashers = getattr(_local, "hashers", None)
+    if hashers is None:
+        hashers = _local.hashers = {}
+    if key not in hashers:
+        hashers[key] = FileHasher(digests=digests, bufsize=bufsize, mmap_threshold=mmap_threshold, fuzzy=fuzzy)
+    return hashers[key]
+
+def hash_file(fp, digests=DIGESTS, hexdigest=True, bufsize=None):
+    """
+    Hash a file object or path with the calling thread's hasher.
+    @return: tuple of (hex)digests in the order of digests
+    """
+    res = thread_hasher(digests=digests, bufsize=bufsize).hash_file(fp, hexdigest=hexdigest)
+    return tuple(res[name] for name in digests)
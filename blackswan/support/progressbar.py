@@ -1,57 +1,143 @@
 __author__ = 'ivo'
 
 import sys
-import os
+import json
 import math
+import time
+import shutil
+import logging
+import datetime
+
+from blackswan import config
+
+_log = logging.getLogger(__name__)
+
+MODES = ("auto", "bar", "log", "json", "none")
+# seconds between redraws of the bar and between log or json progress lines
+REDRAW_INTERVAL = 0.2
+REPORT_INTERVAL = 10.0
 
 class Progressbar(object):
     '''
-    Represents a simple progressbar.
-    Works only on linux systems.
+    Reports the progress of a long loop with its throughput and ETA: as a bar on a terminal, otherwise as periodic
+    log lines or JSON lines for other programs to read. update only adds to the counters and output is produced at
+    most once per interval, so it is cheap enough to call for every file. With a total of None only the count and
+    throughput are displayed.
     '''
-    def __init__(self, total, description, unit="MB", outstream=sys.stdout):
+    def __init__(self, total, description, unit="MB", outstream=None, mode=None, interval=None):
         '''
-        Constructor
+        @param mode: one of MODES. None means config.progress; auto is bar on a tty and log otherwise
+        @param interval: seconds between outputs. Default: REDRAW_INTERVAL for the bar, else REPORT_INTERVAL
         '''
         self.total = total
+        self.description = description
         self.cur = 0
-        self.stream = outstream
-        self.stream.write(description + "\n")
+        self.bytes = 0
+        self.stream = outstream if outstream is not None else sys.stdout
         self.unit = unit
-
-        (rows, columns) = os.popen('stty size', 'r').read().split()
-        self.width = int(columns) - len(self.unit) - 25
-        self.termwidth = int(columns)
+        mode = mode or config.progress
+        if mode == "auto":
+            isatty = getattr(self.stream, "isatty", None)
+            mode = "bar" if isatty is not None and isatty() else "log"
+        self.mode = mode
+        self.interval = interval if interval is not None else (REDRAW_INTERVAL if mode == "bar" else REPORT_INTERVAL)
+        self.started = time.monotonic()
+        self._next = self.started + self.interval
+        if self.mode == "bar":
+            self.stream.write(description + "\n")
+        elif self.mode == "log":
+            _log.info("%s", description)
         self.refresh()
         return
 
-    def update(self, amount, diff=True):
+    def update(self, amount, diff=True, nbytes=0):
+        '''
+        @param nbytes: bytes processed for this amount, for the MB/s figure
+        '''
         if diff:
             self.cur += amount
         else:
             self.cur = amount
-        self.refresh()
+        self.bytes += nbytes
+        now = time.monotonic()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.refresh()
         return
 
-    def refresh(self):
+    def stats(self):
+        """
+        @return: (elapsed seconds, items per second, MB per second, ETA in seconds or None)
+        """
+        elapsed = time.monotonic() - self.started
+        rate = self.cur / elapsed if elapsed > 0 else 0.0
+        mbps = self.bytes / 1024 / 1024 / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.total is not None and rate > 0:
+            eta = max(0, self.total - self.cur) / rate
+        return (elapsed, rate, mbps, eta)
+
+    def _status(self, done=False):
+        (elapsed, rate, mbps, eta) = self.stats()
+        fields = ["{:.0f} {}/s".format(rate, self.unit)]
+        if self.bytes:
+            fields.append("{:.1f} MB/s".format(mbps))
+        if done:
+            fields.append("in {}".format(datetime.timedelta(seconds=int(elapsed))))
+        elif eta is not None:
+            fields.append("ETA {}".format(datetime.timedelta(seconds=int(eta))))
+        return " ".join(fields)
+
+    def _percent(self):
         try:
-            prcnt = math.floor(self.cur/self.total * 100)
+            return min(100, math.floor(self.cur/self.total * 100))
         except ZeroDivisionError:
-            prcnt = 100
-        if self.width < 0:
-            prstr = "{:d}%".format(prcnt)
-        else:
-            fillwidth = round(prcnt/100 * self.width)
-            prstr = "[" + ("#"*fillwidth).ljust(self.width,"_") + "]" + " {:d}%".format(prcnt) + "({:d} / {:d} {})".format(self.cur, self.total, self.unit)
-        self.stream.write("\r" + prstr.ljust(self.termwidth-1))
-        #self.stream.write("\r{:d}%".format(round(self.cur/self.total)))
+            return 100
+
+    def refresh(self):
+        if self.mode == "bar":
+            self._draw()
+        elif self.mode == "log":
+            if self.total is None:
+                _log.info("%d %s, %s", self.cur, self.unit, self._status())
+            else:
+                _log.info("%d / %d %s (%d%%), %s", self.cur, self.total, self.unit, self._percent(), self._status())
+        elif self.mode == "json":
+            self._write_json(done=False)
         return
 
-    def finish(self):
-        if self.width > 0:
-            prstr = "[" + "#"*self.width + "]" + " 100% done!"
+    def _draw(self, done=False):
+        termwidth = shutil.get_terminal_size().columns
+        status = self._status(done=done)
+        if self.total is None:
+            prstr = "{:d} {} {}".format(self.cur, self.unit, status)
         else:
-            prstr = "100% done!\n"
-        self.stream.write("\r" + prstr.ljust(self.termwidth-1) + "\n")
+            prcnt = 100 if done else self._percent()
+            counts = " {:d}% ({:d} / {:d} {}) {}".format(prcnt, self.cur, self.total, self.unit, status)
+            width = termwidth - len(counts) - 3
+            if width < 10:
+                prstr = counts.strip()
+            else:
+                fillwidth = round(prcnt/100 * width)
+                prstr = "[" + ("#"*fillwidth).ljust(width, "_") + "]" + counts
+        self.stream.write("\r" + prstr[:termwidth - 1].ljust(termwidth - 1))
         self.stream.flush()
-        return
\ No newline at end of file
+
+    def _write_json(self, done):
+        (elapsed, rate, mbps, eta) = self.stats()
+        self.stream.write(json.dumps({"description": self.description, "done": done, "count": self.cur, "total": self.total,
+                                      "unit": self.unit, "bytes": self.bytes, "elapsed": round(elapsed, 3),
+                                      "rate": round(rate, 3), "mb_per_s": round(mbps, 3),
+                                      "eta": round(eta, 3) if eta is not None and not done else None}) + "\n")
+        self.stream.flush()
+
+    def finish(self):
+        if self.mode == "bar":
+            self._draw(done=True)
+            self.stream.write("\n")
+            self.stream.flush()
+        elif self.mode == "log":
+            _log.info("%s done: %d %s, %s", self.description, self.cur, self.unit, self._status(done=True))
+        elif self.mode == "json":
+            self._write_json(done=True)
+        return
@@ -0,0 +1,74 @@
+__author__ = 'ivo'
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+
+from blackswan.support import hashing
+
+BUF_SIZES = [4096, 64*1024, 256*1024, 1024*1024, 4*1024*1024]
+DIGEST_SETS = [("sha1", "md5", "sha256"), ("sha1",), ("sha256",), ("md5",)]
+
+def legacy_hash_file(fp):
+    """
+    The original Explore.hash_file: fixed 4 KiB reads and a new bytes object per chunk.
+    """
+    hasher_sha1 = hashlib.sha1()
+    hasher_md5 = hashlib.md5()
+    hasher_sha256 = hashlib.sha256()
+    while True:
+        chunk = fp.read(4096)
+        if not chunk:
+            break
+        hasher_sha1.update(chunk)
+        hasher_md5.update(chunk)
+        hasher_sha256.update(chunk)
+    return hasher_sha1.hexdigest(), hasher_md5.hexdigest(), hasher_sha256.hexdigest()
+
+def measure(func, paths, rounds):
+    total_bytes = sum(os.path.getsize(path) for path in paths)
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for path in paths:
+            with open(path, "rb") as ifh:
+                func(ifh)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return total_bytes / 1024 / 1024 / best if best else 0.0
+
+def configurations():
+    yield ("legacy 4K x3", legacy_hash_file)
+    for digests in DIGEST_SETS:
+        for bufsize in BUF_SIZES + [None]:
+            hasher = hashing.FileHasher(digests=digests, bufsize=bufsize, mmap_threshold=None)
+            yield ("{} buf={}".format("+".join(digests), bufsize or "adaptive"), hasher.hash_file)
+        hasher = hashing.FileHasher(digests=digests, mmap_threshold=0)
+        yield ("{} mmap".format("+".join(digests)), hasher.hash_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure hashing throughput (MB/s) of the hashing engine configurations")
+    parser.add_argument("files", nargs="*", help="Files to hash. Default: a generated file of --size MB")
+    parser.add_argument("--size", type=int, default=256, help="Size in MB of the generated file. Default: 256")
+    parser.add_argument("--rounds", type=int, default=3, help="Rounds per configuration, best is reported. Default: 3")
+    args = parser.parse_args()
+
+    tmpfile = None
+    paths = args.files
+    if not paths:
+        tmpfile = tempfile.NamedTemporaryFile(prefix="bench_hashing_", delete=False)
+        for _ in range(args.size):
+            tmpfile.write(os.urandom(1024*1024))
+        tmpfile.close()
+        paths = [tmpfile.name]
+    try:
+        measure(legacy_hash_file, paths, 1) # warm up the page cache
+        for (name, func) in configurations():
+            print("{} {:10.1f} MB/s".format(name.ljust(40, " "), measure(func, paths, args.rounds)), flush=True)
+    finally:
+        if tmpfile is not None:
+            os.remove(tmpfile.name)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+__author__ = 'ivo'
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from blackswan.core import database, hashset, ldbwhitelist
+
+_log = logging.getLogger(__name__)
+
+RESULTS_VERSION = 1
+# Directories of a system image with the share of the small files they get.
+TREE_LAYOUT = [("system/bin", 0.10), ("system/lib", 0.15), ("system/lib64", 0.15), ("system/etc", 0.10),
+               ("system/framework", 0.05), ("system/usr/share/zoneinfo", 0.10), ("system/fonts", 0.05),
+               ("system/media/audio/ui", 0.10), ("system/priv-app", 0.10), ("system/app", 0.10)]
+SMALL_MIN_SIZE = 100
+SMALL_MAX_SIZE = 256 * 1024
+LARGE_NAMES = ["system/framework/arm64/boot-framework.oat", "system/app/Chrome/Chrome.apk",
+               "system/priv-app/GmsCore/GmsCore.apk", "system/framework/framework.jar"]
+RATE_METRICS = ("files_per_s", "mb_per_s", "lookups_per_s")
+
+def make_tree(rootdir, files, large_files, large_size, symlinks, duplicates, seed=0):
+    """
+    Generate a dir tree shaped like an Android system partition: many small files with log uniform sizes, some of
+    them copies of others, a few files the size of apks and oat files and toybox style symlinks.
+    @param large_size: size of the large files in bytes
+    @return: (number of regular files, total bytes)
+    """
+    rnd = random.Random(seed)
+    total = 0
+    contents = []
+    for (i, (dirname, share)) in enumerate(TREE_LAYOUT):
+        os.makedirs(os.path.join(rootdir, dirname), exist_ok=True)
+        for j in range(int(files * share)):
+            path = os.path.join(rootdir, dirname, "f{:02d}_{:06d}".format(i, j))
+            if contents and rnd.random() < duplicates:
+                data = rnd.choice(contents)
+            else:
+                data = os.urandom(int(SMALL_MIN_SIZE * (SMALL_MAX_SIZE / SMALL_MIN_SIZE) ** rnd.random()))
+                if len(contents) < 1000:
+                    contents.append(data)
+            with open(path, "wb") as ofh:
+                ofh.write(data)
+            total += len(data)
+    count = sum(int(files * share) for (dirname, share) in TREE_LAYOUT)
+    for i in range(large_files):
+        path = os.path.join(rootdir, LARGE_NAMES[i % len(LARGE_NAMES)] + ("" if i < len(LARGE_NAMES) else ".{:d}".format(i)))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as ofh:
+            for pos in range(0, large_size, 1024 * 1024):
+                ofh.write(os.urandom(min(1024 * 1024, large_size - pos)))
+        total += large_size
+        count += 1
+    with open(os.path.join(rootdir, "system/bin/toybox"), "wb") as ofh:
+        ofh.write(os.urandom(SMALL_MAX_SIZE))
+    total += SMALL_MAX_SIZE
+    count += 1
+    for i in range(symlinks):
+        os.symlink("toybox", os.path.join(rootdir, "system/bin", "tool{:04d}".format(i)))
+    os.symlink("system/lib", os.path.join(rootdir, "vendor_lib"))
+    # explore skips symlinks, to files as well as to dirs
+    return (count, total)
+
+def _random_row(i):
+    return {"path": "ref/{:d}".format(i), "size": 0, "sha1": os.urandom(20).hex(), "md5": os.urandom(16).hex(),
+            "sha256": os.urandom(32).hex(), "magic": "", "mimetype": ""}
+
+def reference_rows(dbpath, records, hit_ratio, seed=0):
+    """
+    Generator function. Reference records: hit_ratio of the contents of the db at dbpath, the rest random digests.
+    @yield: dict of MetaFile values with hex digests
+    """
+    rnd = random.Random(seed)
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    Content = database.Content
+    hits = [row for row in dbif.Session.query(Content.sha1, Content.md5, Content.sha256).order_by(Content.id) if rnd.random() < hit_ratio]
+    dbif.Session.remove()
+    for (i, digests) in enumerate(hits):
+        row = _random_row(i)
+        row.update(zip(database.HASH_COLUMNS, (digest.hex() for digest in digests)))
+        yield row
+    for i in range(len(hits), records):
+        yield _random_row(i)
+
+def make_refdb(path, rows):
+    dbif = database.DbIf("sqlite:///{}".format(path))
+    dbif.init_db(dbinfos={"rootpath": "benchmark", "created": str(datetime.datetime.now())})
+    with dbif.bulk_writer() as writer:
+        for row in rows:
+            writer.add(row)
+    return writer.written
+
+def make_hashset(path, dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    return hashset.write_hashset(path, dbif.distinct_digests("sha1", hexdigest=False), name="sha1")
+
+def make_ldb(path, dbpath):
+    import plyvel
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    ldb = plyvel.DB(path, create_if_missing=True)
+    count = 0
+    try:
+        batch = ldb.write_batch()
+        for (hexdigest, refpath) in dbif.digest_rows("sha1"):
+            batch.put(ldbwhitelist.ldb_key(hexdigest, "sha1"), b"benchmark:" + refpath.encode("utf8"))
+            count += 1
+        batch.write()
+    finally:
+        ldb.close()
+    return count
+
+def _copy_db(src, dest):
+    # the backup api includes what is still in the write ahead log
+    if os.path.exists(dest):
+        os.remove(dest)
+    srcconn = sqlite3.connect(src)
+    destconn = sqlite3.connect(dest)
+    try:
+        srcconn.backup(destconn)
+    finally:
+        destconn.close()
+        srcconn.close()
+    return dest
+
+def _records(dbpath):
+    return database.DbIf("sqlite:///{}".format(dbpath)).Session.query(database.MetaFile).count()
+
+def stage_hash(params):
+    """
+    Hash the regular files of the tree, the ones explore would hash, without anything else explore does.
+    """
+    from blackswan.modules.explore import Explore
+    from blackswan.support import hashing
+    hasher = hashing.FileHasher()
+    files = nbytes = 0
+    start = time.perf_counter()
+    for (relpath, fullpath, sinfo) in Explore.files(params["tree"]):
+        if sinfo is None or not stat.S_ISREG(sinfo.st_mode):
+            continue
+        with open(fullpath, "rb") as ifh:
+            hasher.hash_file(ifh)
+        files += 1
+        nbytes += sinfo.st_size
+    return {"seconds": time.perf_counter() - start, "files": files, "bytes": nbytes}
+
+def stage_explore(params):
+    from blackswan.modules.explore import Explore
+    dbpath = os.path.join(params["workdir"], "stage.db")
+    if os.path.exists(dbpath):
+        os.remove(dbpath)
+    explorer = Explore()
+    explorer.configure(rootpath=params["tree"], db=dbpath, workers=params.get("workers", 0))
+    start = time.perf_counter()
+    explorer.run()
+    elapsed = time.perf_counter() - start
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    (files, nbytes) = dbif.Session.query(database.sqla.func.count(database.MetaFile.id), database.sqla.func.sum(database.MetaFile.size)).one()
+    if params.get("keep"):
+        _copy_db(dbpath, params["keep"])
+    return {"seconds": elapsed, "files": files, "bytes": nbytes}
+
+def _filter_stage(modname, params, **options):
+    from blackswan import modules
+    dbpath = _copy_db(params["db"], os.path.join(params["workdir"], "stage.db"))
+    module = modules.load(modname)()
+    module.configure(db=dbpath, filter=params["filter"], **options)
+    start = time.perf_counter()
+    module.run()
+    elapsed = time.perf_counter() - start
+    excluded = database.DbIf("sqlite:///{}".format(dbpath)).Session.query(database.MetaFile).filter(database.MetaFile.excluded == True).count()
+    return {"seconds": elapsed, "lookups": _records(dbpath), "excluded": excluded}
+
+def stage_hashfilter(params):
+    return _filter_stage("hashfilter", params)
+
+def stage_ldb_hashfilter(params):
+    return _filter_stage("ldb_hashfilter", params, merge=params.get("merge", False))
+
+STAGES = {"hash": stage_hash, "explore": stage_explore, "hashfilter": stage_hashfilter, "ldb_hashfilter": stage_ldb_hashfilter}
+
+def run_stage(name, stage, params):
+    """
+    Run a stage in a fresh interpreter, so the peak RSS is that of the stage alone.
+    @return: dict of metrics
+    """
+    resultpath = os.path.join(params["workdir"], "result.json")
+    cmd = [sys.executable, "-m", "blackswan.utils.benchmark", "--stage", stage, "--params", json.dumps(params), "--result", resultpath]
+    with open(os.path.join(params["workdir"], "stage.log"), "w") as log:
+        proc = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=log)
+    if proc.returncode != 0:
+        raise Exception("Stage {} failed, see {}".format(name, os.path.join(params["workdir"], "stage.log")))
+    with open(resultpath) as ifh:
+        metrics = json.load(ifh)
+    seconds = metrics["seconds"] or float("nan")
+    if "files" in metrics:
+        metrics["files_per_s"] = metrics["files"] / seconds
+        metrics["mb_per_s"] = metrics["bytes"] / 1024 / 1024 / seconds
+    if "lookups" in metrics:
+        metrics["lookups_per_s"] = metrics["lookups"] / seconds
+    return metrics
+
+def _child(stage, params, resultpath):
+    logging.basicConfig(level=logging.WARNING)
+    metrics = STAGES[stage](params)
+    metrics["peak_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    with open(resultpath, "w") as ofh:
+        json.dump(metrics, ofh)
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def prepare(workdir, args):
+    """
+    Generate the tree unless workdir already has one generated with the same parameters, so repeated runs and runs
+    of different commits can measure the same data.
+    @return: path of the tree
+    """
+    tree = os.path.join(workdir, "tree")
+    spec = {key: getattr(args, key) for key in ("files", "large_files", "large_size", "symlinks", "duplicates", "seed")}
+    specpath = os.path.join(workdir, "tree.json")
+    if os.path.isdir(tree) and os.path.exists(specpath):
+        with open(specpath) as ifh:
+            if json.load(ifh) == spec:
+                _log.info("Reusing tree %s", tree)
+                return tree
+    shutil.rmtree(tree, ignore_errors=True)
+    _log.info("Generating tree %s...", tree)
+    (count, nbytes) = make_tree(tree, args.files, args.large_files, args.large_size * 1024 * 1024, args.symlinks, args.duplicates, seed=args.seed)
+    _log.info("%d files, %d MB", count, nbytes // 1024 // 1024)
+    with open(specpath, "w") as ofh:
+        json.dump(spec, ofh)
+    return tree
+
+def benchmark(workdir, args):
+    """
+    Generate the data and run every stage.
+    @return: dict of stage name to metrics
+    """
+    tree = prepare(workdir, args)
+    params = {"workdir": workdir, "tree": tree}
+    results = {}
+    results["hash"] = run_stage("hash", "hash", params)
+    dbpath = os.path.join(workdir, "explored.db")
+    results["explore"] = run_stage("explore", "explore", dict(params, keep=dbpath))
+    if args.workers:
+        results["explore_workers"] = run_stage("explore_workers", "explore", dict(params, workers=args.workers))
+    refdb = os.path.join(workdir, "ref.db")
+    for path in (refdb, os.path.join(workdir, "ref.hs")):
+        if os.path.exists(path):
+            os.remove(path)
+    shutil.rmtree(os.path.join(workdir, "ref.ldb"), ignore_errors=True)
+    _log.info("Generating reference db with %d records...", args.ref_records)
+    make_refdb(refdb, reference_rows(dbpath, args.ref_records, args.hit_ratio, seed=args.seed))
+    results["hashfilter_sqlite"] = run_stage("hashfilter_sqlite", "hashfilter", dict(params, db=dbpath, filter=refdb))
+    make_hashset(os.path.join(workdir, "ref.hs"), refdb)
+    results["hashfilter_hashset"] = run_stage("hashfilter_hashset", "hashfilter", dict(params, db=dbpath, filter=os.path.join(workdir, "ref.hs")))
+    try:
+        make_ldb(os.path.join(workdir, "ref.ldb"), refdb)
+    except ImportError:
+        _log.warning("plyvel not available, skipping the ldb stages")
+    else:
+        results["ldb_hashfilter_get"] = run_stage("ldb_hashfilter_get", "ldb_hashfilter", dict(params, db=dbpath, filter=os.path.join(workdir, "ref.ldb")))
+        results["ldb_hashfilter_merge"] = run_stage("ldb_hashfilter_merge", "ldb_hashfilter", dict(params, db=dbpath, filter=os.path.join(workdir, "ref.ldb"), merge=True))
+    return results
+
+def format_results(results, baseline=None):
+    """
+    @return: lines of a table of the rates and peak RSS per stage, with the change against the baseline results
+    """
+    lines = []
+    for (stage, metrics) in results.items():
+        fields = []
+        for metric in RATE_METRICS + ("peak_rss_kb",):
+            if metric not in metrics:
+                continue
+            field = "{} {:.1f}".format(metric, metrics[metric])
+            old = (baseline or {}).get(stage, {}).get(metric)
+            if old:
+                field += " ({:+.1f}%)".format((metrics[metric] - old) / old * 100)
+            fields.append(field)
+        lines.append("{} {:8.2f}s  {}".format(stage.ljust(22), metrics["seconds"], "  ".join(fields)))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest and filter stages on a generated Android-like dir tree and reference databases")
+    parser.add_argument("--workdir", help="Dir for the generated data, kept and reused between runs. Default: a temporary dir")
+    parser.add_argument("--output", "-o", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", "-c", help="Results JSON of an earlier run to compare with")
+    parser.add_argument("--files", type=int, default=5000, help="Number of small files. Default: 5000")
+    parser.add_argument("--large-files", type=int, default=4, help="Number of apk and oat sized files. Default: 4")
+    parser.add_argument("--large-size", type=int, default=64, help="Size of the large files in MB. Default: 64")
+    parser.add_argument("--symlinks", type=int, default=100, help="Number of symlinks to files. Default: 100")
+    parser.add_argument("--duplicates", type=float, default=0.1, help="Fraction of small files that copy another file. Default: 0.1")
+    parser.add_argument("--ref-records", type=int, default=100000, help="Number of records in the reference databases. Default: 100000")
+    parser.add_argument("--hit-ratio", type=float, default=0.5, help="Fraction of the explored contents in the reference databases. Default: 0.5")
+    parser.add_argument("--workers", "-w", type=int, default=4, help="Worker threads of the explore_workers stage, 0 to skip it. Default: 4")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the tree layout. Default: 0")
+    parser.add_argument("--stage", help=argparse.SUPPRESS)
+    parser.add_argument("--params", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        _child(args.stage, json.loads(args.params), args.result)
+        return
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s|%(name)s|%(levelname)s|%(message)s")
+    workdir = args.workdir or tempfile.mkdtemp(prefix="blackswan_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        results = benchmark(workdir, args)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as ifh:
+            baseline = json.load(ifh)["stages"]
+    for line in format_results(results, baseline):
+        print(line)
+    if args.output:
+        with open(args.output, "w") as ofh:
+            json.dump({"version": RESULTS_VERSION, "created": datetime.datetime.now().isoformat(), "commit": _git_commit(),
+                       "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                       "params": {key: value for (key, value) in vars(args).items() if key not in ("stage", "params", "result", "output", "compare")},
+                       "stages": results}, ofh, indent=2)
+
+if __name__ == "__main__":
+    main()
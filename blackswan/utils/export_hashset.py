@@ -0,0 +1,41 @@
+__author__ = 'ivo'
+import argparse
+import os.path
+
+from blackswan.core import database, hashset, ldbwhitelist
+
+def sqlite_digests(dbpath, name):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    dbif.assert_schema()
+    for digest in dbif.distinct_digests(name, hexdigest=False):
+        if digest:
+            yield digest
+
+def ldb_digests(ldbpath, name):
+    import plyvel
+    prefix = ldbwhitelist.KEY_PREFIXES[name]
+    ldb = plyvel.DB(ldbpath, create_if_missing=False)
+    try:
+        for key in ldb.iterator(include_value=False):
+            if ldbwhitelist.key_type(key) == name:
+                yield key[len(prefix):]
+    finally:
+        ldb.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the digests of a blackswan or ldb database to a hash set file")
+    parser.add_argument("source", help="Blackswan sqlite database file or ldb database dir")
+    parser.add_argument("hashset", help="The hash set file to write")
+    parser.add_argument("--digest", "-d", choices=sorted(hashset.DIGEST_SIZES), default="sha1", help="The digest type to export. Default: sha1")
+    parser.add_argument("--bits-per-entry", type=int, default=hashset.DEF_BITS_PER_ENTRY, help="Bloom filter bits per digest. Default: {:d} (about 1%% false positives)".format(hashset.DEF_BITS_PER_ENTRY))
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        digests = ldb_digests(args.source, args.digest)
+    else:
+        digests = sqlite_digests(args.source, args.digest)
+    count = hashset.write_hashset(args.hashset, digests, name=args.digest, bits_per_entry=args.bits_per_entry)
+    print("{:d} {} digests written to {}".format(count, args.digest, args.hashset))
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,125 @@
 __author__ = 'ivo'
 import argparse
+import csv
+import io
+import json
 import sys
 import binascii
 
 import plyvel
 
+from blackswan.core import ldbwhitelist
+
+BLOCK_SIZE = 1024 * 1024
+DEF_BATCH_SIZE = 100000
+FORMATS = ("text", "jsonl", "csv")
+
+def read_queries(stream, batch_size):
+    """
+    Generator function. Read hashes from a binary stream in large blocks.
+    @yield: lists of at most batch_size hash strings
+    """
+    batch = []
+    rest = b""
+    while True:
+        block = stream.read(BLOCK_SIZE)
+        if not block:
+            break
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        for line in lines:
+            hashstr = line.strip()
+            if hashstr:
+                batch.append(hashstr.decode("ascii", errors="replace").lower())
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if rest.strip():
+        batch.append(rest.strip().decode("ascii", errors="replace").lower())
+    if batch:
+        yield batch
+
+def display_value(val):
+    """
+    @return: the ldb value as str for display. Paths are stored with surrogateescape, so non-UTF-8 names are replaced.
+    """
+    return str(val, encoding="utf8", errors="replace")
+
+def resolve(dbif, queries):
+    """
+    Resolve a batch of hashes with one sorted, deduplicated pass over the ldb.
+    @return: dict of hash string to (value or None, error or None)
+    """
+    results = {}
+    keyed = []
+    for hashstr in set(queries):
+        try:
+            keyed.append((ldbwhitelist.ldb_key(hashstr), hashstr))
+        except ValueError as err:
+            results[hashstr] = (None, str(err))
+            continue
+        results[hashstr] = (None, None)
+    keyed.sort()
+    for (hashstr, val) in ldbwhitelist.merge_join(dbif, keyed):
+        results[hashstr] = (display_value(val), None)
+    return results
+
+def format_results(queries, results, fmt):
+    out = io.StringIO()
+    if fmt == "csv":
+        writer = csv.writer(out)
+    for hashstr in queries:
+        (val, err) = results[hashstr]
+        if fmt == "text":
+            if err:
+                out.write("{} error: {}\n".format(hashstr, err))
+            elif val is not None:
+                out.write("{} found: {}\n".format(hashstr, val))
+            else:
+                out.write("{} not found!\n".format(hashstr))
+        elif fmt == "jsonl":
+            out.write(json.dumps({"hash": hashstr, "found": val is not None, "value": val, "error": err}) + "\n")
+        else:
+            writer.writerow([hashstr, "error" if err else ("found" if val is not None else "not found"), val or err or ""])
+    return out.getvalue()
+
+def batch_lookup(dbif, instream, outstream, fmt="text", batch_size=DEF_BATCH_SIZE):
+    if fmt == "csv":
+        outstream.write("hash,status,value\n")
+    for queries in read_queries(instream, batch_size):
+        outstream.write(format_results(queries, resolve(dbif, queries), fmt))
+    outstream.flush()
+
+def lookup(dbif, instream, outstream, fmt="text"):
+    """
+    Look up the hashes line by line, any hex string is used as key as is.
+    """
+    if fmt == "csv":
+        outstream.write("hash,status,value\n")
+    for line in instream:
+        hashstr = line.strip()
+        try:
+            val = dbif.get(binascii.unhexlify(hashstr))
+        except binascii.Error as err:
+            result = (None, str(err))
+        else:
+            result = (display_value(val) if val else None, None)
+        outstream.write(format_results([hashstr], {hashstr: result}, fmt))
+        outstream.flush()
+
 def main():
     parser = argparse.ArgumentParser(description="Lookup hash in ldb database")
     parser.add_argument("ldb", help="The database to look in")
+    parser.add_argument("--batch", "-b", action="store_true", help="Read stdin in blocks and resolve the hashes in sorted batches. Accepts md5, sha1 and sha256")
+    parser.add_argument("--batch-size", type=int, default=DEF_BATCH_SIZE, help="Number of hashes per batch. Default: {:d}".format(DEF_BATCH_SIZE))
+    parser.add_argument("--format", "-f", choices=FORMATS, default="text", help="Output format. Default: text")
     args = parser.parse_args()
 
     dbif = plyvel.DB(args.ldb, create_if_missing=False)
-    for line in sys.stdin:
-        hashstr = line.strip()
-        try:
-            hashbytes = binascii.unhexlify(hashstr)
-        except binascii.Error as err:
-            print("{} error: {}".format(hashstr, str(err)))
-            continue
-        val = dbif.get(hashbytes)
-        if val:
-            print("{} found: {}".format(hashstr, str(val, encoding="utf8")))
-        else:
-            print("{} not found!".format(hashstr))
+    if args.batch:
+        batch_lookup(dbif, sys.stdin.buffer, sys.stdout, fmt=args.format, batch_size=args.batch_size)
+    else:
+        lookup(dbif, sys.stdin, sys.stdout, fmt=args.format)
 
 if __name__ == "__main__":
     main()
-
-
-
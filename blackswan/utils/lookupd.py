@@ -0,0 +1,122 @@
+__author__ = 'ivo'
+import argparse
+import asyncio
+import collections
+import logging
+import os
+
+import plyvel
+
+from blackswan import config
+from blackswan.core import ldbwhitelist, lookupclient
+
+_log = logging.getLogger(__name__)
+
+DEF_LRU_SIZE = 100000
+# below this many cache misses in a request block random gets beat a merge join
+MERGE_THRESHOLD = 64
+
+class LookupServer(object):
+    '''
+    Keeps a whitelist ldb open and answers hash lookups on a unix socket for any number of clients.
+    Every block of request lines is resolved as a batch; recent hits are kept in an LRU.
+    '''
+    def __init__(self, ldbpath, lru_size=DEF_LRU_SIZE):
+        self.ldb = plyvel.DB(ldbpath, create_if_missing=False)
+        self.lru_size = lru_size
+        self.lru = collections.OrderedDict()
+        self.lookups = self.hits = 0
+
+    def _remember(self, key, value):
+        self.lru[key] = value
+        if len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def resolve(self, lines):
+        """
+        @return: response lines for the request lines, in order
+        """
+        keys = []
+        misses = set()
+        found = {}
+        for line in lines:
+            hexdigest = line.strip().decode("ascii", errors="replace").lower()
+            try:
+                key = ldbwhitelist.ldb_key(hexdigest)
+            except ValueError as err:
+                keys.append(err)
+                continue
+            keys.append(key)
+            if key in self.lru:
+                self.lru.move_to_end(key)
+                found[key] = self.lru[key]
+            elif key not in found:
+                misses.add(key)
+        self.lookups += len(lines)
+        self.hits += len(found)
+        if len(misses) >= MERGE_THRESHOLD:
+            hits = ldbwhitelist.merge_join(self.ldb, ((key, key) for key in sorted(misses)))
+        else:
+            hits = ((key, self.ldb.get(key)) for key in misses)
+        for (key, value) in hits:
+            if value is not None:
+                found[key] = value
+                self._remember(key, value)
+        responses = []
+        for key in keys:
+            if isinstance(key, ValueError):
+                responses.append("E {}\n".format(key).encode("utf8"))
+                continue
+            value = found.get(key)
+            if value is None:
+                responses.append(b"N\n")
+            else:
+                responses.append(b"F " + value.replace(b"\n", b" ") + b"\n")
+        return responses
+
+    async def handle(self, reader, writer):
+        rest = b""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                lines = (rest + data).split(b"\n")
+                rest = lines.pop()
+                if lines:
+                    writer.write(b"".join(self.resolve(lines)))
+                    await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        _log.info("Serving lookups on %s", path)
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.ldb.close()
+        _log.info("%d lookups served, %d from the LRU", self.lookups, self.hits)
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve hash lookups from a whitelist ldb database on a unix socket")
+    parser.add_argument("ldb", help="The database to serve")
+    parser.add_argument("--socket", "-s", default=lookupclient.DEF_SOCKET, help="The unix socket to listen on. Default: {}".format(lookupclient.DEF_SOCKET))
+    parser.add_argument("--lru-size", type=int, default=DEF_LRU_SIZE, help="Number of recent hits kept in memory. Default: {:d}".format(DEF_LRU_SIZE))
+    args = parser.parse_args()
+
+    server = LookupServer(args.ldb, lru_size=args.lru_size)
+    try:
+        asyncio.run(server.serve(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+if __name__ == "__main__":
+    main()
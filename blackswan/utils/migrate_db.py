@@ -0,0 +1,80 @@
+__author__ = 'ivo'
+import argparse
+import datetime
+import logging
+import os.path
+
+import sqlalchemy as sqla
+
+from blackswan.core import database
+
+_log = logging.getLogger(__name__)
+
+def legacy_rows(engine):
+    """
+    Generator function. Stream the MetaFiles of a schema 1 database as dicts of column values, digests and magic
+    included, in id order.
+    @yield: dict
+    """
+    table = sqla.Table(database.MetaFile.__tablename__, sqla.MetaData(), autoload_with=engine)
+    wanted = set(col.name for col in database.MetaFile.__table__.columns) | set(database.CONTENT_COLUMNS)
+    columns = [col for col in table.columns if col.name in wanted]
+    with engine.connect() as conn:
+        for row in conn.execution_options(stream_results=True).execute(sqla.select(*columns).order_by(table.c.id)):
+            yield dict(zip([col.name for col in columns], row))
+
+def copy_table(dbif, srcpath, name):
+    """
+    Copy a table that did not change between the schemas, if the source database has it.
+    @return: number of rows copied
+    """
+    srccolumns = [col["name"] for col in sqla.inspect(sqla.create_engine("sqlite:///{}".format(srcpath))).get_columns(name)]
+    if not srccolumns:
+        return 0
+    with dbif.attached(srcpath, alias="srcdb") as conn:
+        trans = conn.begin()
+        res = conn.execute(sqla.text("INSERT INTO {0} ({1}) SELECT {1} FROM srcdb.{0}".format(name, ", ".join(srccolumns))))
+        trans.commit()
+    return res.rowcount
+
+def migrate(srcpath, destpath, batch_size=database.DEF_BATCH_SIZE):
+    """
+    Write a schema 1 database to a new database with the current schema. MetaFile ids are kept, so Indicators
+    still refer to the same files.
+    @return: number of MetaFiles migrated
+    """
+    srcdbif = database.DbIf("sqlite:///{}".format(srcpath))
+    if srcdbif.schema_version() == database.SCHEMA_VERSION:
+        raise Exception("{} already has the current schema".format(srcpath))
+    if os.path.exists(destpath):
+        raise Exception("{} allready exists!".format(destpath))
+    dbinfos = {key: value for (key, value) in srcdbif.get_db_info().items() if key != "schema_version"}
+    srcdbif.Session.remove()
+    dbinfos.update(migrated=str(datetime.datetime.now()), migrated_from=os.path.abspath(srcpath))
+    destdbif = database.DbIf("sqlite:///{}".format(destpath))
+    destdbif.init_db(dbinfos=dbinfos)
+    destdbif.Session.remove()
+    with destdbif.bulk_writer(batch_size=batch_size) as writer:
+        for row in legacy_rows(srcdbif._engine):
+            writer.add(row)
+    for name in (database.ModuleRun.__tablename__, database.Indicator.__tablename__):
+        _log.info("%d %s copied", copy_table(destdbif, srcpath, name), name)
+    return writer.written
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate a blackswan database to the current schema, with file contents stored once in a Contents table")
+    parser.add_argument("source", help="The blackswan sqlite database to migrate, which is left untouched")
+    parser.add_argument("dest", help="The migrated database to create")
+    parser.add_argument("--batch-size", type=int, default=database.DEF_BATCH_SIZE, help="Number of records per transaction. Default: {:d}".format(database.DEF_BATCH_SIZE))
+    parser.add_argument("--verbose", "-v", action="store_true", help="Log progress")
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    count = migrate(args.source, args.dest, batch_size=args.batch_size)
+    contents = database.DbIf("sqlite:///{}".format(args.dest)).Session.query(database.Content).count()
+    print("{:d} records with {:d} distinct contents migrated to {}".format(count, contents, args.dest))
+    print("Size {:d} bytes, was {:d} bytes".format(os.path.getsize(args.dest), os.path.getsize(args.source)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+__author__ = 'ivo'
+
+import os
+import os.path
+import sys
+import subprocess
+
+import pytest
+
+from blackswan import config,modules
+from blackswan.core import database
+
+# progress output would interleave with the pytest output
+config.progress = "none"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TREE = {
+    "system/bin/sh": b"#!/system/bin/sh\necho shell\n",
+    "system/bin/toolbox": b"\x7fELF" + bytes(range(256)) * 40,
+    "system/etc/hosts": b"127.0.0.1 localhost\n",
+    "system/app/Empty.txt": b"",
+    "data/local/tmp/note.txt": b"a note on the data partition\n",
+}
+
+def _write_tree(rootpath, files):
+    for (relpath, data) in files.items():
+        fullpath = os.path.join(str(rootpath), relpath)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, "wb") as ofh:
+            ofh.write(data)
+    return str(rootpath)
+
+@pytest.fixture
+def tree(tmp_path):
+    """
+    A small dir tree of an Android image, see TREE.
+    """
+    return _write_tree(tmp_path / "tree", TREE)
+
+@pytest.fixture
+def make_tree(tmp_path):
+    """
+    Factory writing a dict of relative path to content as a dir tree under tmp_path.
+    """
+    return lambda name, files: _write_tree(tmp_path / name, files)
+
+def _run_module(modname, **kwargs):
+    module = modules.load(modname)()
+    module.configure(stats_interval=0, **kwargs)
+    module.run()
+    return module
+
+@pytest.fixture
+def run_module():
+    """
+    Function running a module by name with the given config, without its defaults from the argument parser.
+    """
+    return _run_module
+
+@pytest.fixture
+def explore_db(tmp_path):
+    """
+    Factory exploring a dir tree or image into a database with the explore module.
+    """
+    def explore(rootpath, dbname="explored.db", **kwargs):
+        dbpath = str(tmp_path / dbname)
+        _run_module("explore", rootpath=str(rootpath), db=dbpath, **kwargs)
+        return dbpath
+    return explore
+
+def _metafiles(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return {path: (excluded, sha1.hex() if sha1 is not None else None) for (path, excluded, sha1) in
+                dbif.Session.query(database.MetaFile.path, database.MetaFile.excluded, database.Content.sha1)
+                .outerjoin(database.Content, database.MetaFile.content_id == database.Content.id)
+                .filter(database.MetaFile.removed == False)}
+    finally:
+        dbif.Session.remove()
+
+@pytest.fixture
+def metafiles():
+    """
+    Function reading a database as a dict of path to (excluded, sha1 hex) of its existing files.
+    """
+    return _metafiles
+
+@pytest.fixture
+def cli(tmp_path):
+    """
+    Function running the blackswan command line in a fresh interpreter in tmp_path.
+    @return: the CompletedProcess, with stdout and stderr as text
+    """
+    def run(*args):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([ROOT] + [path for path in [os.environ.get("PYTHONPATH")] if path]))
+        return subprocess.run([sys.executable, "-m", "blackswan.cli", "-p", "none"] + [str(arg) for arg in args], cwd=str(tmp_path),
+                              env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    return run
@@ -0,0 +1,214 @@
+__author__ = 'ivo'
+
+import io
+import base64
+import shutil
+import struct
+import hashlib
+import zipfile
+import subprocess
+
+import pytest
+
+from blackswan.core import database
+from blackswan.support import apk
+
+pytestmark = pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl is needed to sign test APKs")
+
+MEMBERS = {"AndroidManifest.xml": b"<manifest/>" * 30, "classes.dex": b"dex\n035\x00" + bytes(range(256)) * 20, "res/raw/a.bin": b"\x01" * 100}
+
+def _openssl(*args, data=None):
+    return subprocess.run(("openssl",) + args, input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout
+
+class Signer(object):
+    """
+    A self signed RSA key and certificate made with openssl, which signs jars and APKs the way the Android tools do.
+    """
+    def __init__(self, path, subject):
+        self.key = str(path / "key.pem")
+        self.cert = str(path / "cert.pem")
+        _openssl("req", "-x509", "-newkey", "rsa:2048", "-nodes", "-keyout", self.key, "-out", self.cert, "-subj", subject, "-days", "30")
+        self.der = _openssl("x509", "-in", self.cert, "-outform", "DER")
+        self.spki = _openssl("pkey", "-in", self.key, "-pubout", "-outform", "DER")
+        self.fingerprint = bytes.fromhex(_openssl("x509", "-in", self.cert, "-noout", "-fingerprint", "-sha256").decode().split("=")[1].strip().replace(":", ""))
+
+    def sign(self, data, digestname="sha256", pss=False):
+        args = ["dgst", "-" + digestname, "-sign", self.key]
+        if pss:
+            args += ["-sigopt", "rsa_padding_mode:pss", "-sigopt", "rsa_pss_saltlen:{:d}".format(hashlib.new(digestname).digest_size)]
+        return _openssl(*args, data=data)
+
+    def v1_files(self, members, attributes=False):
+        """
+        @return: dict of the META-INF files of a v1 signature of the members
+        """
+        manifest = b"Manifest-Version: 1.0\r\nCreated-By: test\r\n\r\n"
+        for (name, data) in members.items():
+            manifest += "Name: {}\r\nSHA-256-Digest: {}\r\n\r\n".format(name, base64.b64encode(hashlib.sha256(data).digest()).decode()).encode()
+        sf = "Signature-Version: 1.0\r\nSHA-256-Digest-Manifest: {}\r\n\r\n".format(base64.b64encode(hashlib.sha256(manifest).digest()).decode()).encode()
+        args = ["cms", "-sign", "-binary", "-outform", "DER", "-md", "sha256", "-signer", self.cert, "-inkey", self.key]
+        if not attributes:
+            args.append("-noattr")
+        return {"META-INF/MANIFEST.MF": manifest, "META-INF/CERT.SF": sf, "META-INF/CERT.RSA": _openssl(*args, data=sf)}
+
+    def v2_block(self, data, algid=0x0103, der=None):
+        """
+        @param der: certificate to put in the block instead of the own one
+        @return: the v2 signature scheme block of the zip data
+        """
+        (padding, digestname) = apk.SIG_ALGORITHMS[algid]
+        digests = _lp(struct.pack("<I", algid) + _lp(_content_digest(data, digestname)))
+        signeddata = _lp(digests) + _lp(_lp(der or self.der)) + _lp(b"")
+        signature = self.sign(signeddata, digestname, pss=padding == "pss")
+        return _lp(_lp(_lp(signeddata) + _lp(_lp(struct.pack("<I", algid) + _lp(signature))) + _lp(self.spki)))
+
+def _lp(data):
+    return struct.pack("<I", len(data)) + data
+
+def _zip(members, comment=b""):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for (name, data) in members.items():
+            zf.writestr(name, data)
+        zf.comment = comment
+    return buf.getvalue()
+
+def _split(data):
+    eocd = data.rfind(apk.EOCD_MAGIC)
+    (cdoffset,) = struct.unpack_from("<I", data, eocd + 16)
+    return (data[:cdoffset], data[cdoffset:eocd], data[eocd:])
+
+def _content_digest(data, digestname):
+    (entries, cd, eocd) = _split(data)
+    chunks = [section[i:i + apk.CHUNK_SIZE] for section in (entries, cd, eocd) for i in range(0, len(section), apk.CHUNK_SIZE)]
+    return hashlib.new(digestname, b"\x5a" + struct.pack("<I", len(chunks)) + b"".join(
+        hashlib.new(digestname, b"\xa5" + struct.pack("<I", len(chunk)) + chunk).digest() for chunk in chunks)).digest()
+
+def _with_block(data, value, blockid=0x7109871a):
+    """
+    @return: the zip data with an APK signing block holding value inserted before the central directory
+    """
+    (entries, cd, eocd) = _split(data)
+    pair = struct.pack("<QI", len(value) + 4, blockid) + value
+    size = len(pair) + 8 + 16
+    block = struct.pack("<Q", size) + pair + struct.pack("<Q", size) + apk.SIGBLOCK_MAGIC
+    eocd = bytearray(eocd)
+    struct.pack_into("<I", eocd, 16, len(entries) + len(block))
+    return entries + block + cd + bytes(eocd)
+
+def _signed_v2(signer, members, algid=0x0103, comment=b""):
+    data = _zip(members, comment)
+    return _with_block(data, signer.v2_block(data, algid))
+
+def _inspect(data):
+    return apk.inspect(io.BytesIO(data))
+
+@pytest.fixture(scope="module")
+def vendor(tmp_path_factory):
+    return Signer(tmp_path_factory.mktemp("vendor"), "/O=Vendor Inc/CN=Platform")
+
+@pytest.fixture(scope="module")
+def other(tmp_path_factory):
+    return Signer(tmp_path_factory.mktemp("other"), "/CN=Someone Else")
+
+def test_certificate_info(vendor):
+    info = apk.certificate_info(vendor.der)
+    assert info == {"fingerprint": vendor.fingerprint, "subject": "O=Vendor Inc, CN=Platform", "issuer": "O=Vendor Inc, CN=Platform"}
+
+def test_rsa_public_key(vendor):
+    assert apk.certificate_public_key(vendor.der) == vendor.spki
+    modulus = _openssl("x509", "-in", vendor.cert, "-noout", "-modulus").decode().split("=")[1].strip()
+    assert apk.rsa_public_key(vendor.spki) == (int(modulus, 16), 65537)
+
+def test_der_truncated():
+    with pytest.raises(apk.ApkError):
+        apk._der(b"\x30\x82\x01\x00\x02", 0)
+    with pytest.raises(apk.ApkError):
+        apk.certificate_info(b"\x30\x03\x02\x01\x01")
+
+@pytest.mark.parametrize("digestname,pss", [("sha256", False), ("sha512", False), ("sha256", True), ("sha512", True)])
+def test_rsa_signatures(vendor, other, digestname, pss):
+    key = apk.rsa_public_key(vendor.spki)
+    digest = hashlib.new(digestname, b"signed data").digest()
+    signature = vendor.sign(b"signed data", digestname, pss=pss)
+    verify = (lambda *args: apk.verify_pss(*args, saltlen=len(digest))) if pss else apk.verify_pkcs1
+    assert verify(key, digestname, digest, signature)
+    assert not verify(key, digestname, hashlib.new(digestname, b"other data").digest(), signature)
+    assert not verify(key, digestname, digest, other.sign(b"signed data", digestname, pss=pss))
+
+def test_members_are_hashed(vendor):
+    res = _inspect(_zip(MEMBERS))
+    assert res["error"] is None and res["signers"] == []
+    members = {member["name"]: member for member in res["members"]}
+    assert members["classes.dex"]["sha256"] == hashlib.sha256(MEMBERS["classes.dex"]).digest()
+    assert members["classes.dex"]["size"] == len(MEMBERS["classes.dex"])
+
+@pytest.mark.parametrize("attributes", [False, True])
+def test_v1_verified(vendor, attributes):
+    res = _inspect(_zip(dict(MEMBERS, **vendor.v1_files(MEMBERS, attributes=attributes))))
+    assert res["error"] is None
+    assert [(signer["scheme"], signer["fingerprint"], signer["verified"]) for signer in res["signers"]] == [("v1", vendor.fingerprint, True)]
+
+def test_v1_modified_member(vendor):
+    modified = dict(MEMBERS, **{"classes.dex": b"dex\n035\x00 evil"})
+    res = _inspect(_zip(dict(modified, **vendor.v1_files(MEMBERS))))
+    assert [(signer["fingerprint"], signer["verified"]) for signer in res["signers"]] == [(vendor.fingerprint, False)]
+
+def test_v1_unlisted_member(vendor):
+    res = _inspect(_zip(dict(MEMBERS, **dict(vendor.v1_files(MEMBERS), **{"lib/evil.so": b"\x7fELF"}))))
+    assert [signer["verified"] for signer in res["signers"]] == [False]
+
+def test_v1_copied_signature(vendor):
+    # the signature files of a genuine jar in another jar
+    files = vendor.v1_files(MEMBERS)
+    files["META-INF/MANIFEST.MF"] = files["META-INF/MANIFEST.MF"].replace(b"Created-By: test", b"Created-By: evil")
+    res = _inspect(_zip(dict(MEMBERS, **files)))
+    assert [signer["verified"] for signer in res["signers"]] == [False]
+
+@pytest.mark.parametrize("algid", sorted(apk.SIG_ALGORITHMS))
+def test_v2_verified(vendor, algid):
+    res = _inspect(_signed_v2(vendor, MEMBERS, algid=algid))
+    assert res["error"] is None
+    assert [(signer["scheme"], signer["fingerprint"], signer["verified"]) for signer in res["signers"]] == [("v2", vendor.fingerprint, True)]
+
+def test_v2_and_v1(vendor):
+    res = _inspect(_signed_v2(vendor, dict(MEMBERS, **vendor.v1_files(MEMBERS))))
+    assert sorted((signer["scheme"], signer["verified"]) for signer in res["signers"]) == [("v1", True), ("v2", True)]
+
+def test_v2_modified_content(vendor):
+    data = _signed_v2(vendor, MEMBERS, comment=b"genuine")
+    res = _inspect(data[:-len(b"genuine")] + b"evil!!!")
+    assert res["error"] is None
+    assert [signer["verified"] for signer in res["signers"]] == [False]
+
+def test_v2_copied_block(vendor):
+    # the signing block of a genuine APK in another APK
+    genuine = apk.signing_block(io.BytesIO(_signed_v2(vendor, MEMBERS)))[0x7109871a]
+    res = _inspect(_with_block(_zip(dict(MEMBERS, **{"classes.dex": b"evil"})), genuine))
+    assert [(signer["fingerprint"], signer["verified"]) for signer in res["signers"]] == [(vendor.fingerprint, False)]
+
+def test_v2_other_key(vendor, other):
+    # a certificate of the vendor with a signature of someone else
+    data = _zip(MEMBERS)
+    res = _inspect(_with_block(data, other.v2_block(data, der=vendor.der)))
+    assert [(signer["fingerprint"], signer["verified"]) for signer in res["signers"]] == [(vendor.fingerprint, False)]
+
+def test_hashfilter_certs_excludes_verified_apks_only(vendor, make_tree, explore_db, run_module, metafiles, tmp_path):
+    reference = make_tree("reference", {"system/app/Settings.apk": _signed_v2(vendor, MEMBERS)})
+    certs = str(tmp_path / "certs.db")
+    run_module("build_certlist", sources=[explore_db(reference, "ref.db")], certs=certs, workers=0)
+
+    genuine = dict(MEMBERS, **{"classes.dex": b"dex\n035\x00 update"})
+    spoofed = apk.signing_block(io.BytesIO(_signed_v2(vendor, MEMBERS)))[0x7109871a]
+    target = make_tree("target", {"system/app/Settings.apk": _signed_v2(vendor, genuine),
+                                  "system/app/Evil.apk": _with_block(_zip(dict(MEMBERS, **{"classes.dex": b"evil"})), spoofed),
+                                  "system/app/Unsigned.apk": _zip(MEMBERS)})
+    dbpath = explore_db(target, "target.db")
+    run_module("hashfilter", db=dbpath, filter=certs, apk_workers=0)
+    files = metafiles(dbpath)
+    assert files["system/app/Settings.apk"][0] is True
+    assert files["system/app/Evil.apk"][0] is False
+    assert files["system/app/Unsigned.apk"][0] is False
+    dbif = database.DbIf("sqlite:///{}".format(certs))
+    assert [cert.fingerprint for cert in dbif.Session.query(database.TrustedCert)] == [vendor.fingerprint]
+    dbif.Session.remove()
@@ -0,0 +1,23 @@
+__author__ = 'ivo'
+
+import os
+
+from blackswan.utils import benchmark
+
+def test_hash_and_explore_stages_count_the_same_files(tmp_path):
+    tree = str(tmp_path / "tree")
+    (count, nbytes) = benchmark.make_tree(tree, files=40, large_files=1, large_size=100000, symlinks=5, duplicates=0.2)
+    # a symlink to nothing next to the ones to toybox
+    os.symlink("missing", os.path.join(tree, "system/bin/dangling"))
+    params = {"workdir": str(tmp_path), "tree": tree}
+    hashed = benchmark.stage_hash(params)
+    explored = benchmark.stage_explore(params)
+    assert (hashed["files"], hashed["bytes"]) == (count, nbytes)
+    assert (explored["files"], explored["bytes"]) == (count, nbytes)
+
+def test_format_results():
+    results = {"hash": {"seconds": 2.0, "files_per_s": 110.0, "mb_per_s": 5.0, "peak_rss_kb": 1000}}
+    baseline = {"hash": {"files_per_s": 100.0}}
+    (line,) = benchmark.format_results(results, baseline)
+    assert line.startswith("hash ")
+    assert "files_per_s 110.0 (+10.0%)" in line and "mb_per_s 5.0  " in line
@@ -0,0 +1,10 @@
+__author__ = 'ivo'
+
+import pytest
+
+def test_build_whitelist_from_dir_tree(tree, cli, tmp_path):
+    # explore is only registered when build_whitelist loads it
+    pytest.importorskip("plyvel")
+    res = cli("run", "build_whitelist", "--", tree, "--ldb", tmp_path / "wl.ldb")
+    assert res.returncode == 0, res.stderr
+    assert "5 sha1 keys written" in res.stderr
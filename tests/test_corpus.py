@@ -0,0 +1,47 @@
+__author__ = 'ivo'
+
+import shutil
+import subprocess
+
+import pytest
+
+from blackswan.core import database
+
+from conftest import TREE
+
+def _sources(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return (sorted(value for (key, value) in dbif.Session.query(database.DbInfo.key, database.DbInfo.value) if key == "source"),
+                sorted((metafile.source, metafile.path) for metafile in dbif.Session.query(database.MetaFile)),
+                dbif.Session.query(database.Content).count())
+    finally:
+        dbif.Session.remove()
+
+def test_corpus(tree, make_tree, run_module, tmp_path):
+    second = make_tree("second/tree", {"system/bin/sh": TREE["system/bin/sh"], "system/bin/vendor": b"vendor"})
+    manifest = tmp_path / "corpus.txt"
+    manifest.write_text("# a dir tree with the same base name as an item\n\nvendor\t{}\n{}\n".format(second, second))
+    dbpath = str(tmp_path / "corpus.db")
+    run_module("corpus", db=dbpath, items=[tree], manifest=str(manifest), processes=2)
+    (sources, files, contents) = _sources(dbpath)
+    assert sources == ["tree\t{}".format(tree), "tree_2\t{}".format(second), "vendor\t{}".format(second)]
+    assert files == sorted([("tree", relpath) for relpath in TREE] + [(name, relpath) for name in ("tree_2", "vendor") for relpath in ("system/bin/sh", "system/bin/vendor")])
+    # shared contents are stored once
+    assert contents == len(TREE) + 1
+
+    # sources already in the database are skipped
+    run_module("corpus", db=dbpath, items=[tree, make_tree("third", {"new": b"new"})], processes=1)
+    (sources, files, contents) = _sources(dbpath)
+    assert len(sources) == 4 and len(files) == len(TREE) + 5
+
+@pytest.mark.skipif(shutil.which("mke2fs") is None, reason="mke2fs is needed to build ext4 images")
+def test_corpus_image(tree, run_module, tmp_path):
+    image = str(tmp_path / "system.img")
+    subprocess.run(["mke2fs", "-q", "-F", "-t", "ext4", "-d", tree, image, "4M"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    dbpath = str(tmp_path / "corpus.db")
+    run_module("corpus", db=dbpath, items=[image, tree], processes=2, cache=str(tmp_path / "cache.db"))
+    (sources, files, contents) = _sources(dbpath)
+    assert [source.split("\t")[0] for source in sources] == ["system.img", "tree"]
+    assert sorted(relpath for (source, relpath) in files if source == "system.img" and not relpath.startswith("lost+found")) == sorted(TREE)
+    assert contents == len(TREE)
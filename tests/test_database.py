@@ -0,0 +1,188 @@
+__author__ = 'ivo'
+
+import hashlib
+import sys
+import sqlite3
+import subprocess
+import datetime
+
+import pytest
+
+from blackswan.core import database, metrics
+from blackswan.utils import migrate_db
+
+from conftest import ROOT
+
+def _digests(data):
+    return {name: hashlib.new(name, data).hexdigest() for name in database.HASH_COLUMNS}
+
+def _row(path, data, **values):
+    row = {"path": path, "extension": "", "size": len(data), "lastmodified": datetime.datetime(2020, 1, 1), "magic": "data",
+           "mimetype": "application/octet-stream", "ssdeep": None, "excluded": False, "removed": False}
+    row.update(_digests(data), **values)
+    return row
+
+@pytest.fixture
+def dbif(tmp_path):
+    dbif = database.DbIf("sqlite:///{}".format(tmp_path / "test.db"))
+    dbif.init_db(dbinfos={"rootpath": "/test", "checkpoint": ""})
+    yield dbif
+    dbif.Session.remove()
+
+def _paths(dbif):
+    return [path for (path,) in dbif.Session.query(database.MetaFile.path).order_by(database.MetaFile.id)]
+
+def test_bulk_writer_commits_batches_with_checkpoint(dbif):
+    reader = database.DbIf(dbif.connstr)
+    stats = metrics.Metrics()
+    with dbif.bulk_writer(batch_size=3, metrics=stats) as writer:
+        for i in range(7):
+            writer.checkpoint("f{:d}".format(i))
+            writer.add(_row("f{:d}".format(i), b"%d" % i))
+            # what another connection sees is always complete up to the checkpoint
+            committed = _paths(reader)
+            assert reader.get_db_info()["checkpoint"] == (committed[-1] if committed else "")
+            reader.Session.remove()
+        assert writer.written == 6
+    assert writer.written == 7 and stats.counters["db_rows"] == 7
+    assert _paths(reader) == ["f{:d}".format(i) for i in range(7)]
+    assert reader.get_db_info()["checkpoint"] == "f6"
+    reader.Session.remove()
+
+def test_bulk_writer_updates(dbif):
+    with dbif.bulk_writer(batch_size=2) as writer:
+        for i in range(3):
+            writer.add(_row("f{:d}".format(i), b"old"))
+    ids = dict(dbif.Session.query(database.MetaFile.path, database.MetaFile.id))
+    with dbif.bulk_writer(batch_size=2) as writer:
+        writer.update(ids["f1"], _row("f1", b"new content"))
+    dbif.Session.remove()
+    rows = {metafile.path: (metafile.size, metafile.content.sha1.hex()) for metafile in dbif.Session.query(database.MetaFile)}
+    assert rows == {"f0": (3, _digests(b"old")["sha1"]), "f1": (11, _digests(b"new content")["sha1"]), "f2": (3, _digests(b"old")["sha1"])}
+
+def test_bulk_writer_other_table(dbif):
+    table = database.ModuleRun.__table__
+    with dbif.bulk_writer(table=table, batch_size=2) as writer:
+        for i in range(5):
+            writer.add({"name": "run{:d}".format(i), "config": "{}"})
+    assert writer.written == 5
+    assert sorted(name for (name,) in dbif.Session.query(database.ModuleRun.name)) == ["run{:d}".format(i) for i in range(5)]
+
+def _contents(dbif):
+    return sorted(sha1.hex() for (sha1,) in dbif.Session.query(database.Content.sha1))
+
+def test_contents_stored_once(dbif):
+    with dbif.bulk_writer(batch_size=2) as writer:
+        for (i, data) in enumerate([b"a", b"b", b"a", b"a", b"c"]):
+            writer.add(_row("f{:d}".format(i), data))
+    assert _contents(dbif) == sorted(_digests(data)["sha1"] for data in (b"a", b"b", b"c"))
+    assert [(sha1, path) for (sha1, path) in dbif.digest_rows("sha1") if path == "f3"] == [(_digests(b"a")["sha1"], "f3")]
+    assert list(dbif.distinct_digests("md5")) == sorted(_digests(data)["md5"] for data in (b"a", b"b", b"c"))
+
+def test_merge_db_shares_contents(dbif, tmp_path):
+    other = database.DbIf("sqlite:///{}".format(tmp_path / "other.db"))
+    other.init_db(dbinfos={"rootpath": "/other"})
+    with other.bulk_writer() as writer:
+        writer.add(_row("x", b"a"))
+        writer.add(_row("y", b"new"))
+    with dbif.bulk_writer() as writer:
+        writer.add(_row("f", b"a"))
+    assert dbif.merge_db(str(tmp_path / "other.db"), source="other") == 2
+    assert _contents(dbif) == sorted(_digests(data)["sha1"] for data in (b"a", b"new"))
+    rows = {metafile.path: (metafile.source, metafile.content.sha1.hex()) for metafile in dbif.Session.query(database.MetaFile)}
+    assert rows == {"f": (None, _digests(b"a")["sha1"]), "x": ("other", _digests(b"a")["sha1"]), "y": ("other", _digests(b"new")["sha1"])}
+    other.Session.remove()
+
+def _filled(dbif):
+    return {sha1.hex(): (magic, mimetype, ssdeep) for (sha1, magic, mimetype, ssdeep) in
+            dbif.Session.query(database.Content.sha1, database.Content.magic, database.Content.mimetype, database.Content.ssdeep)}
+
+def test_empty_content_columns_filled_in(dbif, tmp_path):
+    skipped = {"magic": "", "mimetype": ""}
+    with dbif.bulk_writer(batch_size=2) as writer:
+        writer.add(_row("a.img", b"a", **skipped))
+        writer.add(_row("a.bin", b"a"))
+        writer.add(_row("b.img", b"b", **skipped))
+    with dbif.bulk_writer() as writer:
+        writer.add(_row("b.bin", b"b", ssdeep="3:b:b"))
+        writer.add(_row("c.img", b"c", **skipped))
+        # values already stored are kept
+        writer.add(_row("a.txt", b"a", magic="other", ssdeep="3:a:a"))
+    other = database.DbIf("sqlite:///{}".format(tmp_path / "other.db"))
+    other.init_db(dbinfos={"rootpath": "/other"})
+    with other.bulk_writer() as writer:
+        writer.add(_row("c.bin", b"c", ssdeep="3:c:c"))
+    other.Session.remove()
+    dbif.merge_db(str(tmp_path / "other.db"), source="other")
+    assert _filled(dbif) == {_digests(b"a")["sha1"]: ("data", "application/octet-stream", "3:a:a"),
+                             _digests(b"b")["sha1"]: ("data", "application/octet-stream", "3:b:b"),
+                             _digests(b"c")["sha1"]: ("data", "application/octet-stream", "3:c:c")}
+
+def test_prune_contents(dbif):
+    with dbif.bulk_writer() as writer:
+        writer.add(_row("f0", b"a"))
+        writer.add(_row("f1", b"b"))
+    ids = dict(dbif.Session.query(database.MetaFile.path, database.MetaFile.id))
+    content_ids = dict(dbif.Session.query(database.MetaFile.path, database.MetaFile.content_id))
+    database.FuzzyGram.__table__.create(dbif._engine, checkfirst=True)
+    for content_id in content_ids.values():
+        dbif.Session.add(database.FuzzyGram(blocksize=3, gram=1, content_id=content_id))
+        dbif.Session.add(database.Similarity(content_id=content_id, score=90, ref_path="ref"))
+    dbif.Session.commit()
+    with dbif.bulk_writer() as writer:
+        writer.update(ids["f1"], _row("f1", b"a"))
+    assert dbif.prune_contents() == 1
+    assert _contents(dbif) == [_digests(b"a")["sha1"]]
+    # the grams and similarities of the pruned content go with it
+    assert [content_id for (content_id,) in dbif.Session.query(database.FuzzyGram.content_id)] == [content_ids["f0"]]
+    assert [content_id for (content_id,) in dbif.Session.query(database.Similarity.content_id)] == [content_ids["f0"]]
+
+LEGACY_SCHEMA = ("CREATE TABLE DbInfo (id INTEGER PRIMARY KEY, key VARCHAR(4096) NOT NULL, value VARCHAR(4096))",
+                 "CREATE TABLE MetaFiles (id INTEGER PRIMARY KEY, path VARCHAR(1024), extension VARCHAR(256), size INTEGER, "
+                 "mimetype VARCHAR(1024), magic VARCHAR(4096), md5 VARCHAR(256) NOT NULL, sha1 VARCHAR(256) NOT NULL, "
+                 "sha256 VARCHAR(256) NOT NULL, ssdeep VARCHAR(256), excluded BOOLEAN)",
+                 "CREATE TABLE ModuleRuns (id INTEGER PRIMARY KEY, name VARCHAR(4096) NOT NULL, config VARCHAR(4096) NOT NULL)",
+                 "CREATE TABLE Indicators (id INTEGER PRIMARY KEY, score INTEGER, description VARCHAR(4096), metafile_id INTEGER, modulerun_id INTEGER)")
+
+@pytest.fixture
+def legacy(tmp_path):
+    """
+    A database with schema 1, digests and magic on every MetaFile.
+    """
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    with conn:
+        for stmt in LEGACY_SCHEMA:
+            conn.execute(stmt)
+        conn.execute("INSERT INTO DbInfo (key, value) VALUES ('rootpath', '/legacy')")
+        for (mfid, path_, data) in ((3, "a", b"a"), (5, "b", b"b"), (9, "copy of a", b"a")):
+            digests = _digests(data)
+            conn.execute("INSERT INTO MetaFiles VALUES (?, ?, '', 1, 'text/plain', 'ASCII text', ?, ?, ?, NULL, 0)",
+                         (mfid, path_, digests["md5"], digests["sha1"], digests["sha256"]))
+        conn.execute("INSERT INTO ModuleRuns VALUES (1, 'score', '{}')")
+        conn.execute("INSERT INTO Indicators VALUES (1, 10, 'suspicious', 9, 1)")
+    conn.close()
+    return path
+
+def test_migrate(legacy, tmp_path):
+    assert database.DbIf("sqlite:///{}".format(legacy)).schema_version() == 1
+    with pytest.raises(Exception):
+        database.DbIf("sqlite:///{}".format(legacy)).file_states()
+    dest = str(tmp_path / "migrated.db")
+    assert migrate_db.migrate(legacy, dest, batch_size=2) == 3
+    dbif = database.DbIf("sqlite:///{}".format(dest))
+    assert dbif.assert_schema()
+    assert dbif.get_db_info()["rootpath"] == "/legacy"
+    rows = {metafile.id: (metafile.path, metafile.content.sha1.hex(), metafile.content.magic) for metafile in dbif.Session.query(database.MetaFile)}
+    assert rows == {3: ("a", _digests(b"a")["sha1"], "ASCII text"), 5: ("b", _digests(b"b")["sha1"], "ASCII text"), 9: ("copy of a", _digests(b"a")["sha1"], "ASCII text")}
+    assert len(_contents(dbif)) == 2
+    # indicators still point at the same file
+    assert dbif.indicator_scores() == [("copy of a", 10, 1, "suspicious")]
+    dbif.Session.remove()
+    with pytest.raises(Exception):
+        migrate_db.migrate(dest, str(tmp_path / "again.db"))
+
+def test_migrate_cli(legacy, tmp_path):
+    dest = str(tmp_path / "migrated.db")
+    res = subprocess.run([sys.executable, "-m", "blackswan.utils.migrate_db", legacy, dest], cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    assert res.stdout.startswith("3 records with 2 distinct contents migrated to {}".format(dest))
@@ -0,0 +1,72 @@
+__author__ = 'ivo'
+
+import os
+import time
+import sqlite3
+import hashlib
+
+from blackswan.support import digestcache
+
+BLOCK = digestcache.PREHASH_BLOCK
+ORIGINAL = b"\x7fELF" + b"\x01" * (3 * BLOCK)
+# same size, head and tail, different middle
+PATCHED = ORIGINAL[:BLOCK + 10] + b"\x90\x90" + ORIGINAL[BLOCK + 12:]
+
+def test_prehash_collides_on_the_middle(make_tree):
+    rootpath = make_tree("tree", {"a": ORIGINAL, "b": PATCHED})
+    (a, b) = (os.path.join(rootpath, "a"), os.path.join(rootpath, "b"))
+    assert digestcache.prehash_key(a, os.lstat(a)) == digestcache.prehash_key(b, os.lstat(b))
+    assert digestcache.stat_key(a, os.lstat(a)) != digestcache.stat_key(b, os.lstat(b))
+
+def test_put_get_evict(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with digestcache.DigestCache(path, maxentries=2, batch_size=2) as cache:
+        assert not cache.confirm
+        for i in range(3):
+            cache.put(b"k%d" % i, {"sha1": str(i), "magic": "data"})
+        assert cache.get(b"k2")["sha1"] == "2"
+        assert cache.get(b"nope") is None
+    with digestcache.DigestCache(path, keymode="prehash") as cache:
+        assert cache.confirm
+        assert [cache.get(b"k%d" % i) is not None for i in range(3)] == [False, True, True]
+
+def test_hits_touched_in_batches(tmp_path):
+    path = str(tmp_path / "cache.db")
+    with digestcache.DigestCache(path) as cache:
+        for i in range(10):
+            cache.put(b"k%d" % i, {"sha1": str(i)})
+    start = time.time()
+    with digestcache.DigestCache(path, batch_size=3) as cache:
+        for i in range(10):
+            assert cache.get(b"k%d" % i) is not None
+            assert len(cache._used) < 3
+        # the last use of all but the hits since the last batch is written before the cache is closed
+        conn = sqlite3.connect(path)
+        touched = conn.execute("SELECT count(*) FROM DigestCache WHERE lastused >= ?", (start,)).fetchone()[0]
+        conn.close()
+        assert touched == 9
+
+def test_prehash_hit_is_confirmed(make_tree, explore_db, run_module, metafiles, tmp_path):
+    cache = str(tmp_path / "cache.db")
+    explore_db(make_tree("genuine", {"system/bin/app_process": ORIGINAL}), "genuine.db", cache=cache, cache_key="prehash")
+
+    dbpath = str(tmp_path / "patched.db")
+    explorer = run_module("explore", rootpath=make_tree("patched", {"system/bin/app_process": PATCHED}), db=dbpath, cache=cache, cache_key="prehash")
+    assert metafiles(dbpath)["system/bin/app_process"][1] == hashlib.sha1(PATCHED).hexdigest()
+    assert explorer.metrics.counters.get("cache_conflicts") == 1
+    assert explorer.metrics.counters.get("cache_hits") is None
+
+    # the entry is now the one of the patched content
+    dbpath = str(tmp_path / "copy.db")
+    explorer = run_module("explore", rootpath=make_tree("copy", {"system/bin/app_process": PATCHED}), db=dbpath, cache=cache, cache_key="prehash")
+    assert metafiles(dbpath)["system/bin/app_process"][1] == hashlib.sha1(PATCHED).hexdigest()
+    assert explorer.metrics.counters.get("cache_hits") == 1
+
+def test_corpus_cache(make_tree, cli, metafiles, tmp_path):
+    first = make_tree("first", {"system/bin/app_process": ORIGINAL})
+    second = make_tree("second", {"system/bin/app_process32": PATCHED})
+    for key in ("stat", "prehash"):
+        dbpath = tmp_path / "corpus_{}.db".format(key)
+        res = cli("run", "corpus", "--", first, second, "--db", dbpath, "--cache", tmp_path / "cache.db", "--cache-key", key, "--processes", "1")
+        assert res.returncode == 0, res.stderr
+        assert sorted(sha1 for (_, sha1) in metafiles(str(dbpath)).values()) == sorted(hashlib.sha1(data).hexdigest() for data in (ORIGINAL, PATCHED))
@@ -0,0 +1,97 @@
+__author__ = 'ivo'
+
+import os
+import time
+import concurrent.futures
+
+import magic
+
+from blackswan.core import database
+from blackswan.modules.explore import Explore, imap_ordered
+
+from conftest import TREE
+
+def _symlinked(tree):
+    os.symlink("sh", os.path.join(tree, "system/bin/ls"))
+    os.symlink("system/bin", os.path.join(tree, "bin"))
+    return tree
+
+def test_files_in_path_order(tree):
+    _symlinked(tree)
+    files = list(Explore.files(tree))
+    relpaths = [relpath for (relpath, fullpath, sinfo) in files]
+    # file symlinks are yielded, symlinked dirs not followed
+    assert relpaths == sorted(list(TREE) + ["system/bin/ls"], key=Explore.path_key)
+    assert all(fullpath == os.path.join(tree, relpath) and sinfo.st_ino == os.lstat(fullpath).st_ino for (relpath, fullpath, sinfo) in files)
+    assert Explore.count_files(tree) == len(files)
+
+def test_files_after(tree):
+    relpaths = [relpath for (relpath, fullpath, sinfo) in Explore.files(tree)]
+    for (i, after) in enumerate(relpaths):
+        assert [relpath for (relpath, fullpath, sinfo) in Explore.files(tree, after=after)] == relpaths[i + 1:]
+    # a checkpoint that no longer exists
+    assert [relpath for (relpath, fullpath, sinfo) in Explore.files(tree, after="system/bin/zz")] == relpaths[relpaths.index("system/etc/hosts"):]
+
+def test_explore_skips_symlinks(tree, explore_db, metafiles):
+    files = metafiles(explore_db(_symlinked(tree)))
+    assert sorted(files) == sorted(TREE)
+
+def _many(count=60):
+    return {"d{:d}/f{:03d}".format(i % 5, i): bytes([i]) * (i * 97) for i in range(count)}
+
+def _ordered_paths(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return [path for (path,) in dbif.Session.query(database.MetaFile.path).order_by(database.MetaFile.id)]
+    finally:
+        dbif.Session.remove()
+
+def test_imap_ordered():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        # later items finish first
+        results = imap_ordered(executor, lambda i: time.sleep((20 - i) / 2000) or i * i, iter(range(20)), window=6)
+        assert list(results) == [i * i for i in range(20)]
+
+def test_workers_same_as_serial(make_tree, explore_db, metafiles):
+    rootpath = make_tree("many", _many())
+    serial = explore_db(rootpath, "serial.db")
+    threaded = explore_db(rootpath, "threaded.db", workers=4, batchsize=7)
+    assert metafiles(threaded) == metafiles(serial)
+    # rows are written in traversal order whatever worker finishes first
+    assert _ordered_paths(threaded) == _ordered_paths(serial) == sorted(_many(), key=Explore.path_key)
+
+def test_worker_errors_skip_the_file(make_tree, run_module, metafiles, tmp_path, monkeypatch):
+    rootpath = make_tree("many", _many(20))
+    explore_file = Explore.explore_file
+
+    def failing(self, relpath, fullpath, sinfo=None):
+        if relpath.endswith("7"):
+            raise OSError("unreadable")
+        return explore_file(self, relpath, fullpath, sinfo)
+    monkeypatch.setattr(Explore, "explore_file", failing)
+    dbpath = str(tmp_path / "errors.db")
+    explorer = run_module("explore", rootpath=rootpath, db=dbpath, workers=3)
+    assert sorted(metafiles(dbpath)) == sorted(relpath for relpath in _many(20) if not relpath.endswith("7"))
+    assert explorer.metrics.counters["errors"] == 2
+
+def _magic(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return {path: (magicstr, mimetype) for (path, magicstr, mimetype) in
+                dbif.Session.query(database.MetaFile.path, database.Content.magic, database.Content.mimetype)
+                .join(database.Content, database.MetaFile.content_id == database.Content.id)}
+    finally:
+        dbif.Session.remove()
+
+def test_magic_from_the_first_block(tree, explore_db):
+    found = _magic(explore_db(tree))
+    # the head is the whole file for these, so it identifies as the buffer of all of it
+    for (relpath, data) in TREE.items():
+        assert found[relpath] == (magic.from_buffer(data), magic.from_buffer(data, mime=True))
+    assert found["system/etc/hosts"][1] == "text/plain"
+    # one pair of handles per thread
+    assert Explore._magic_handles() == Explore._magic_handles()
+
+def test_magic_skipped(tree, explore_db):
+    found = _magic(explore_db(tree, magic_skip_ext=(".txt",), magic_max_size=1000))
+    assert [relpath for relpath in sorted(TREE) if found[relpath] == ("", "")] == ["data/local/tmp/note.txt", "system/app/Empty.txt", "system/bin/toolbox"]
@@ -0,0 +1,91 @@
+__author__ = 'ivo'
+
+import os
+import shutil
+import hashlib
+
+import pytest
+
+from blackswan.core import database
+from blackswan.modules.explore import Explore
+
+from conftest import TREE
+
+def _db_info(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return dbif.get_db_info()
+    finally:
+        dbif.Session.remove()
+
+def test_update(tree, explore_db, run_module, metafiles):
+    dbpath = explore_db(tree)
+    with open(os.path.join(tree, "system/etc/hosts"), "wb") as ofh:
+        ofh.write(b"0.0.0.0 ads\n")
+    os.remove(os.path.join(tree, "data/local/tmp/note.txt"))
+    run_module("explore", rootpath=tree, db=dbpath, update=True)
+    files = metafiles(dbpath)
+    assert sorted(files) == sorted(set(TREE) - {"data/local/tmp/note.txt"})
+    assert files["system/etc/hosts"][1] == hashlib.sha1(b"0.0.0.0 ads\n").hexdigest()
+    assert files["system/bin/sh"][1] == hashlib.sha1(TREE["system/bin/sh"]).hexdigest()
+
+def test_update_from_another_rootpath(tree, make_tree, explore_db, run_module, metafiles):
+    dbpath = explore_db(tree)
+    other = make_tree("other", {"system/bin/sh": b"other shell"})
+    with pytest.raises(Exception):
+        run_module("explore", rootpath=other, db=dbpath, update=True)
+    assert _db_info(dbpath)["rootpath"] == os.path.abspath(tree)
+    assert len(metafiles(dbpath)) == len(TREE)
+
+    run_module("explore", rootpath=other, db=dbpath, update=True, force=True)
+    assert _db_info(dbpath)["rootpath"] == os.path.abspath(other)
+    assert {path: sha1 for (path, (_, sha1)) in metafiles(dbpath).items()} == {"system/bin/sh": hashlib.sha1(b"other shell").hexdigest()}
+
+def test_update_cli_refuses_another_rootpath(tree, explore_db, cli, tmp_path):
+    dbpath = explore_db(tree)
+    moved = str(tmp_path / "moved")
+    shutil.copytree(tree, moved)
+    res = cli("run", "explore", "--", moved, "--db", dbpath, "--update")
+    assert res.returncode != 0
+    assert "another rootpath" in res.stderr
+    res = cli("run", "explore", "--", moved, "--db", dbpath, "--update", "--force")
+    assert res.returncode == 0, res.stderr
+    assert _db_info(dbpath)["rootpath"] == os.path.abspath(moved)
+
+def _interrupt_at(monkeypatch, stop):
+    explore_file = Explore.explore_file
+
+    def interrupted(self, relpath, fullpath, sinfo=None):
+        if relpath == stop:
+            raise KeyboardInterrupt()
+        return explore_file(self, relpath, fullpath, sinfo)
+    monkeypatch.setattr(Explore, "explore_file", interrupted)
+
+def test_resume(tree, run_module, metafiles, tmp_path, monkeypatch):
+    dbpath = str(tmp_path / "resumed.db")
+    relpaths = sorted(TREE, key=Explore.path_key)
+    with monkeypatch.context() as patched:
+        _interrupt_at(patched, "system/bin/sh")
+        with pytest.raises(KeyboardInterrupt):
+            run_module("explore", rootpath=tree, db=dbpath, batchsize=1)
+    # everything before the interrupted file is committed, with the checkpoint of the last one
+    infos = _db_info(dbpath)
+    assert (infos["explore_state"], infos["checkpoint"]) == ("running", "system/app/Empty.txt")
+    assert sorted(metafiles(dbpath)) == relpaths[:relpaths.index("system/bin/sh")]
+
+    explorer = run_module("explore", rootpath=tree, db=dbpath, resume=True)
+    assert explorer.metrics.counters["files"] == len(relpaths) - relpaths.index("system/bin/sh")
+    assert _db_info(dbpath)["explore_state"] == "finished"
+    assert {path: sha1 for (path, (_, sha1)) in metafiles(dbpath).items()} == {relpath: hashlib.sha1(data).hexdigest() for (relpath, data) in TREE.items()}
+    with pytest.raises(Exception):
+        run_module("explore", rootpath=tree, db=dbpath, resume=True)
+
+def test_resume_from_another_rootpath(tree, make_tree, run_module, tmp_path, monkeypatch):
+    dbpath = str(tmp_path / "resumed.db")
+    with monkeypatch.context() as patched:
+        _interrupt_at(patched, "system/bin/sh")
+        with pytest.raises(KeyboardInterrupt):
+            run_module("explore", rootpath=tree, db=dbpath, batchsize=1)
+    with pytest.raises(Exception):
+        run_module("explore", rootpath=make_tree("other", TREE), db=dbpath, resume=True)
+    assert _db_info(dbpath)["explore_state"] == "running"
@@ -0,0 +1,151 @@
+__author__ = 'ivo'
+
+import os
+import struct
+import contextlib
+import shutil
+import hashlib
+import subprocess
+
+import pytest
+
+from blackswan.support import fsimage
+
+needs_mke2fs = pytest.mark.skipif(shutil.which("mke2fs") is None, reason="mke2fs is needed to build ext4 images")
+
+# sizes around the 60 bytes of i_block and the room left for the system.data attribute in a 256 byte inode
+SIZES = (0, 10, 59, 60, 61, 100, 150, 300, 5000, 70000)
+
+def _files(count=60):
+    return {os.path.join("d{:d}".format(i % 7), "sub" if i % 3 == 0 else "", "f{:02d}".format(i)):
+            bytes((i + n) % 251 for n in range(SIZES[i % len(SIZES)])) for i in range(count)}
+
+def _digests(image):
+    return {entry.relpath: hashlib.sha1(image.open(entry.relpath).read()).hexdigest() for entry in image.entries if entry.reader is not None}
+
+def _expected(files):
+    return {relpath: hashlib.sha1(data).hexdigest() for (relpath, data) in files.items()}
+
+@pytest.fixture
+def files(make_tree):
+    files = _files()
+    return (make_tree("content", files), files)
+
+def _mke2fs(tmp_path, rootpath, *features):
+    path = str(tmp_path / "image.ext4")
+    args = ["mke2fs", "-q", "-F", "-t", "ext4", "-I", "256", "-d", rootpath]
+    if features:
+        args += ["-O", ",".join(features)]
+    subprocess.run(args + [path, "8M"], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return path
+
+def _sparse(rawpath, path, blocksize=4096):
+    """
+    Convert a raw image to an Android sparse image with raw, fill and don't care chunks.
+    """
+    with open(rawpath, "rb") as ifh:
+        raw = ifh.read()
+    chunks = []
+    for offset in range(0, len(raw), blocksize):
+        block = raw[offset:offset + blocksize]
+        if block == bytes(blocksize):
+            chunk = (fsimage.CHUNK_TYPE_DONT_CARE, b"")
+        elif block == block[:4] * (blocksize // 4):
+            chunk = (fsimage.CHUNK_TYPE_FILL, block[:4])
+        else:
+            chunk = (fsimage.CHUNK_TYPE_RAW, block)
+        if chunks and chunks[-1][0] == chunk[0] and chunk[0] != fsimage.CHUNK_TYPE_FILL:
+            chunks[-1] = (chunk[0], chunks[-1][1] + 1, chunks[-1][2] + chunk[1])
+        else:
+            chunks.append((chunk[0], 1, chunk[1]))
+    with open(path, "wb") as ofh:
+        ofh.write(struct.pack("<I4H4I", fsimage.SPARSE_MAGIC, 1, 0, 28, 12, blocksize, len(raw) // blocksize, len(chunks), 0))
+        for (chunktype, nblocks, data) in chunks:
+            ofh.write(struct.pack("<2H2I", chunktype, 0, nblocks, 12 + len(data)) + data)
+    return path
+
+def _yaffs2(files, path, chunksize=2048, sparesize=64):
+    """
+    Write the files as a yaffs2 image the way mkyaffs2image does: an object header chunk per object, then its data.
+    """
+    ids = {"": fsimage.YAFFS_OBJECTID_ROOT}
+    out = []
+
+    def chunk(objid, chunkid, data, nbytes):
+        out.append(data.ljust(chunksize, b"\xff") + struct.pack("<4I", 1, objid, chunkid, nbytes).ljust(sparesize, b"\xff"))
+
+    def header(objtype, parent, name, mode, size):
+        raw = struct.pack("<Ii2x", objtype, parent) + name.encode().ljust(256, b"\0") + b"\0\0" + struct.pack("<7Ii", mode, 1000, 1000, 1, 2, 3, size, -1)
+        objid = len(ids) + 256
+        chunk(objid, 0, raw, 0)
+        return objid
+
+    for (relpath, data) in sorted(files.items()):
+        parts = relpath.split(os.sep)
+        for i in range(1, len(parts)):
+            dirpath = os.path.join(*parts[:i])
+            if dirpath not in ids:
+                ids[dirpath] = header(fsimage.YAFFS_OBJECT_TYPE_DIRECTORY, ids[os.path.dirname(dirpath)], parts[i - 1], 0o40755, 0)
+        objid = header(fsimage.YAFFS_OBJECT_TYPE_FILE, ids[os.path.dirname(relpath)], parts[-1], 0o100644, len(data))
+        ids[relpath] = objid
+        for (i, offset) in enumerate(range(0, len(data), chunksize)):
+            chunk(objid, i + 1, data[offset:offset + chunksize], len(data[offset:offset + chunksize]))
+    with open(path, "wb") as ofh:
+        ofh.write(b"".join(out))
+    return path
+
+@needs_mke2fs
+def test_ext4(files, tmp_path):
+    (rootpath, content) = files
+    with contextlib.closing(fsimage.open_image(_mke2fs(tmp_path, rootpath))) as image:
+        assert image.imagetype == "ext4"
+        assert _digests(image) == _expected(content)
+
+@needs_mke2fs
+def test_ext4_inline_data(files, tmp_path):
+    (rootpath, content) = files
+    path = _mke2fs(tmp_path, rootpath, "inline_data")
+    assert fsimage.image_type(path) == "ext4"
+    with contextlib.closing(fsimage.open_image(path)) as image:
+        assert _digests(image) == _expected(content)
+        # the small files and dirs are inline, those over i_block partly in the system.data attribute
+        inline = [entry for entry in image.entries if image.read_inode(entry.sinfo.st_ino)[1] & fsimage.EXT4_INLINE_DATA_FL]
+        assert any(entry.sinfo.st_size > 60 for entry in inline)
+
+def test_ext4_invalid_inline_data():
+    inode = bytearray(256)
+    struct.pack_into("<H", inode, 128, 32)
+    struct.pack_into("<I", inode, 160, fsimage.EXT4_XATTR_MAGIC)
+    # system.data with a value past the end of the inode
+    struct.pack_into("<BBHIII4s", inode, 164, 4, fsimage.EXT4_XATTR_INDEX_SYSTEM, 80, 0, 40, 0, b"data")
+    with pytest.raises(fsimage.ImageError):
+        fsimage.Ext4Image.inline_data(bytes(inode))
+    struct.pack_into("<H", inode, 166, 40)
+    assert fsimage.Ext4Image.inline_data(bytes(inode)) == bytes(100)
+
+@needs_mke2fs
+def test_sparse_ext4(files, tmp_path):
+    (rootpath, content) = files
+    path = _sparse(_mke2fs(tmp_path, rootpath), str(tmp_path / "image.simg"))
+    assert fsimage.image_type(path) == "sparse ext4"
+    with contextlib.closing(fsimage.open_image(path)) as image:
+        assert _digests(image) == _expected(content)
+
+def test_yaffs2(tmp_path):
+    content = _files(20)
+    path = _yaffs2(content, str(tmp_path / "image.yaffs2"))
+    assert fsimage.image_type(path) == "yaffs2"
+    with contextlib.closing(fsimage.open_image(path)) as image:
+        assert _digests(image) == _expected(content)
+        assert {entry.sinfo.st_uid for entry in image.entries} == {1000}
+
+def test_unknown_image(tmp_path):
+    path = tmp_path / "random.img"
+    path.write_bytes(os.urandom(10000))
+    assert fsimage.image_type(str(path)) is None
+
+@needs_mke2fs
+def test_explore_inline_data_image(files, tmp_path, explore_db, metafiles):
+    (rootpath, content) = files
+    dbpath = explore_db(_mke2fs(tmp_path, rootpath, "inline_data"), image=True)
+    assert {path: sha1 for (path, (_, sha1)) in metafiles(dbpath).items()} == _expected(content)
@@ -0,0 +1,60 @@
+__author__ = 'ivo'
+
+import pathlib
+
+from blackswan import modules
+from blackswan.core import database,hashset
+
+from conftest import TREE
+
+def test_filter_type_of_explored_db(tree, explore_db):
+    # explored databases get all tables, an empty TrustedCerts included, and must still filter as reference db
+    refdb = explore_db(tree, "ref.db")
+    assert database.DbIf("sqlite:///{}".format(refdb)).has_table(database.TrustedCert.__tablename__)
+    assert modules.load("hashfilter").filter_type(refdb) == "sqlite"
+
+def test_filter_type_of_certlist(tree, explore_db, run_module, tmp_path):
+    refdb = explore_db(tree, "ref.db")
+    certs = str(tmp_path / "certs.db")
+    run_module("build_certlist", sources=[refdb], certs=certs, workers=0)
+    assert modules.load("hashfilter").filter_type(certs) == "certs"
+
+def test_filter_type_of_hashset_and_dirtree(tree, tmp_path):
+    path = str(tmp_path / "ref.hs")
+    hashset.write_hashset(path, [bytes(20)])
+    assert modules.load("hashfilter").filter_type(path) == "hashset"
+    assert modules.load("hashfilter").filter_type(tree) == "dirtree"
+
+def test_hashfilter_refdb_excludes_known_files(tree, make_tree, explore_db, run_module, metafiles):
+    refdb = explore_db(tree, "ref.db")
+    target = make_tree("target", {"system/etc/hosts": pathlib.Path(tree, "system/etc/hosts").read_bytes(),
+                                  "system/xbin/su": b"not in the reference\n"})
+    dbpath = explore_db(target, "target.db")
+    run_module("hashfilter", db=dbpath, filter=refdb)
+    files = metafiles(dbpath)
+    assert files["system/etc/hosts"][0] is True
+    assert files["system/xbin/su"][0] is False
+
+def test_exclude_by_refdb_matches_any_digest(tree, explore_db, make_tree, metafiles):
+    refdb = explore_db(tree, "ref.db")
+    dbpath = explore_db(make_tree("target", TREE), "target.db")
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    # a reference that only has the md5 right still matches
+    ref = database.DbIf("sqlite:///{}".format(refdb))
+    with ref._engine.connect() as conn:
+        trans = conn.begin()
+        conn.execute(database.Content.__table__.update().where(database.Content.__table__.c.size == 0).values(sha1=bytes(20), sha256=bytes(32)))
+        trans.commit()
+    stats = dbif.exclude_by_refdb(refdb)
+    assert (stats["sha1"], stats["md5"], stats["sha256"], stats["excluded"]) == (len(TREE) - 1, len(TREE), len(TREE) - 1, len(TREE))
+    # excluded records are not matched again
+    assert dbif.exclude_by_refdb(refdb)["excluded"] == 0
+    assert all(excluded for (excluded, sha1) in metafiles(dbpath).values())
+
+def test_hashfilter_dirtree(tree, make_tree, explore_db, run_module, metafiles, tmp_path, monkeypatch):
+    # the dir tree is explored into filter.db in the working dir
+    monkeypatch.chdir(tmp_path)
+    dbpath = explore_db(make_tree("target", dict(TREE, **{"system/xbin/su": b"not in the reference\n"})), "target.db")
+    run_module("hashfilter", db=dbpath, filter=tree)
+    assert [path for (path, (excluded, sha1)) in metafiles(dbpath).items() if not excluded] == ["system/xbin/su"]
+    assert database.DbIf("sqlite:///{}".format(tmp_path / "filter.db")).get_db_info()["rootpath"] == tree
@@ -0,0 +1,73 @@
+__author__ = 'ivo'
+
+import io
+import hashlib
+
+import pytest
+
+from blackswan.support import hashing
+
+DATA = bytes(range(256)) * 9000 + b"tail"
+
+def _expected(data, hexdigest=True):
+    return {name: (hashlib.new(name, data).hexdigest() if hexdigest else hashlib.new(name, data).digest()) for name in hashing.DIGESTS}
+
+class CountingHash(object):
+    """
+    hashlib object that counts the bytes it was fed and records the largest update.
+    """
+    def __init__(self, name):
+        self._hash = hashlib.new(name)
+        self.fed = 0
+        self.largest = 0
+
+    def update(self, data):
+        self.fed += len(data)
+        self.largest = max(self.largest, len(data))
+        self._hash.update(data)
+
+    def digest(self):
+        return self._hash.digest()
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+@pytest.fixture
+def datafile(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(DATA)
+    return str(path)
+
+@pytest.mark.parametrize("bufsize", [None, 4096, 1000])
+def test_buffered(datafile, bufsize):
+    hasher = hashing.FileHasher(bufsize=bufsize, mmap_threshold=None)
+    (digests, head) = hasher.hash_file_head(datafile, headsize=5000)
+    assert digests == _expected(DATA)
+    assert head == DATA[:5000]
+
+def test_mmap_single_pass(datafile, monkeypatch):
+    hasher = hashing.FileHasher(mmap_threshold=1)
+    hashers = []
+    monkeypatch.setattr(hasher, "_hashers", lambda: hashers.extend(CountingHash(name) for name in hasher.digests) or hashers)
+    (digests, head) = hasher.hash_file_head(datafile, hexdigest=False, headsize=100)
+    assert digests == _expected(DATA, hexdigest=False)
+    assert head == DATA[:100]
+    # every hasher saw the file once, in slices instead of one pass over the whole map each
+    assert [h.fed for h in hashers] == [len(DATA)] * len(hashing.DIGESTS)
+    assert max(h.largest for h in hashers) <= hashing.MAX_BUF_SIZE < len(DATA)
+
+def test_file_object_and_chunks():
+    hasher = hashing.FileHasher()
+    assert hasher.hash_file(io.BytesIO(DATA)) == _expected(DATA)
+    assert hasher.hash_chunks([DATA[:10], DATA[10:]]) == _expected(DATA)
+    assert hashing.hash_file(io.BytesIO(b"")) == tuple(hashlib.new(name).hexdigest() for name in hashing.DIGESTS)
+
+@pytest.mark.skipif(not hashing.fuzzy_available(), reason="no ssdeep or ppdeep")
+def test_fuzzy_same_for_mmap_and_buffered(tmp_path):
+    # small, the pure python ppdeep is slow
+    path = tmp_path / "small.bin"
+    path.write_bytes(DATA[:100000])
+    mapped = hashing.FileHasher(mmap_threshold=1, fuzzy=True).hash_file(str(path))
+    buffered = hashing.FileHasher(mmap_threshold=None, fuzzy=True).hash_file(str(path))
+    assert mapped == buffered
+    assert hashing.fuzzy_compare(mapped["ssdeep"], buffered["ssdeep"]) == 100
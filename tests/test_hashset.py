@@ -0,0 +1,66 @@
+__author__ = 'ivo'
+
+import os
+import sys
+import hashlib
+import subprocess
+
+import pytest
+
+from blackswan.core import hashset
+
+from conftest import ROOT
+
+DIGESTS = sorted(hashlib.sha1(b"%d" % i).digest() for i in range(5000))
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "ref.hs")
+    # duplicates are dropped
+    assert hashset.write_hashset(path, DIGESTS[:10] + DIGESTS[9:]) == len(DIGESTS)
+    return path
+
+def test_contains(path):
+    hs = hashset.HashSet(path)
+    try:
+        assert (len(hs), hs.name, hs.digest_size) == (len(DIGESTS), "sha1", 20)
+        assert all(digest in hs for digest in DIGESTS)
+        assert hs.contains(DIGESTS[0].hex())
+        others = [hashlib.sha1(b"other %d" % i).digest() for i in range(5000)]
+        assert not any(digest in hs for digest in others)
+        # about 1% false positives with the default 10 bits per entry
+        assert sum(1 for digest in others if hs.maybe_contains(digest)) < 150
+        assert not hs.contains(b"short") and list(hs) == DIGESTS
+    finally:
+        hs.close()
+
+def test_matches(path):
+    hs = hashset.HashSet(path)
+    try:
+        rows = [(1, DIGESTS[3].hex()), (2, hashlib.sha1(b"other").hexdigest()), (3, "not hex"), (4, DIGESTS[-1].hex())]
+        assert list(hs.matches(rows)) == [1, 4]
+    finally:
+        hs.close()
+
+def test_invalid_input(tmp_path):
+    with pytest.raises(ValueError):
+        hashset.write_hashset(str(tmp_path / "unsorted.hs"), DIGESTS[::-1])
+    with pytest.raises(ValueError):
+        hashset.write_hashset(str(tmp_path / "md5.hs"), DIGESTS, name="md5")
+    assert hashset.write_hashset(str(tmp_path / "empty.hs"), []) == 0
+    hs = hashset.HashSet(str(tmp_path / "empty.hs"))
+    assert DIGESTS[0] not in hs
+    hs.close()
+    (tmp_path / "other").write_bytes(os.urandom(100))
+    assert not hashset.is_hashset(str(tmp_path / "other"))
+    with pytest.raises(Exception):
+        hashset.HashSet(str(tmp_path / "other"))
+
+def test_export_and_filter(tree, make_tree, explore_db, run_module, metafiles, tmp_path):
+    path = str(tmp_path / "ref.hs")
+    out = subprocess.run([sys.executable, "-m", "blackswan.utils.export_hashset", explore_db(tree, "ref.db"), path, "--digest", "sha256"],
+                         cwd=ROOT, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    assert out.startswith("5 sha256 digests written")
+    dbpath = explore_db(make_tree("target", {"system/etc/hosts": b"127.0.0.1 localhost\n", "system/xbin/su": b"su"}), "target.db")
+    run_module("hashfilter", db=dbpath, filter=path)
+    assert {relpath: excluded for (relpath, (excluded, sha1)) in metafiles(dbpath).items()} == {"system/etc/hosts": True, "system/xbin/su": False}
@@ -0,0 +1,68 @@
+__author__ = 'ivo'
+
+import io
+import hashlib
+import zipfile
+
+import pytest
+import sqlalchemy as sqla
+
+from blackswan.core import database
+
+MEMBERS = {"AndroidManifest.xml": b"<manifest/>" * 30, "classes.dex": b"dex\n035\x00" + bytes(range(256)) * 20}
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for (name, data) in members.items():
+            zf.writestr(name, data)
+    return buf.getvalue()
+
+FILES = {"system/app/Settings.apk": _zip(MEMBERS), "system/app/Copy.apk": _zip(MEMBERS),
+         "system/framework/core.jar": _zip({"classes.dex": b"dex\n035\x00 core"}), "system/app/Broken.apk": b"PK\x03\x04 truncated",
+         "system/etc/hosts": b"127.0.0.1 localhost\n"}
+
+def _inspections(dbpath):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return {apkfile.path: (apkfile.member_count, apkfile.error is not None) for apkfile in dbif.Session.query(database.ApkFile)}
+    finally:
+        dbif.Session.remove()
+
+@pytest.mark.parametrize("workers", [0, 2])
+def test_inspect(make_tree, explore_db, run_module, workers):
+    dbpath = explore_db(make_tree("tree", FILES))
+    inspector = run_module("inspect_apks", db=dbpath, workers=workers)
+    # every content is inspected once, under one of its paths
+    inspections = _inspections(dbpath)
+    assert sorted(inspections.values()) == [(0, True), (1, False), (2, False)]
+    assert inspections["system/framework/core.jar"] == (1, False)
+    assert (inspector.metrics.counters["apks"], inspector.metrics.counters["errors"]) == (3, 1)
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    members = {member.name: member.sha256 for member in dbif.Session.query(database.ApkMember).filter(database.ApkMember.apk_sha256 == hashlib.sha256(FILES["system/app/Settings.apk"]).digest())}
+    dbif.Session.remove()
+    assert members == {name: hashlib.sha256(data).digest() for (name, data) in MEMBERS.items()}
+    # nothing left to inspect
+    assert run_module("inspect_apks", db=dbpath, workers=workers).metrics.counters.get("apks") is None
+
+def test_cache(make_tree, explore_db, run_module, tmp_path):
+    cache = str(tmp_path / "apks.db")
+    first = explore_db(make_tree("first", FILES), "first.db")
+    run_module("inspect_apks", db=first, workers=0, cache=cache)
+    second = explore_db(make_tree("second", {"system/app/Settings.apk": FILES["system/app/Settings.apk"], "system/app/New.apk": _zip({"a": b"a"})}), "second.db")
+    inspector = run_module("inspect_apks", db=second, workers=0, cache=cache)
+    # only the APK the cache does not know is read
+    assert inspector.metrics.counters["apks"] == 1
+    assert sorted(_inspections(second).values()) == [(1, False), (2, False)]
+    assert len(_inspections(cache)) == 4
+
+def test_inspections_without_verification_are_redone(make_tree, explore_db, run_module):
+    dbpath = explore_db(make_tree("tree", FILES))
+    run_module("inspect_apks", db=dbpath, workers=0)
+    # the signers table as it was before signatures were verified
+    engine = sqla.create_engine("sqlite:///{}".format(dbpath))
+    with engine.connect() as conn:
+        trans = conn.begin()
+        conn.execute(sqla.text("ALTER TABLE ApkSigners DROP COLUMN verified"))
+        trans.commit()
+    assert run_module("inspect_apks", db=dbpath, workers=0).metrics.counters["apks"] == 3
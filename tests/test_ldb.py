@@ -0,0 +1,69 @@
+__author__ = 'ivo'
+
+import hashlib
+
+import pytest
+
+plyvel = pytest.importorskip("plyvel")
+
+from blackswan.core import database, hashset, ldbwhitelist
+from blackswan.utils import export_hashset
+
+from conftest import TREE
+
+def _whitelist(run_module, refdb, path, **kwargs):
+    run_module("build_whitelist", sources=[refdb], ldb=path, digests=["sha1"], **kwargs)
+    return path
+
+@pytest.fixture
+def target(tree, make_tree, explore_db):
+    files = dict(TREE, **{"system/xbin/su": b"not in the reference\n"})
+    del files["system/etc/hosts"]
+    return explore_db(make_tree("target", files), "target.db")
+
+@pytest.mark.parametrize("merge", [False, True])
+def test_ldb_hashfilter(tree, target, explore_db, run_module, metafiles, tmp_path, merge):
+    ldbpath = _whitelist(run_module, explore_db(tree, "ref.db"), str(tmp_path / "wl.ldb"))
+    hashfilter = run_module("ldb_hashfilter", db=target, filter=ldbpath, merge=merge)
+    assert sorted(path for (path, (excluded, sha1)) in metafiles(target).items() if not excluded) == ["system/xbin/su"]
+    assert (hashfilter.metrics.counters["lookups"], hashfilter.metrics.counters["matches"]) == (len(TREE), len(TREE) - 1)
+
+def test_merge_join_unsorted_keys(tmp_path):
+    ldb = plyvel.DB(str(tmp_path / "keys.ldb"), create_if_missing=True)
+    for key in (b"b", b"d", b"f"):
+        ldb.put(key, key.upper())
+    items = [(key, i) for (i, key) in enumerate([b"a", b"b", b"f", b"d", b"e", b"b"])]
+    assert list(ldbwhitelist.merge_join(ldb, items)) == [(1, b"B"), (2, b"F"), (3, b"D"), (5, b"B")]
+    ldb.close()
+
+def _ldb_items(path):
+    ldb = plyvel.DB(path)
+    try:
+        return dict(ldb.iterator())
+    finally:
+        ldb.close()
+
+def test_build_whitelist_keys(tree, make_tree, explore_db, run_module, tmp_path):
+    ldbpath = str(tmp_path / "wl.ldb")
+    other = make_tree("other", {"system/bin/sh": TREE["system/bin/sh"], "system/bin/extra": b"extra"})
+    run_module("build_whitelist", sources=[explore_db(tree, "ref.db"), other], ldb=ldbpath, digests=list(database.HASH_COLUMNS), batch_size=3)
+    items = _ldb_items(ldbpath)
+    contents = list(TREE.values()) + [b"extra"]
+    assert sorted(items) == sorted(ldbwhitelist.ldb_key(hashlib.new(name, data).hexdigest(), name) for data in set(contents) for name in database.HASH_COLUMNS)
+    # the value names the source root and the path in it, one of them for a content in several sources
+    assert items[ldbwhitelist.ldb_key(hashlib.sha1(b"extra").hexdigest())] == b"other:system/bin/extra"
+    assert items[ldbwhitelist.ldb_key(hashlib.md5(TREE["system/bin/sh"]).hexdigest())] in (b"tree:system/bin/sh", b"other:system/bin/sh")
+
+    # extending a whitelist keeps its keys
+    run_module("build_whitelist", sources=[make_tree("more", {"new": b"new"})], ldb=ldbpath, digests=["sha1"])
+    assert set(_ldb_items(ldbpath)) == set(items) | {hashlib.sha1(b"new").digest()}
+
+@pytest.mark.parametrize("name", ["sha1", "md5"])
+def test_export_one_digest_type(make_tree, run_module, tmp_path, name):
+    files = {"a": b"a", "b": b"b"}
+    ldbpath = str(tmp_path / "wl.ldb")
+    run_module("build_whitelist", sources=[make_tree("tree", files)], ldb=ldbpath, digests=["sha1", "md5"])
+    assert {ldbwhitelist.key_type(key) for key in _ldb_items(ldbpath)} == {"sha1", "md5"}
+    path = str(tmp_path / "wl.hs")
+    assert hashset.write_hashset(path, export_hashset.ldb_digests(ldbpath, name), name=name) == len(files)
+    assert sorted(hashset.HashSet(path)) == sorted(hashlib.new(name, data).digest() for data in files.values())
@@ -0,0 +1,60 @@
+__author__ = 'ivo'
+
+import io
+import csv
+import sys
+import json
+import hashlib
+import subprocess
+
+import pytest
+
+plyvel = pytest.importorskip("plyvel")
+
+from blackswan.core import ldbwhitelist
+from blackswan.utils import lookup_hash
+
+from conftest import ROOT
+
+KNOWN = {name: hashlib.new(name, b"known").hexdigest() for name in ldbwhitelist.KEY_PREFIXES}
+UNKNOWN = hashlib.sha1(b"unknown").hexdigest()
+QUERIES = [KNOWN["sha1"], UNKNOWN, "nothex", KNOWN["md5"].upper(), KNOWN["sha256"]]
+
+@pytest.fixture
+def ldb(tmp_path):
+    path = str(tmp_path / "wl.ldb")
+    dbif = plyvel.DB(path, create_if_missing=True)
+    for (name, hexdigest) in KNOWN.items():
+        dbif.put(ldbwhitelist.ldb_key(hexdigest, name), "{} of known".format(name).encode())
+    dbif.close()
+    return path
+
+def _lookup(ldb, *args):
+    res = subprocess.run([sys.executable, "-m", "blackswan.utils.lookup_hash", ldb] + list(args), input="\n".join(QUERIES) + "\n",
+                         cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    return res.stdout
+
+def test_batch(ldb):
+    out = io.StringIO()
+    dbif = plyvel.DB(ldb)
+    lookup_hash.batch_lookup(dbif, io.BytesIO("\n".join(QUERIES).encode()), out, fmt="jsonl", batch_size=2)
+    dbif.close()
+    results = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [res["hash"] for res in results] == [query.lower() for query in QUERIES]
+    assert [res["value"] for res in results] == ["sha1 of known", None, None, "md5 of known", "sha256 of known"]
+    assert [res["error"] is not None for res in results] == [False, False, True, False, False]
+
+@pytest.mark.parametrize("batch", [[], ["--batch"]])
+def test_format_applies_to_single_and_batch_lookups(ldb, batch):
+    rows = list(csv.reader(io.StringIO(_lookup(ldb, "--format", "csv", *batch))))
+    assert rows[0] == ["hash", "status", "value"]
+    assert [row[1] for row in rows[1:3]] == ["found", "not found"]
+    assert rows[1][2] == "sha1 of known"
+    results = [json.loads(line) for line in _lookup(ldb, "--format", "jsonl", *batch).splitlines()]
+    assert [res["found"] for res in results[:3]] == [True, False, False]
+    assert results[2]["error"] is not None
+
+def test_single_text(ldb):
+    lines = _lookup(ldb).splitlines()
+    assert lines[:2] == ["{} found: sha1 of known".format(KNOWN["sha1"]), "{} not found!".format(UNKNOWN)]
+    assert lines[2].startswith("nothex error: ")
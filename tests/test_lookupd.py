@@ -0,0 +1,98 @@
+__author__ = 'ivo'
+
+import os
+import sys
+import time
+import shutil
+import contextlib
+import hashlib
+import tempfile
+import subprocess
+
+import pytest
+
+plyvel = pytest.importorskip("plyvel")
+
+from blackswan.core import lookupclient
+from blackswan.utils import lookupd, lookup_hash
+
+from conftest import ROOT, TREE
+
+@pytest.fixture
+def ldb(tree, explore_db, run_module, tmp_path):
+    path = str(tmp_path / "wl.ldb")
+    run_module("build_whitelist", sources=[explore_db(tree, "ref.db")], ldb=path, digests=["sha1", "md5"])
+    return path
+
+@contextlib.contextmanager
+def _serving(ldb):
+    """
+    The lookup daemon serving ldb, on a socket with a path short enough for AF_UNIX.
+    """
+    sockdir = tempfile.mkdtemp(prefix="bs")
+    path = os.path.join(sockdir, "lookupd.sock")
+    proc = subprocess.Popen([sys.executable, "-m", "blackswan.utils.lookupd", ldb, "--socket", path], cwd=ROOT)
+    try:
+        for i in range(100):
+            if lookupclient.is_service(path):
+                break
+            time.sleep(0.05)
+        yield path
+    finally:
+        proc.terminate()
+        proc.wait()
+        shutil.rmtree(sockdir, ignore_errors=True)
+
+@pytest.fixture
+def service(ldb):
+    with _serving(ldb) as path:
+        yield path
+
+def _hexdigest(data, name="sha1"):
+    return hashlib.new(name, data).hexdigest()
+
+def test_resolve(ldb, monkeypatch):
+    server = lookupd.LookupServer(ldb, lru_size=2)
+    try:
+        lines = [_hexdigest(TREE["system/bin/sh"]).encode(), b"xyz", _hexdigest(b"unknown").encode(), _hexdigest(TREE["system/etc/hosts"], "md5").upper().encode()]
+        assert server.resolve(lines) == [b"F tree:system/bin/sh\n", b"E Unsupported digest length 3\n", b"N\n", b"F tree:system/etc/hosts\n"]
+        assert len(server.lru) == 2
+        # the same answers through the merge join
+        monkeypatch.setattr(lookupd, "MERGE_THRESHOLD", 1)
+        server.lru.clear()
+        assert server.resolve(lines)[2:] == [b"N\n", b"F tree:system/etc/hosts\n"]
+        assert server.resolve(lines[:1]) == [b"F tree:system/bin/sh\n"]
+        assert server.hits == 1
+    finally:
+        server.close()
+
+def test_client(service):
+    queries = [_hexdigest(data) for data in TREE.values()] + [_hexdigest(b"unknown"), "nothex!!"]
+    with lookupclient.LookupClient(service, window=3) as client:
+        results = list(client.lookup(queries))
+        assert [hexdigest for (hexdigest, value, err) in results] == queries
+        assert [value for (hexdigest, value, err) in results[:len(TREE)]] == ["tree:" + relpath for relpath in TREE]
+        assert results[-2][1:] == (None, None) and results[-1][2] is not None
+        assert list(client.matches([(1, queries[0]), (2, queries[-2]), (3, queries[-1])])) == [1]
+
+@pytest.mark.parametrize("modname", ["hashfilter", "ldb_hashfilter"])
+def test_filter_on_service(service, modname, make_tree, explore_db, run_module, metafiles):
+    dbpath = explore_db(make_tree("target", {"system/etc/hosts": TREE["system/etc/hosts"], "system/xbin/su": b"su"}), "target.db")
+    run_module(modname, db=dbpath, filter=service)
+    assert {relpath: excluded for (relpath, (excluded, sha1)) in metafiles(dbpath).items()} == {"system/etc/hosts": True, "system/xbin/su": False}
+
+def test_non_utf8_path(tmp_path):
+    relpath = os.fsdecode(b"system/caf\xe9")
+    ldb = str(tmp_path / "latin.ldb")
+    # the value as build_whitelist writes it
+    dbif = plyvel.DB(ldb, create_if_missing=True)
+    dbif.put(hashlib.sha1(b"latin").digest(), b"latin:" + relpath.encode("utf8", errors="surrogateescape"))
+    dbif.close()
+    with _serving(ldb) as path:
+        with lookupclient.LookupClient(path) as client:
+            assert list(client.lookup([_hexdigest(b"latin")])) == [(_hexdigest(b"latin"), "latin:" + relpath, None)]
+    dbif = plyvel.DB(ldb)
+    try:
+        assert lookup_hash.resolve(dbif, [_hexdigest(b"latin")]) == {_hexdigest(b"latin"): ("latin:system/caf\ufffd", None)}
+    finally:
+        dbif.close()
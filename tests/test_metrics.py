@@ -0,0 +1,50 @@
+__author__ = 'ivo'
+
+import json
+import pstats
+import logging
+import threading
+
+from blackswan.core import database, metrics
+
+def test_counters_timers_and_gauges():
+    stats = metrics.Metrics()
+    threads = [threading.Thread(target=lambda: [stats.count("files") for i in range(1000)]) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.count("read_bytes", 3 * 1024 * 1024)
+    with stats.timer("hash"):
+        pass
+    assert list(stats.timed_iter("stat", range(3))) == [0, 1, 2]
+    for depth in (3, 8, 2):
+        stats.gauge("queue_depth", depth)
+    report = stats.report()
+    assert report["counters"] == {"files": 4000, "read_bytes": 3 * 1024 * 1024}
+    assert report["timers"]["hash"]["calls"] == 1 and report["timers"]["stat"]["calls"] == 4
+    assert report["gauges"]["queue_depth"] == {"last": 2, "max": 8}
+    summary = stats.summary()
+    assert "files 4000 (" in summary and "read_bytes 3 MB (" in summary and "queue_depth 2/8" in summary
+
+def test_metrics_stored_with_the_run(tree, explore_db):
+    dbpath = explore_db(tree, workers=2)
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    report = json.loads(dbif.get_db_info()["metrics_explore"])
+    dbif.Session.remove()
+    assert report["counters"]["files"] == 5 and report["counters"]["db_rows"] == 5
+    assert {"hash", "magic", "stat", "db_insert"} <= set(report["timers"])
+
+def test_profile(tree, explore_db, tmp_path, caplog):
+    path = str(tmp_path / "explore.prof")
+    with caplog.at_level(logging.INFO, logger=metrics.__name__):
+        explore_db(tree, profile=path)
+    assert any("explore_file" in func[2] for func in pstats.Stats(path).stats)
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("Profile:") for message in messages)
+    assert any(message.startswith("Traced memory:") for message in messages)
+
+def test_profile_cli(tree, cli, tmp_path):
+    res = cli("run", "explore", "--", tree, "--db", tmp_path / "explored.db", "--profile", "--stats-interval", "0")
+    assert res.returncode == 0, res.stderr
+    assert "Traced memory" in res.stderr
@@ -0,0 +1,64 @@
+__author__ = 'ivo'
+
+import sys
+import subprocess
+
+import pytest
+
+from blackswan import modules
+
+PLUGIN = '''from blackswan.core import modularity
+
+class Hello(modularity.ModuleBase):
+    description = "Say hello"
+    modname = "hello"
+
+    def work(self):
+        print("hello {}".format(self.config.get("name")))
+
+    @classmethod
+    def add_args(cls):
+        cls.argparser.add_argument("--name", default="world")
+'''
+
+@pytest.fixture
+def plugin(tmp_path):
+    """
+    A distribution on the path of the cli fixture that adds the hello module through an entry point.
+    """
+    (tmp_path / "myplugin").mkdir()
+    (tmp_path / "myplugin" / "__init__.py").write_text(PLUGIN)
+    (tmp_path / "myplugin-0.1.dist-info").mkdir()
+    (tmp_path / "myplugin-0.1.dist-info" / "METADATA").write_text("Metadata-Version: 2.1\nName: myplugin\nVersion: 0.1\n")
+    (tmp_path / "myplugin-0.1.dist-info" / "entry_points.txt").write_text("[{}]\nhello = myplugin:Hello\n".format(modules.ENTRY_POINT_GROUP))
+    return tmp_path
+
+def test_builtin_descriptions_match_the_classes():
+    for info in modules.BUILTIN_MODULES:
+        if info.name in ("build_whitelist", "ldb_hashfilter"):
+            pytest.importorskip("plyvel")
+        source = modules.description(modules.ModuleInfo(info.name + "_unloaded", info.entrypoint))
+        assert source is not None
+        assert source == modules.load(info.name).description
+
+def test_load():
+    explore = modules.load("explore")
+    assert explore.modname == "explore" and explore.argparser is not None
+    assert modules.load("explore") is explore
+    with pytest.raises(Exception):
+        modules.load("no_such_module")
+
+def test_listing_imports_no_modules():
+    code = ("import sys\nfrom blackswan import modules\n"
+            "assert all(modules.description(info) for info in modules.available().values())\n"
+            "print(sorted(name for name in sys.modules if name.startswith('blackswan.modules.') or name in ('sqlalchemy', 'magic')))")
+    out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    assert out.strip() == "[]"
+
+def test_plugin_module(plugin, cli):
+    res = cli("list_modules")
+    assert res.returncode == 0, res.stderr
+    assert "Say hello" in [line.split(None, 1)[1] for line in res.stdout.splitlines() if line.startswith("hello ")]
+    res = cli("run", "hello", "--", "--name", "plugin", "--stats-interval", "0")
+    assert res.returncode == 0, res.stderr
+    assert "hello plugin" in res.stdout
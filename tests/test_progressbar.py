@@ -0,0 +1,64 @@
+__author__ = 'ivo'
+
+import io
+import json
+import logging
+
+from blackswan.support import progressbar
+
+class Tty(io.StringIO):
+    def isatty(self):
+        return True
+
+def test_json_is_rate_limited():
+    out = io.StringIO()
+    pbar = progressbar.Progressbar(1000, "Exploring", unit="files", outstream=out, mode="json", interval=3600)
+    for i in range(1000):
+        pbar.update(1, nbytes=1024)
+    pbar.finish()
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    # one line when started and one when done, none for the updates in between
+    assert [(line["done"], line["count"], line["total"]) for line in lines] == [(False, 0, 1000), (True, 1000, 1000)]
+    assert lines[-1]["bytes"] == 1024 * 1000 and lines[-1]["eta"] is None and lines[-1]["unit"] == "files"
+
+def test_auto_mode():
+    assert progressbar.Progressbar(10, "Tty", outstream=Tty(), mode="auto").mode == "bar"
+    assert progressbar.Progressbar(10, "Pipe", outstream=io.StringIO(), mode="auto").mode == "log"
+
+def test_bar():
+    out = Tty()
+    pbar = progressbar.Progressbar(4, "Hashing", unit="files", outstream=out, mode="bar", interval=0)
+    pbar.update(2)
+    pbar.finish()
+    frames = out.getvalue().split("\r")
+    assert frames[0] == "Hashing\n"
+    assert "50% (2 / 4 files)" in frames[2]
+    assert "100% (2 / 4 files)" in frames[-1] and frames[-1].endswith("\n")
+
+def test_log_without_total(caplog):
+    out = io.StringIO()
+    with caplog.at_level(logging.INFO, logger=progressbar.__name__):
+        pbar = progressbar.Progressbar(None, "Counting", unit="files", outstream=out, mode="log", interval=0)
+        pbar.update(7)
+        pbar.finish()
+    assert out.getvalue() == ""
+    assert [record.getMessage().split(",")[0] for record in caplog.records] == ["Counting", "0 files", "7 files", "Counting done: 7 files"]
+
+def test_none_writes_nothing(caplog):
+    out = io.StringIO()
+    with caplog.at_level(logging.INFO, logger=progressbar.__name__):
+        pbar = progressbar.Progressbar(3, "Quiet", outstream=out, mode="none", interval=0)
+        pbar.update(3)
+        pbar.finish()
+    assert out.getvalue() == "" and not caplog.records
+
+def test_explore_json_progress(tree, cli, tmp_path):
+    # a single walk by default, without a total
+    res = cli("-p", "json", "run", "explore", "--", tree, "--db", tmp_path / "explored.db")
+    assert res.returncode == 0, res.stderr
+    lines = [json.loads(line) for line in res.stdout.splitlines()]
+    assert lines[-1]["done"] and (lines[-1]["count"], lines[-1]["total"]) == (5, None)
+    res = cli("-p", "json", "run", "explore", "--", tree, "--db", tmp_path / "counted.db", "--precount", "names")
+    assert res.returncode == 0, res.stderr
+    lines = [json.loads(line) for line in res.stdout.splitlines()]
+    assert lines[-1]["done"] and (lines[-1]["count"], lines[-1]["total"]) == (5, 5)
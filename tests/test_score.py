@@ -0,0 +1,75 @@
+__author__ = 'ivo'
+
+import os
+import json
+
+import pytest
+
+from blackswan.core import database, rules
+
+FILES = {"system/xbin/su": b"\x7fELF su", "system/bin/sh": b"#!/system/bin/sh\n", "system/app/Evil.apk": b"PK\x03\x04",
+         "data/local/tmp/.hidden": b"hidden", "data/local/tmp/run.sh": b"#!/system/bin/sh\nid\n", "system/etc/hosts": b"127.0.0.1 localhost\n"}
+
+@pytest.fixture
+def scored_tree(make_tree):
+    rootpath = make_tree("image", FILES)
+    os.chmod(os.path.join(rootpath, "system/xbin/su"), 0o4755)
+    os.chmod(os.path.join(rootpath, "data/local/tmp/run.sh"), 0o755)
+    os.chmod(os.path.join(rootpath, "system/etc/hosts"), 0o644)
+    return rootpath
+
+def _scores(dbpath, **kwargs):
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    try:
+        return {path: (score, count) for (path, score, count, descriptions) in dbif.indicator_scores(**kwargs)}
+    finally:
+        dbif.Session.remove()
+
+def test_invalid_rules():
+    for spec in ({"name": "x", "score": "high", "match": {"owner": "root"}},
+                 {"name": "x", "score": "high", "match": {"path_regex": "("}},
+                 {"name": "x", "score": "high", "match": {"mode_all": ["suid"]}},
+                 {"name": "x", "match": {"path": "*"}},
+                 {"name": "x", "score": "extreme", "match": {}}):
+        with pytest.raises(rules.RuleError):
+            rules.Rule(spec)
+    assert all(rule.pushdown != ("path_regex" in spec["match"]) for (rule, spec) in zip(rules.load_rules(), rules.DEFAULT_RULES))
+
+def test_default_rules(scored_tree, explore_db, run_module):
+    dbpath = explore_db(scored_tree)
+    run_module("score", db=dbpath, batch_size=2)
+    high = rules.SCORES["high"]
+    assert _scores(dbpath) == {"system/xbin/su": (2 * high, 2), "system/app/Evil.apk": (rules.SCORES["low"], 1),
+                               "data/local/tmp/.hidden": (rules.SCORES["low"], 1), "data/local/tmp/run.sh": (rules.SCORES["low"], 1)}
+    assert _scores(dbpath, min_score=high, limit=1) == {"system/xbin/su": (2 * high, 2)}
+
+def test_rules_file_and_runs(scored_tree, explore_db, run_module, tmp_path):
+    dbpath = explore_db(scored_tree)
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps([{"name": "shell_script", "score": 7, "match": {"magic_regex": "sh script", "path": ["data/*", "system/*"]}},
+                                {"name": "hosts", "score": -3, "match": {"path": "system/etc/hosts", "mode_all": "644", "whitelisted": False}}]))
+    run_module("score", db=dbpath, rules=str(path), batch_size=1)
+    expected = {"system/bin/sh": (7, 1), "data/local/tmp/run.sh": (7, 1), "system/etc/hosts": (-3, 1)}
+    assert _scores(dbpath) == expected
+    # a new run replaces the indicators of the previous one unless they are kept
+    run_module("score", db=dbpath, rules=str(path))
+    assert _scores(dbpath) == expected
+    run_module("score", db=dbpath, rules=str(path), keep=True)
+    assert _scores(dbpath) == {relpath: (2 * score, 2) for (relpath, (score, count)) in expected.items()}
+
+    path.write_text(json.dumps([{"name": "a", "score": 1, "match": {}}, {"name": "a", "score": 2, "match": {}}]))
+    with pytest.raises(rules.RuleError):
+        run_module("score", db=dbpath, rules=str(path))
+
+def test_cli(scored_tree, explore_db, cli):
+    dbpath = explore_db(scored_tree)
+    res = cli("run", "score", "--", "--dump-rules")
+    assert res.returncode == 0, res.stderr
+    assert json.loads(res.stdout) == rules.DEFAULT_RULES
+    assert cli("run", "score", "--", "--db", dbpath).returncode == 0
+    res = cli("list_indicators", "--db", dbpath, "--limit", "2")
+    assert res.returncode == 0, res.stderr
+    lines = res.stdout.splitlines()
+    assert len(lines) == 2
+    assert lines[0].split()[:3] == [str(2 * rules.SCORES["high"]), "2", "system/xbin/su"]
+    assert "su binary" in lines[0] and "Setuid file not in the whitelist" in lines[0]
@@ -0,0 +1,37 @@
+__author__ = 'ivo'
+
+import random
+
+import pytest
+
+from blackswan.core import database, fuzzyindex
+from blackswan.support import hashing
+
+def _text(seed, size=20000):
+    rnd = random.Random(seed)
+    words = ["system", "binder", "service", "vendor", "init", "property", "socket", "zygote", "surface", "audio"]
+    return " ".join(rnd.choice(words) + str(rnd.randrange(1000)) for i in range(size // 10)).encode()[:size]
+
+def test_grams():
+    keys = fuzzyindex.grams("3:abcdefgh:ABCDEFGH")
+    assert keys == {(3, fuzzyindex._gram_value("abcdefg")), (3, fuzzyindex._gram_value("bcdefgh")),
+                    (6, fuzzyindex._gram_value("ABCDEFG")), (6, fuzzyindex._gram_value("BCDEFGH"))}
+    # runs of equal characters count as three, like ssdeep compares them
+    assert fuzzyindex.grams("3:aaaaaaaaabcdefg:") == fuzzyindex.grams("3:aaabcdefg:")
+    # the double block size signature of one hash is keyed like the signature of the next block size
+    assert fuzzyindex.grams("3::ABCDEFGH") & fuzzyindex.grams("6:ABCDEFGH:")
+    assert fuzzyindex.grams("not ssdeep") == set()
+
+@pytest.mark.skipif(not hashing.fuzzy_available(), reason="no ssdeep or ppdeep")
+def test_similar(make_tree, explore_db, run_module, tmp_path):
+    original = _text(1)
+    patched = original[:9000] + b"patched by someone" + original[9018:]
+    refdb = explore_db(make_tree("reference", {"system/bin/original": original, "system/bin/other": _text(2)}), "ref.db", ssdeep=True)
+    dbpath = explore_db(make_tree("target", {"system/bin/patched": patched, "system/bin/unrelated": _text(3)}), "target.db", ssdeep=True)
+    similar = run_module("similar", db=dbpath, reference=refdb)
+    dbif = database.DbIf("sqlite:///{}".format(dbpath))
+    rows = [(similarity.ref_path, similarity.score) for similarity in dbif.Session.query(database.Similarity)]
+    dbif.Session.remove()
+    assert [(ref_path, score >= 80) for (ref_path, score) in rows] == [("system/bin/original", True)]
+    assert similar.metrics.counters["lookups"] == 2 and similar.metrics.counters["matches"] == 1
+    assert database.DbIf("sqlite:///{}".format(refdb)).has_fuzzy_index()